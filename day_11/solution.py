@@ -19,11 +19,6 @@ class RobotDirections(Enum):
     DOWN = 4
 
 
-class RobotOutputState(Enum):
-    COLOR = 0
-    DIRECTION = 1
-
-
 class EmergencyHullPaintingRobotControl(ObserverMixin):
     @property
     def robot_position(self):
@@ -53,12 +48,12 @@ class EmergencyHullPaintingRobotControl(ObserverMixin):
         )
         self._robot_current_direction = RobotDirections.UP.value
         self._robot_current_position = {'x': 0, 'y': 0}
-        self._robot_output_state = RobotOutputState.COLOR.value
 
     def run_program(self):
         self._computer.load_program(self._program)
         self.subscribe(self._computer.input_buffer, self.provide_input)
-        self.subscribe(self._computer.output_buffer, self.get_output)
+        self.subscribe(self._computer.output_buffer, self.get_output,
+                       record_width=2)
 
         self._computer.run_program()
 
@@ -69,21 +64,11 @@ class EmergencyHullPaintingRobotControl(ObserverMixin):
         self._computer.send_input_data(color)
 
     def get_output(self, output):
-        """Get the color or the turn direction from the computer program
-        depending on what it produces and update robot position"""
-        if self._robot_output_state == RobotOutputState.COLOR.value:
-            color = output
-            self.update_panel_state(color)
-        else:
-            turn_direction = output
-            self.update_robot_position(turn_direction)
-        self.switch_robot_output_state()
-
-    def switch_robot_output_state(self):
-        if self._robot_output_state == RobotOutputState.COLOR.value:
-            self._robot_output_state = RobotOutputState.DIRECTION.value
-        else:
-            self._robot_output_state = RobotOutputState.COLOR.value
+        """Get the (color, turn direction) pair from the computer program,
+        paint the panel and update robot position"""
+        color, turn_direction = output
+        self.update_panel_state(color)
+        self.update_robot_position(turn_direction)
 
     def check_current_panel_color(self):
         """Get the color of a panel the robot is currently over"""
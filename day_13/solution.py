@@ -1,10 +1,12 @@
-from enum import Enum, IntEnum, unique
+from enum import Enum, unique
 
-from collections import defaultdict, deque
+from collections import defaultdict
 from intcode_computer import IntcodeComputer, parse_program
 from utils import ObserverMixin
 
 INPUT_FILE = './inputs/task_13_input.txt'
+# tiles drawn at once
+TILE_BATCH_SIZE = 256
 
 
 @unique
@@ -16,17 +18,7 @@ class TileID(Enum):
     BALL = 4
 
 
-class OutputState(IntEnum):
-    X_POS = 0
-    Y_POS = 1
-    TILE_ID = 2
-
-
 class TileScreen(ObserverMixin):
-    @property
-    def output_state(self):
-        return self._program_output_state[0]
-
     @property
     def blocks(self):
         return self._blocks
@@ -35,27 +27,17 @@ class TileScreen(ObserverMixin):
         self._computer = computer
         self._program = program
         self._blocks = defaultdict(lambda: TileID.EMPTY.value)
-        self._program_output_state = deque(map(int, OutputState))
-        self._x_buffer = None
-        self._y_buffer = None
-
-    def switch_output_state(self):
-        self._program_output_state.rotate(-1)
 
     def run_program(self):
         self._computer.load_program(self._program)
-        self.subscribe(self._computer.output_buffer, self.get_output)
+        self.subscribe(self._computer.output_buffer, self.get_output,
+                       record_width=3, flush_size=TILE_BATCH_SIZE)
         self._computer.run_program()
 
-    def get_output(self, value):
-        if self.output_state == OutputState.X_POS.value:
-            self._x_buffer = value
-        elif self.output_state == OutputState.Y_POS.value:
-            self._y_buffer = value
-        else:
-            self._blocks[(self._x_buffer, self._y_buffer)] = value
-
-        self.switch_output_state()
+    def get_output(self, tiles):
+        """Draw the batch of the (x, y, tile_id) tiles"""
+        for x, y, tile_id in tiles:
+            self._blocks[(x, y)] = tile_id
 
 
 def solution():
@@ -1,21 +1,12 @@
 # --- Day 2: 1202 Program Alarm Part Two---
-from intcode_computer import IntcodeComputer, parse_program
+from intcode_computer import SymbolicExecutor, parse_program
 
 INPUT_FILE = './inputs/task_2_part_2_input.txt'
 
 DESIRED_RESULT = 19690720
 
-
-def run_the_magic_program(input_sequence, noun, verb):
-    # create a copy of input_sequence to make sure we don't change the
-    # original one
-    input_sequence_copy = input_sequence.copy()
-    input_sequence_copy[1] = noun
-    input_sequence_copy[2] = verb
-
-    command_invoker = IntcodeComputer(program=input_sequence_copy)
-    command_invoker.run_program()
-    return command_invoker.get_memory_state()[0]
+NOUN_ADDRESS = 1
+VERB_ADDRESS = 2
 
 
 def solution(desired_result=DESIRED_RESULT):
@@ -23,13 +14,15 @@ def solution(desired_result=DESIRED_RESULT):
     input_file = Path(INPUT_FILE)
 
     program = parse_program(input_file)
-
-    for noun in range(100):
-        for verb in range(100):
-            program_result = run_the_magic_program(program, noun, verb)
-
-            if program_result == desired_result:
-                return (100 * noun) + verb
+    # the program is executed once with the noun and the verb as symbols,
+    # the result is then solved for them instead of trying every pair
+    executor = SymbolicExecutor(program,
+                                symbolic_cells={NOUN_ADDRESS: 'noun',
+                                                VERB_ADDRESS: 'verb'})
+    ranges = {'noun': range(100), 'verb': range(100)}
+
+    for assignment in executor.solve(0, desired_result, ranges):
+        return (100 * assignment['noun']) + assignment['verb']
     # if we reach this point then we haven't found the solution
     raise Exception("The solutions hasn't been found")
 
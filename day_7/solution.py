@@ -1,69 +1,40 @@
 # --- Day 7: Amplification Circuit ---
 import itertools
 
-from utils import ObserverMixin
-from intcode_computer import IntcodeComputer, parse_program
+from intcode_computer import IntcodeComputer, Scheduler, parse_program
 
 INPUT_FILE = './inputs/task_7_input.txt'
 
+AMPLIFIER_NAMES = ('A', 'B', 'C', 'D', 'E')
 
-class Amplifier(ObserverMixin):
-    @property
-    def computer(self):
-        return self._computer
-
-    @property
-    def phase_setting(self):
-        return self._phase_setting
-
-    @phase_setting.setter
-    def phase_setting(self, value):
-        self._phase_setting = value
-
-    @property
-    def input_signal(self):
-        return self._input_signal
-
-    @input_signal.setter
-    def input_signal(self, value):
-        self._input_signal = value
-
-    def __init__(self, computer, program, phase_setting=None):
-        self._computer = computer
-        self._phase_setting = phase_setting
-        self._input_signal = 0
-        self._program = program
-        self._successor = None
-        # states of the amplifier
-        self._is_phase_setting_provided = False
-
-    def set_successor(self, amp):
-        self._successor = amp
-
-    def get_output_signal(self):
-        self.computer.load_program(self._program.copy())
-        self.subscribe(self.computer.input_buffer, self.provide_amp_data)
-        self.computer.run_program()
-        self.unsubscribe(self.computer.input_buffer)
-
-        output_signal = self.computer.output_buffer.value
-
-        if self._successor is not None:
-            self._successor.input_signal = output_signal
-            return self._successor.get_output_signal()
-        else:
-            return output_signal
-
-    def provide_amp_data(self, value):
-        """Observer callback to provide the phase config or input_signal
-         when input is requested by the computer"""
-        if value:
-            if not self._is_phase_setting_provided:
-                self.computer.send_input_data(self.phase_setting)
-                self._is_phase_setting_provided = True
-            else:
-                self.computer.send_input_data(self.input_signal)
-                self._is_phase_setting_provided = False
+
+def create_amplifiers(computer):
+    """Create the network of the amplifiers chained one after another, every
+    one of them running its own fork of the computer"""
+    scheduler = Scheduler()
+    for name in AMPLIFIER_NAMES:
+        scheduler.add(name, computer.fork())
+    for source, target in zip(AMPLIFIER_NAMES, AMPLIFIER_NAMES[1:]):
+        scheduler.connect(source, target)
+    return scheduler
+
+
+def get_output_signal(scheduler, program, phase_config, input_signal=0):
+    """Run the chain of the amplifiers from the start of the program, passing
+    the output of each one to the input of the next one"""
+    assert len(AMPLIFIER_NAMES) == len(phase_config), \
+        'Number of amplifier does not correspond to the configuration provided'
+
+    # the network is built once and only reloaded for every configuration
+    scheduler.reset()
+    for name, phase_setting in zip(AMPLIFIER_NAMES, phase_config):
+        computer = scheduler.computer(name)
+        computer.load_program(list(program))
+        computer.relative_base = 0
+        scheduler.send(name, [phase_setting])
+    scheduler.send(AMPLIFIER_NAMES[0], [input_signal])
+    scheduler.run()
+    return scheduler.outputs(AMPLIFIER_NAMES[-1])[-1]
 
 
 def solution():
@@ -71,48 +42,21 @@ def solution():
     input_file = Path(INPUT_FILE)
 
     program = parse_program(input_file)
-    computer = IntcodeComputer(program=None)
-
-    amp_A = Amplifier(computer, program)
-    amp_B = Amplifier(computer, program)
-    amp_C = Amplifier(computer, program)
-    amp_D = Amplifier(computer, program)
-    amp_E = Amplifier(computer, program)
-
-    # compose the Chain of Responsibility
-    amp_A.set_successor(amp_B)
-    amp_B.set_successor(amp_C)
-    amp_C.set_successor(amp_D)
-    amp_D.set_successor(amp_E)
+    computer = IntcodeComputer(program=program)
+    scheduler = create_amplifiers(computer)
 
     base_config = [0, 1, 2, 3, 4]    # basic configuration
-    amp_list = [amp_A, amp_B, amp_C, amp_D, amp_E]
 
     signal_outputs = []
     for phase_config in itertools.permutations(base_config, len(base_config)):
-        set_phases(amp_list, phase_config)
-        signal_outputs.append(amp_A.get_output_signal())
+        signal_outputs.append(
+            get_output_signal(scheduler, program, phase_config))
 
     return max(signal_outputs)
 
 
-def set_phases(amp_list, config):
-    assert len(amp_list) == len(config), \
-        'Number of amplifier does not correspond to the configuration provided'
-
-    for index, amp in enumerate(amp_list):
-        amp.phase_setting = config[index]
-
-
 if __name__ == '__main__':
     import os
     os.chdir('..')
 
     print(solution())
-
-
-
-
-
-
-
@@ -1,9 +1,31 @@
 from .buffers import Buffer, InputBuffer, OutputBuffer
+from .channels import Channel, ChannelFull, ChannelEmpty
 from .command_parameters import CommandParameter, ParameterModes
 from .commands import OpCodeExtended, ExtendedCommand, JumpIfTrueCommand, \
     JumpIfFalseCommand, LessThanCommand, EqualsCommand, OutputCommand, \
     InputCommand, MultiplyCommand, AddCommand, AdjustRelativeBaseCommand
 from .utils import parse_program
-from .memory import Memory, DynamicMemory
-from .computer import IntcodeComputer
+from .decode_cache import DecodeCache
+from .program_image import ProgramImage, write_program_image, \
+    read_program_image, load_program_image
+from .memory import Memory, DynamicMemory, TypedMemory, PagedMemory, \
+    ImageMemory, MemoryTypes
+from .engines import EngineTypes, StopReasons
+from .block_compiler import BlockCompiler, CompiledBlockCache
+from .loop_accelerator import LoopAccelerator
+from .profiler import ExecutionProfile
+from .tracer import TraceRecorder, TraceRecord, TraceFile, read_trace
+from .output_history import HistoryPolicies, DisabledHistory, \
+    RingHistory, TypedHistory, SpillHistory
+from .computer import IntcodeComputer, IOResult
+from .scheduler import Scheduler, SchedulerStates, VMStates, VMStats
 
+from .optimizer import PeepholeOptimizer, optimize_program, \
+    verify_equivalence
+from .input_explorer import InputExplorer, ExplorationResult
+from .batch import Variant, BatchResult, run_batch, run_variant
+from .lockstep import LockstepMachine, run_lockstep
+from .symbolic import SymbolicExecutor, SymbolicPath, Polynomial, \
+    SymbolicExecutionError
+from .result_cache import ResultCache, CachedResult, run_cached, \
+    result_key
@@ -0,0 +1,193 @@
+"""Batch runner which executes many independent variants of one program in a
+pool of worker processes.
+
+The program is sent to every worker once, when the worker starts, or mapped
+by the workers if it is given as a ProgramImage. Variants
+are then sent in chunks and their results are streamed back:
+
+    variants = (Variant({1: noun, 2: verb}, ())
+                for noun in range(100) for verb in range(100))
+    for result in run_batch(program, variants, observed_cells=(0,),
+                            chunk_size=100,
+                            stop_when=lambda r: r.cells[0] == 19690720):
+        ...
+"""
+import itertools
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from utils import ObserverMixin
+from intcode_computer.computer import IntcodeComputer
+from intcode_computer.engines import EngineTypes
+from intcode_computer.memory import MemoryTypes
+from intcode_computer.program_image import ProgramImage
+
+# variants sent to a worker at once by default
+DEFAULT_CHUNK_SIZE = 16
+# chunks waiting for a free worker, per worker
+_CHUNKS_IN_FLIGHT_PER_WORKER = 2
+# chunks the ordered results may run ahead of the oldest unfinished one,
+# per worker, the results of the finished ones wait for their turn
+_CHUNKS_AHEAD_PER_WORKER = 4
+
+Variant = namedtuple('Variant', 'patches inputs')
+BatchResult = namedtuple('BatchResult',
+                         'index variant outputs cells halted')
+
+# computer with the program loaded in the worker process, every variant
+# runs on its fork
+_worker_computer = None
+_worker_observed_cells = ()
+
+
+class _InputsExhausted(Exception):
+    """Raised when the program requests more input values than the variant
+    has"""
+
+
+class _VariantInput(ObserverMixin):
+    """Supplies the input values of the variant to the computer"""
+    def __init__(self, computer, inputs):
+        self._computer = computer
+        self._inputs = iter(inputs)
+        self.subscribe(computer.input_buffer, self.provide_input)
+
+    def provide_input(self, value):
+        if value:
+            try:
+                self._computer.send_input_data(next(self._inputs))
+            except StopIteration:
+                raise _InputsExhausted() from None
+
+
+def _init_worker(program, engine, memory_type, observed_cells):
+    global _worker_computer, _worker_observed_cells
+    _worker_computer = IntcodeComputer(program, engine=engine,
+                                       memory_type=memory_type)
+    _worker_observed_cells = observed_cells
+
+
+def run_with_inputs(computer, inputs):
+    """
+    Run the computer supplying it with the input values
+    :return: True if the program has halted, False if it has requested more
+    input values than given
+    """
+    feeder = _VariantInput(computer, inputs)
+    try:
+        computer.run_program()
+        return True
+    except _InputsExhausted:
+        return False
+    finally:
+        feeder.unsubscribe(computer.input_buffer)
+
+
+def run_variant(computer, variant, observed_cells=()):
+    """
+    Run the variant on the fork of the computer
+    :return: (outputs, cells, halted) tuple, where cells is the mapping of
+    the observed addresses to their final values and halted is False if the
+    program has requested more input values than the variant has
+    """
+    computer = computer.fork()
+    for address, value in variant.patches.items():
+        computer.memory[address] = value
+    halted = run_with_inputs(computer, variant.inputs)
+    cells = {address: computer.memory[address] for address in observed_cells}
+    return list(computer.output_history), cells, halted
+
+
+def _run_chunk(chunk):
+    return [BatchResult(index, variant,
+                        *run_variant(_worker_computer, variant,
+                                     _worker_observed_cells))
+            for index, variant in chunk]
+
+
+def _chunks(variants, chunk_size):
+    indexed_variants = enumerate(variants)
+    while True:
+        chunk = list(itertools.islice(indexed_variants, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def run_batch(program, variants, max_workers=None,
+              chunk_size=DEFAULT_CHUNK_SIZE, ordered=True, stop_when=None,
+              engine=EngineTypes.FAST.value,
+              memory_type=MemoryTypes.LIST.value, observed_cells=()):
+    """
+    Run every variant of the program in the pool of worker processes
+    :param program: list of the program values or a ProgramImage, which the
+    workers map instead of receiving a copy of the program. The IMAGE
+    memory is used for the image
+    :param variants: iterable of Variant objects, it is consumed lazily
+    :param max_workers: number of the worker processes
+    :param chunk_size: number of the variants sent to a worker at once
+    :param ordered: yield the results in the order of the variants if True,
+    as soon as they are ready otherwise. The ordered results run at most a
+    few chunks per worker ahead of the oldest unfinished chunk, so the
+    results waiting for their turn stay bounded
+    :param stop_when: predicate called with every result, once it returns
+    True the result is yielded and the remaining variants are cancelled
+    :param observed_cells: addresses of the memory cells to report
+    :return: generator of BatchResult objects
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if isinstance(program, ProgramImage):
+        memory_type = MemoryTypes.IMAGE.value
+    else:
+        program = list(program)
+    executor = ProcessPoolExecutor(
+        max_workers=max_workers, initializer=_init_worker,
+        initargs=(program, engine, memory_type, tuple(observed_cells)))
+    chunks = _chunks(variants, chunk_size)
+    max_in_flight = max_workers * _CHUNKS_IN_FLIGHT_PER_WORKER
+    max_ahead = max_workers * _CHUNKS_AHEAD_PER_WORKER
+    in_flight = {}
+    # results of the chunks completed ahead of their turn, by chunk number
+    completed = {}
+    next_chunk = 0
+    submitted = 0
+
+    try:
+        while True:
+            while len(in_flight) < max_in_flight and \
+                    (not ordered or submitted - next_chunk < max_ahead):
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                in_flight[executor.submit(_run_chunk, chunk)] = submitted
+                submitted += 1
+            if not in_flight:
+                return
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            ready = []
+            for future in done:
+                chunk_number = in_flight.pop(future)
+                if ordered:
+                    completed[chunk_number] = future.result()
+                else:
+                    ready.extend(future.result())
+            while next_chunk in completed:
+                ready.extend(completed.pop(next_chunk))
+                next_chunk += 1
+
+            for result in ready:
+                yield result
+                if stop_when is not None and stop_when(result):
+                    return
+    finally:
+        # the chunks still waiting for a worker are dropped on an early exit
+        for future in in_flight:
+            future.cancel()
+        if sys.version_info >= (3, 9):
+            executor.shutdown(wait=True, cancel_futures=True)
+        else:
+            executor.shutdown(wait=True)
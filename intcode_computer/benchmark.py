@@ -0,0 +1,481 @@
+"""Micro-benchmarks of the IntcodeComputer. Synthetic programs stress every
+instruction with every parameter mode, the relative base, the far memory
+addresses, the input/output exchange and the self-modifying code, the day
+programs from the inputs folder add the real workloads. Every workload is
+run on the engines and memory backends and reported as JSON:
+
+    python -m intcode_computer.benchmark --output results.json
+    python -m intcode_computer.benchmark --compare results.json
+
+The latency of the single instructions is not timed, that would measure the
+timer. The percentiles are taken over the mean instruction latencies of the
+repeated runs.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+
+from intcode_computer.commands import OpCodeExtended
+from intcode_computer.command_parameters import ParameterModes
+from intcode_computer.computer import IntcodeComputer
+from intcode_computer.conformance import CONFORMANCE_CASES, INPUTS_FOLDER, \
+    INSTRUMENTED_ENGINES, ScriptedInput, create_computer, \
+    supported_configurations, configuration_name
+from intcode_computer.engines import EngineTypes
+from intcode_computer.memory import MemoryTypes
+from intcode_computer.program_image import write_program_image
+from intcode_computer.result_cache import implementation_fingerprint
+from intcode_computer.utils import parse_program
+
+# loop iterations of the synthetic programs by default
+DEFAULT_ITERATIONS = 2000
+# timed runs of every workload by default
+DEFAULT_REPEAT = 5
+# copies of the stressed instruction in the loop body
+BODY_REPEAT = 16
+# first address of the data of the synthetic programs, the code is below it
+DATA_ADDRESS = 1000
+# distance between the cells written by the far addresses workload
+FAR_ADDRESS_STRIDE = 1021
+LATENCY_PERCENTILES = (50, 90, 99)
+REPORT_VERSION = 1
+
+Workload = namedtuple('Workload', 'name program inputs')
+BenchmarkResult = namedtuple('BenchmarkResult',
+                             'workload engine memory_type instructions '
+                             'instructions_per_second latency_ns '
+                             'construction_ns peak_memory')
+
+_POSITION = ParameterModes.POSITION.value
+_IMMEDIATE = ParameterModes.IMMEDIATE.value
+_RELATIVE = ParameterModes.RELATIVE.value
+
+# data cells of the synthetic programs, relative to DATA_ADDRESS
+_COUNTER = 0
+_FIRST_OPERAND = 1
+_SECOND_OPERAND = 2
+_RESULT = 3
+_ZERO = 4
+_PLUS_ONE = 5
+_MINUS_ONE = 6
+_JUMP_TARGETS = 16
+
+
+def _instruction(op_code, modes, *params):
+    extended_opcode = op_code.value
+    for index, mode in enumerate(modes):
+        extended_opcode += mode * 10 ** (index + 2)
+    return [extended_opcode] + list(params)
+
+
+def _parameter(mode, offset, immediate_value):
+    """Return the parameter reading the data cell at the offset in the
+    mode, the relative base points to DATA_ADDRESS"""
+    if mode == _POSITION:
+        return DATA_ADDRESS + offset
+    if mode == _RELATIVE:
+        return offset
+    return immediate_value
+
+
+def _loop_program(body, iterations, data=None):
+    """
+    Build the program repeating the body the number of iterations. The
+    relative base points to DATA_ADDRESS when the body starts
+    :param body: function returning the list of the body cells for the
+    address the body starts at
+    :param data: mapping of the data offsets to their initial values
+    """
+    program = _instruction(OpCodeExtended.ADJUST_REL_BASE, (_IMMEDIATE,),
+                           DATA_ADDRESS)
+    loop_address = len(program)
+    program += body(loop_address)
+    counter = DATA_ADDRESS + _COUNTER
+    program += _instruction(OpCodeExtended.ADD, (_POSITION, _IMMEDIATE),
+                            counter, -1, counter)
+    program += _instruction(OpCodeExtended.JUMP_IF_TRUE,
+                            (_POSITION, _IMMEDIATE), counter, loop_address)
+    program.append(OpCodeExtended.TERM.value)
+    if len(program) > DATA_ADDRESS:
+        raise ValueError('The code does not fit below the data')
+
+    cells = {_COUNTER: iterations, _FIRST_OPERAND: 3, _SECOND_OPERAND: 5,
+             _ZERO: 0, _PLUS_ONE: 1, _MINUS_ONE: -1}
+    cells.update(data or {})
+    program += [0] * (DATA_ADDRESS + max(cells) + 1 - len(program))
+    for offset, value in cells.items():
+        program[DATA_ADDRESS + offset] = value
+    return program
+
+
+def _binary_workload(op_code, mode, iterations):
+    output_mode = _RELATIVE if mode == _RELATIVE else _POSITION
+    instruction = _instruction(
+        op_code, (mode, mode, output_mode),
+        _parameter(mode, _FIRST_OPERAND, 3),
+        _parameter(mode, _SECOND_OPERAND, 5),
+        _parameter(output_mode, _RESULT, None))
+    return _loop_program(lambda address: instruction * BODY_REPEAT,
+                         iterations)
+
+
+def _jump_workload(op_code, mode, iterations):
+    """The jumps are taken, each to the next instruction"""
+    condition = _FIRST_OPERAND if op_code == OpCodeExtended.JUMP_IF_TRUE \
+        else _ZERO
+    condition_value = 3 if op_code == OpCodeExtended.JUMP_IF_TRUE else 0
+    targets = {}
+
+    def body(address):
+        cells = []
+        for index in range(BODY_REPEAT):
+            target = address + 3 * (index + 1)
+            targets[_JUMP_TARGETS + index] = target
+            cells += _instruction(
+                op_code, (mode, mode),
+                _parameter(mode, condition, condition_value),
+                _parameter(mode, _JUMP_TARGETS + index, target))
+        return cells
+
+    program = _loop_program(body, iterations)
+    for offset, target in targets.items():
+        program += [0] * (DATA_ADDRESS + offset + 1 - len(program))
+        program[DATA_ADDRESS + offset] = target
+    return program
+
+
+def _adjust_relative_base_workload(mode, iterations):
+    """Pairs of the +1 and -1 adjustments keep the relative base in place"""
+    if mode == _RELATIVE:
+        # the second adjustment reads one cell further, the base has moved
+        pair = _instruction(OpCodeExtended.ADJUST_REL_BASE, (mode,),
+                            _PLUS_ONE) + \
+            _instruction(OpCodeExtended.ADJUST_REL_BASE, (mode,), _PLUS_ONE)
+    else:
+        pair = _instruction(OpCodeExtended.ADJUST_REL_BASE, (mode,),
+                            _parameter(mode, _PLUS_ONE, 1)) + \
+            _instruction(OpCodeExtended.ADJUST_REL_BASE, (mode,),
+                         _parameter(mode, _MINUS_ONE, -1))
+    return _loop_program(lambda address: pair * (BODY_REPEAT // 2),
+                         iterations)
+
+
+def _relative_base_walk_workload(iterations):
+    """Walk the relative base over the data writing every cell from the
+    previous one"""
+    step = _instruction(OpCodeExtended.ADJUST_REL_BASE, (_IMMEDIATE,), 1) + \
+        _instruction(OpCodeExtended.ADD, (_RELATIVE, _IMMEDIATE, _RELATIVE),
+                     0, 1, 1)
+    back = _instruction(OpCodeExtended.ADJUST_REL_BASE, (_IMMEDIATE,),
+                        -BODY_REPEAT)
+    return _loop_program(lambda address: step * BODY_REPEAT + back,
+                         iterations, {BODY_REPEAT + 1: 0})
+
+
+def _far_addresses_workload(iterations):
+    """Move the relative base FAR_ADDRESS_STRIDE cells further every
+    iteration and write there, the memory grows with every write"""
+    body = _instruction(OpCodeExtended.ADJUST_REL_BASE, (_IMMEDIATE,),
+                        FAR_ADDRESS_STRIDE) + \
+        _instruction(OpCodeExtended.ADD, (_IMMEDIATE, _IMMEDIATE, _RELATIVE),
+                     1, 2, 0)
+    return _loop_program(lambda address: body, iterations)
+
+
+def _io_ping_pong_workload(iterations):
+    """Read a value, increment it and output it back"""
+    cell = DATA_ADDRESS + _RESULT
+    body = _instruction(OpCodeExtended.INPUT, (_POSITION,), cell) + \
+        _instruction(OpCodeExtended.ADD, (_POSITION, _IMMEDIATE, _POSITION),
+                     cell, 1, cell) + \
+        _instruction(OpCodeExtended.OUTPUT, (_POSITION,), cell)
+    return _loop_program(lambda address: body, iterations)
+
+
+def _echo_last_output(computer):
+    return computer.output_buffer.value or 0
+
+
+def _self_modifying_workload(iterations):
+    """Every iteration rewrites the op_codes of the upcoming instructions
+    switching them between ADD and MULT"""
+    def body(address):
+        cells = []
+        for _ in range(BODY_REPEAT // 4):
+            # the opcode of the stressed instruction after the two patching
+            # ones
+            target = address + len(cells) + 8
+            scratch = DATA_ADDRESS + _RESULT
+            cells += _instruction(OpCodeExtended.MULT,
+                                  (_POSITION, _IMMEDIATE, _POSITION),
+                                  target, -1, scratch)
+            cells += _instruction(OpCodeExtended.ADD,
+                                  (_POSITION, _IMMEDIATE, _POSITION),
+                                  scratch, 3, target)
+            cells += _instruction(OpCodeExtended.ADD, (),
+                                  DATA_ADDRESS + _FIRST_OPERAND,
+                                  DATA_ADDRESS + _SECOND_OPERAND,
+                                  DATA_ADDRESS + _ZERO + 10)
+        return cells
+    return _loop_program(body, iterations, {_ZERO + 10: 0})
+
+
+def synthetic_workloads(iterations=DEFAULT_ITERATIONS):
+    """
+    :param iterations: loop iterations of every program
+    :return: list of the Workload objects
+    """
+    workloads = []
+    for op_code in (OpCodeExtended.ADD, OpCodeExtended.MULT,
+                    OpCodeExtended.LESS_THAN, OpCodeExtended.EQUALS):
+        for mode in ParameterModes:
+            workloads.append(Workload(
+                '%s_%s' % (op_code.name.lower(), mode.name.lower()),
+                _binary_workload(op_code, mode.value, iterations), ()))
+    for op_code in (OpCodeExtended.JUMP_IF_TRUE,
+                    OpCodeExtended.JUMP_IF_FALSE):
+        for mode in ParameterModes:
+            workloads.append(Workload(
+                '%s_%s' % (op_code.name.lower(), mode.name.lower()),
+                _jump_workload(op_code, mode.value, iterations), ()))
+    for mode in ParameterModes:
+        workloads.append(Workload(
+            'adjust_rel_base_%s' % mode.name.lower(),
+            _adjust_relative_base_workload(mode.value, iterations), ()))
+    workloads += [
+        Workload('relative_base_walk',
+                 _relative_base_walk_workload(iterations), ()),
+        Workload('far_addresses', _far_addresses_workload(iterations), ()),
+        Workload('io_ping_pong', _io_ping_pong_workload(iterations),
+                 _echo_last_output),
+        Workload('self_modifying', _self_modifying_workload(iterations), ()),
+    ]
+    return workloads
+
+
+def day_workloads(cases=CONFORMANCE_CASES):
+    """
+    :return: list of the Workload objects of the day programs, with the
+    patches and the inputs of the conformance cases
+    """
+    workloads = []
+    for case in cases:
+        program = parse_program(INPUTS_FOLDER / case.input_file)
+        for address, value in case.patches.items():
+            program[address] = value
+        workloads.append(Workload(case.name, program, case.inputs))
+    return workloads
+
+
+def count_instructions(workload):
+    """Return the number of the instructions the workload executes"""
+    computer = IntcodeComputer(list(workload.program))
+    profile = computer.enable_profiling()
+    feeder = ScriptedInput(computer, workload.inputs)
+    computer.run_program()
+    feeder.unsubscribe(computer.input_buffer)
+    return profile.instructions
+
+
+def percentile(values, rank):
+    """Return the nearest rank percentile of the values"""
+    ordered = sorted(values)
+    index = max(0, -(-rank * len(ordered) // 100) - 1)
+    return ordered[index]
+
+
+def _run_once(workload, engine, memory_type, accelerate_loops, image):
+    """
+    :return: (construction seconds, run seconds) tuple
+    """
+    program = image if image is not None else list(workload.program)
+    start = time.perf_counter()
+    computer = create_computer(program, engine, memory_type,
+                               accelerate_loops)
+    constructed = time.perf_counter()
+    feeder = ScriptedInput(computer, workload.inputs)
+    started = time.perf_counter()
+    computer.run_program()
+    finished = time.perf_counter()
+    feeder.unsubscribe(computer.input_buffer)
+    return constructed - start, finished - started
+
+
+def run_benchmark(workload, engine, memory_type=MemoryTypes.LIST.value,
+                  repeat=DEFAULT_REPEAT, instructions=None,
+                  accelerate_loops=False):
+    """
+    Run the workload once under tracemalloc for its peak memory and then
+    the repeat times timed
+    :param instructions: number of the instructions the workload executes,
+    counted if None
+    :return: BenchmarkResult, the engine of the accelerated tiered one is
+    reported as tiered+loops
+    """
+    if instructions is None:
+        instructions = count_instructions(workload)
+    image = None
+    if memory_type == MemoryTypes.IMAGE.value:
+        image = write_program_image(workload.program)
+    try:
+        tracemalloc.start()
+        try:
+            _run_once(workload, engine, memory_type, accelerate_loops,
+                      image)
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        construction_times = []
+        run_times = []
+        for _ in range(repeat):
+            construction_time, run_time = _run_once(
+                workload, engine, memory_type, accelerate_loops, image)
+            construction_times.append(construction_time)
+            run_times.append(run_time)
+    finally:
+        if image is not None:
+            image.unlink()
+
+    median_run_time = percentile(run_times, 50)
+    latencies = [run_time / max(instructions, 1) * 1e9
+                 for run_time in run_times]
+    latency_ns = {'p%d' % rank: percentile(latencies, rank)
+                  for rank in LATENCY_PERCENTILES}
+    latency_ns['min'] = min(latencies)
+    latency_ns['max'] = max(latencies)
+    return BenchmarkResult(
+        workload.name, configuration_name(engine, accelerate_loops),
+        memory_type, instructions,
+        instructions / median_run_time if median_run_time else None,
+        latency_ns, percentile(construction_times, 50) * 1e9, peak_memory)
+
+
+def run_benchmark_suite(workloads=None, engines=None, memory_types=None,
+                        repeat=DEFAULT_REPEAT, progress=None):
+    """
+    Run every workload on every supported engine and memory backend
+    :param workloads: list of the Workload objects, the synthetic and the
+    day ones if None
+    :param progress: function called with every BenchmarkResult
+    :return: the report dict, see save_report()
+    """
+    if workloads is None:
+        workloads = synthetic_workloads() + day_workloads()
+    results = []
+    for workload in workloads:
+        instructions = count_instructions(workload)
+        for engine, memory_type, accelerate_loops in \
+                supported_configurations(engines, memory_types):
+            result = run_benchmark(workload, engine, memory_type, repeat,
+                                   instructions, accelerate_loops)
+            results.append(result)
+            if progress is not None:
+                progress(result)
+    return {
+        'version': REPORT_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_implementation() + ' ' +
+        platform.python_version(),
+        'platform': platform.platform(),
+        'implementation': implementation_fingerprint(),
+        'repeat': repeat,
+        'results': [result._asdict() for result in results],
+    }
+
+
+def save_report(report, path):
+    with open(path, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+
+
+def load_report(path):
+    with open(path) as report_file:
+        report = json.load(report_file)
+    if report.get('version') != REPORT_VERSION:
+        raise ValueError('%s is not a benchmark report of version %d' %
+                         (path, REPORT_VERSION))
+    return report
+
+
+def compare_reports(baseline, current):
+    """
+    Compare the throughput of the results both reports have
+    :return: list of the (workload, engine, memory_type, baseline
+    instructions per second, current ones, speedup) tuples
+    """
+    def key(result):
+        return result['workload'], result['engine'], result['memory_type']
+
+    baseline_results = {key(result): result
+                        for result in baseline['results']}
+    comparison = []
+    for result in current['results']:
+        previous = baseline_results.get(key(result))
+        if previous is None or not previous['instructions_per_second'] or \
+                not result['instructions_per_second']:
+            continue
+        comparison.append(key(result) + (
+            previous['instructions_per_second'],
+            result['instructions_per_second'],
+            result['instructions_per_second'] /
+            previous['instructions_per_second']))
+    return comparison
+
+
+def _print_result(result):
+    print('%-22s %-12s %-6s %12.0f instr/s  p50 %7.1f ns  build %9.0f ns  '
+          'peak %10d B' % (result.workload, result.engine,
+                           result.memory_type,
+                           result.instructions_per_second or 0,
+                           result.latency_ns['p50'], result.construction_ns,
+                           result.peak_memory))
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the engines and the memory backends of the '
+                    'IntcodeComputer')
+    parser.add_argument('--output', help='path of the JSON report')
+    parser.add_argument('--compare',
+                        help='path of the JSON report to compare with')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--iterations', type=int,
+                        default=DEFAULT_ITERATIONS,
+                        help='loop iterations of the synthetic programs')
+    parser.add_argument('--engines', nargs='+',
+                        choices=[engine.value for engine in EngineTypes] +
+                        list(INSTRUMENTED_ENGINES))
+    parser.add_argument('--memory-types', nargs='+',
+                        choices=[memory_type.value
+                                 for memory_type in MemoryTypes])
+    parser.add_argument('--workloads', nargs='+',
+                        help='run only the workloads with these names')
+    parser.add_argument('--no-days', action='store_true',
+                        help='skip the day programs')
+    options = parser.parse_args(arguments)
+
+    workloads = synthetic_workloads(options.iterations)
+    if not options.no_days:
+        workloads += day_workloads()
+    if options.workloads:
+        workloads = [workload for workload in workloads
+                     if workload.name in options.workloads]
+    report = run_benchmark_suite(workloads, options.engines,
+                                 options.memory_types, options.repeat,
+                                 progress=_print_result)
+    if options.output:
+        save_report(report, options.output)
+    if options.compare:
+        for workload, engine, memory_type, before, after, speedup in \
+                compare_reports(load_report(options.compare), report):
+            print('%-22s %-12s %-6s %12.0f -> %12.0f instr/s  x%.2f' %
+                  (workload, engine, memory_type, before, after, speedup))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,362 @@
+from collections import namedtuple
+
+from intcode_computer.commands import OpCodeExtended
+from intcode_computer.command_parameters import ParameterModes
+from intcode_computer.decode_cache import DecodeCache
+from intcode_computer.engines import DECODE_TABLE, INSTRUCTION_PARAMETERS, \
+    exchange_input, exchange_output, run_fast_engine
+
+# number of times the execution should reach an address before the basic
+# block starting there gets compiled
+HOT_BLOCK_THRESHOLD = 8
+# the longest straight-line run of instructions compiled into one function
+MAX_BLOCK_LENGTH = 64
+# blocks invalidated that many times are left to the interpreter for good
+MAX_BLOCK_COMPILATIONS = 16
+
+CompiledBlock = namedtuple('CompiledBlock',
+                           'function start end cells instruction_count '
+                           'source')
+
+_JUMP_OP_CODES = (OpCodeExtended.JUMP_IF_TRUE.value,
+                  OpCodeExtended.JUMP_IF_FALSE.value)
+# I/O calls back into the observers which may do anything with the
+# computer, so it always finishes the block
+_IO_OP_CODES = (OpCodeExtended.INPUT.value, OpCodeExtended.OUTPUT.value)
+_BINARY_OPERATIONS = {
+    OpCodeExtended.ADD.value: '{0} + {1}',
+    OpCodeExtended.MULT.value: '{0} * {1}',
+    OpCodeExtended.LESS_THAN.value: '1 if {0} < {1} else 0',
+    OpCodeExtended.EQUALS.value: '1 if {0} == {1} else 0',
+}
+
+
+class CompiledBlockCache(DecodeCache):
+    """DecodeCache which additionally stores compiled basic blocks. A write
+    into any cell of a block drops the block together with the decoded
+    instructions covering the cell. Such cells are remembered as unstable,
+    so the operands stored there are not baked into the recompiled block"""
+    @property
+    def blocks(self):
+        return self._blocks
+
+    @property
+    def unstable_cells(self):
+        return self._unstable_cells
+
+    def __init__(self):
+        super().__init__()
+        self._blocks = {}
+        self._unstable_cells = set()
+
+    def get_block(self, address):
+        return self._blocks.get(address)
+
+    def store_block(self, block):
+        self._blocks[block.start] = block
+        self._add_owner(block.start, block.cells)
+
+    def invalidate(self, address):
+        owners = self._owners.pop(address, None)
+        if owners is None:
+            return
+        for owner in owners:
+            self._entries.pop(owner, None)
+            if self._blocks.pop(owner, None) is not None:
+                self._unstable_cells.add(address)
+
+    def clear(self):
+        super().clear()
+        self._blocks.clear()
+        self._unstable_cells.clear()
+
+
+class BlockCompiler:
+    """Translates basic blocks of the Intcode program into Python functions
+    with the parameter modes and operands baked in. Operands which have been
+    overwritten by the program before are read from the memory instead.
+
+    A compiled function takes the memory container and the relative base and
+    returns the (next command pointer, relative base) tuple. The command
+    pointer is None if the memory the block accesses is not allocated yet,
+    in this case nothing has been executed and the interpreter should take
+    over"""
+    def __init__(self, computer, max_block_length=MAX_BLOCK_LENGTH):
+        self._computer = computer
+        self._max_block_length = max_block_length
+
+    def scan_block(self, address):
+        """
+        Collect the straight-line run of instructions starting at the address
+        :return: list of (address, op_code, modes, operands) tuples
+        """
+        memory = self._computer.memory
+        command_mapping = self._computer.COMMAND_MAPPING
+        unstable_cells = self._computer.decode_cache.unstable_cells
+        instructions = []
+
+        while len(instructions) < self._max_block_length:
+            decoded = DECODE_TABLE.get(memory[address])
+            if decoded is None or decoded[0] == OpCodeExtended.TERM.value:
+                break
+
+            op_code = decoded[0]
+            command_length = command_mapping[op_code].COMMAND_LENGTH
+            parameter_count = len(INSTRUCTION_PARAMETERS[op_code])
+            modes = decoded[1:parameter_count + 1]
+            operands = tuple(memory[address + offset]
+                             for offset in range(1, command_length))
+            if any(mode == ParameterModes.POSITION.value and operand < 0 and
+                   address + offset not in unstable_cells
+                   for offset, (mode, operand)
+                   in enumerate(zip(modes, operands), 1)):
+                # negative positions are left to the interpreter to fail
+                break
+            instructions.append((address, op_code, modes, operands))
+            address += command_length
+
+            if op_code in _JUMP_OP_CODES or op_code in _IO_OP_CODES:
+                break
+            if op_code == OpCodeExtended.ADJUST_REL_BASE.value and \
+                    (modes[0] != ParameterModes.IMMEDIATE.value or
+                     address - 1 in unstable_cells):
+                # the relative addresses of the following instructions can't
+                # be checked in advance
+                break
+
+        return instructions
+
+    def compile_block(self, address):
+        """
+        Compile the basic block starting at the address
+        :return: CompiledBlock object or None if there is nothing to compile
+        """
+        instructions = self.scan_block(address)
+        if not instructions:
+            return None
+
+        decode_cache = self._computer.decode_cache
+        last_address, _, _, last_operands = instructions[-1]
+        end = last_address + len(last_operands) + 1
+        if end > len(self._computer.memory.container):
+            # the code out of the container is left to the interpreter
+            return None
+        # the block depends on every cell except the operands which are read
+        # from the memory on each run
+        cells = frozenset(cell for cell in range(address, end)
+                          if cell not in decode_cache.unstable_cells)
+        cells = cells.union(instruction[0] for instruction in instructions)
+
+        generator = _BlockSourceGenerator(address, end, cells)
+        for instruction in instructions:
+            generator.add_instruction(*instruction)
+        source = generator.get_source()
+
+        memory = self._computer.memory
+        namespace = {'owners': decode_cache.owners,
+                     'invalidate': decode_cache.invalidate,
+                     'read': memory.__getitem__,
+                     'write': memory.__setitem__,
+                     'own_cells': cells,
+                     'computer': self._computer,
+                     'exchange_input': exchange_input,
+                     'exchange_output': exchange_output}
+        exec(compile(source, '<intcode block %d>' % address, 'exec'),
+             namespace)
+        return CompiledBlock(namespace['block'], address, end, cells,
+                             len(instructions), source)
+
+
+class _BlockSourceGenerator:
+    """Builds the source code of the function for one basic block"""
+    INDENT = '    '
+
+    def __init__(self, start, end, cells):
+        self._start = start
+        self._end = end
+        self._cells = cells
+        self._lines = []
+        # offsets of the relative addresses from the entry relative base
+        self._relative_offsets = []
+        self._positions = []
+        self._relative_base_delta = 0
+
+    def _is_dynamic(self, cell):
+        return self._start <= cell < self._end and cell not in self._cells
+
+    def _read(self, mode, operand, cell):
+        if self._is_dynamic(cell):
+            # the Memory object takes care of the unallocated addresses
+            if mode == ParameterModes.POSITION.value:
+                return 'read(mem[%d])' % cell
+            elif mode == ParameterModes.IMMEDIATE.value:
+                return 'mem[%d]' % cell
+            return 'read(rb + mem[%d])' % cell
+
+        if mode == ParameterModes.POSITION.value:
+            self._positions.append(operand)
+            return 'mem[%d]' % operand
+        elif mode == ParameterModes.IMMEDIATE.value:
+            return '%d' % operand
+        self._relative_offsets.append(self._relative_base_delta + operand)
+        return 'mem[rb + %d]' % operand
+
+    def _write(self, mode, operand, cell, value, next_address):
+        indent = self.INDENT * 2
+        if self._is_dynamic(cell):
+            base = 'rb + ' if mode == ParameterModes.RELATIVE.value else ''
+            self._lines.append('%saddr = %smem[%d]' % (self.INDENT, base,
+                                                        cell))
+            # the Memory object invalidates whatever was overwritten
+            self._lines.append('%swrite(addr, %s)' % (self.INDENT, value))
+            self._lines.append('%sif addr in own_cells:' % self.INDENT)
+            self._lines.append('%sreturn %d, rb' % (indent, next_address))
+            return
+
+        if mode == ParameterModes.POSITION.value:
+            self._positions.append(operand)
+            self._lines.append('%smem[%d] = %s' % (self.INDENT, operand,
+                                                    value))
+            if operand in self._cells:
+                # the block has just overwritten its own code
+                self._lines.append('%sinvalidate(%d)' % (self.INDENT,
+                                                         operand))
+                self._lines.append('%sreturn %d, rb' % (self.INDENT,
+                                                        next_address))
+            else:
+                self._lines.append('%sif %d in owners:' % (self.INDENT,
+                                                           operand))
+                self._lines.append('%sinvalidate(%d)' % (indent, operand))
+            return
+
+        self._relative_offsets.append(self._relative_base_delta + operand)
+        self._lines.append('%saddr = rb + %d' % (self.INDENT, operand))
+        self._lines.append('%smem[addr] = %s' % (self.INDENT, value))
+        self._lines.append('%sif addr in owners:' % self.INDENT)
+        self._lines.append('%sinvalidate(addr)' % indent)
+        self._lines.append('%sif addr in own_cells:' % indent)
+        self._lines.append('%sreturn %d, rb' % (indent + self.INDENT,
+                                                next_address))
+
+    def add_instruction(self, address, op_code, modes, operands):
+        next_address = address + len(operands) + 1
+        cells = range(address + 1, next_address)
+        self._lines.append('%s# %d: %d %s' % (
+            self.INDENT, address, op_code,
+            ' '.join('%d:%d' % pair for pair in zip(modes, operands))))
+
+        if op_code in _BINARY_OPERATIONS:
+            value = _BINARY_OPERATIONS[op_code].format(
+                self._read(modes[0], operands[0], cells[0]),
+                self._read(modes[1], operands[1], cells[1]))
+            self._write(modes[2], operands[2], cells[2], value, next_address)
+        elif op_code == OpCodeExtended.ADJUST_REL_BASE.value:
+            value = self._read(modes[0], operands[0], cells[0])
+            if modes[0] == ParameterModes.IMMEDIATE.value and \
+                    not self._is_dynamic(cells[0]):
+                self._relative_base_delta += operands[0]
+            self._lines.append('%srb += %s' % (self.INDENT, value))
+        elif op_code in _JUMP_OP_CODES:
+            condition = '!=' \
+                if op_code == OpCodeExtended.JUMP_IF_TRUE.value else '=='
+            self._lines.append('%sif %s %s 0:' % (
+                self.INDENT, self._read(modes[0], operands[0], cells[0]),
+                condition))
+            self._lines.append('%starget = %s' % (
+                self.INDENT * 2, self._read(modes[1], operands[1], cells[1])))
+            # a jump to the jump itself moves to the next instruction, the
+            # same way the interpreter does it
+            self._lines.append('%sif target != %d:' % (self.INDENT * 2,
+                                                       address))
+            self._lines.append('%sreturn target, rb' % (self.INDENT * 3))
+        elif op_code == OpCodeExtended.OUTPUT.value:
+            self._lines.append('%sreturn exchange_output(computer, %d, rb, %s)'
+                               % (self.INDENT, address,
+                                  self._read(modes[0], operands[0], cells[0])))
+        elif op_code == OpCodeExtended.INPUT.value:
+            # the input is stored through the Memory object which allocates
+            # and invalidates whatever is needed
+            operand = 'mem[%d]' % cells[0] \
+                if self._is_dynamic(cells[0]) else '%d' % operands[0]
+            self._lines.append('%sreturn exchange_input(computer, %d, rb, %d, '
+                               '%s)' % (self.INDENT, address, modes[0],
+                                        operand))
+        else:
+            raise ValueError('Op code %d can not be compiled' % op_code)
+
+    def get_source(self):
+        guards = ['len(mem) <= %d' % max(self._positions)] \
+            if self._positions else []
+        if self._relative_offsets:
+            guards.append('rb + %d < 0' % min(self._relative_offsets))
+            guards.append('len(mem) <= rb + %d' %
+                          max(self._relative_offsets))
+
+        lines = ['def block(mem, rb, owners=owners, invalidate=invalidate, '
+                 'own_cells=own_cells, read=read, write=write):']
+        if guards:
+            lines.append('%sif %s:' % (self.INDENT, ' or '.join(guards)))
+            lines.append('%sreturn None, rb' % (self.INDENT * 2))
+        lines.extend(self._lines)
+        lines.append('%sreturn %d, rb' % (self.INDENT, self._end))
+        return '\n'.join(lines) + '\n'
+
+
+def run_tiered_engine(computer, compiler, loop_accelerator=None,
+                      hot_threshold=HOT_BLOCK_THRESHOLD):
+    """
+    Execute the program loaded into the computer interpreting the cold code
+    with the fast engine and running the hot basic blocks as compiled
+    functions. The fast engine hands the control back at the jump targets
+    which got hot or have been compiled. Blocks are recompiled once they got
+    invalidated by a write and became hot again. Blocks jumping back to
+    their own start are offered to the loop_accelerator if it is given
+    """
+    decode_cache = computer.decode_cache
+    memory = computer.memory
+    blocks = decode_cache.blocks
+    get_block = blocks.get
+    heat = {}
+    compilations = {}
+
+    def is_hot(address):
+        """Count the execution of the address, return True if the block
+        starting there should be compiled now"""
+        hits = heat.get(address, 0) + 1
+        heat[address] = hits
+        return hits % hot_threshold == 0 and \
+            compilations.get(address, 0) < MAX_BLOCK_COMPILATIONS
+
+    def leaves_interpreter(target):
+        return target in blocks or is_hot(target)
+
+    ip = computer.command_pointer
+    rb = computer.relative_base
+    # set if the fast engine has stopped at the address it found hot
+    hot = False
+    while True:
+        block = get_block(ip)
+        if block is None and (hot or is_hot(ip)):
+            compilations[ip] = compilations.get(ip, 0) + 1
+            block = compiler.compile_block(ip)
+            if block is not None:
+                decode_cache.store_block(block)
+        hot = False
+
+        if block is not None:
+            next_ip, rb = block.function(memory.container, rb)
+            if next_ip is not None:
+                if next_ip == ip and loop_accelerator is not None:
+                    loop_end = loop_accelerator.accelerate(block, rb)
+                    if loop_end is not None:
+                        next_ip = loop_end
+                ip = next_ip
+                continue
+
+        computer.command_pointer = ip
+        computer.relative_base = rb
+        if not run_fast_engine(computer, leaves_interpreter):
+            return
+        ip = computer.command_pointer
+        rb = computer.relative_base
+        hot = True
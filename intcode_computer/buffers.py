@@ -22,8 +22,13 @@ class InputBuffer(Observable, Buffer):
     def request_input(self):
         self._input_requested.value = True
 
-    def subscribe(self, subscriber, callback):
-        self._input_requested.subscribe(subscriber, callback)
+    def subscribe(self, subscriber, callback, record_width=1,
+                  flush_size=None, weak=None):
+        """Call the callback whenever the input is requested, the requests
+        are never batched"""
+        if record_width != 1 or flush_size is not None:
+            raise ValueError('The input requests can not be batched')
+        self._input_requested.subscribe(subscriber, callback, weak=weak)
 
     def unsubscribe(self, subscriber):
         self._input_requested.unsubscribe(subscriber)
@@ -0,0 +1,102 @@
+from collections import deque
+
+# values a channel holds by default
+DEFAULT_CHANNEL_CAPACITY = 1024
+
+
+class ChannelFull(Exception):
+    """Raised when a value is put into the channel which has no free space"""
+
+
+class ChannelEmpty(Exception):
+    """Raised when a value is taken from the empty channel"""
+
+
+class Channel:
+    """Bounded FIFO queue of the values passed to or from the computer.
+    Attached as the input channel it supplies the INPUT instructions without
+    any observer callbacks, the computer pauses once it is empty. Attached
+    as the output channel it collects the output values, the computer
+    pauses once it is full"""
+    @property
+    def capacity(self):
+        """Maximum number of the values held, None if unbounded"""
+        return self._capacity
+
+    @property
+    def values(self):
+        """The deque of the values, the oldest one first"""
+        return self._values
+
+    @property
+    def free_space(self):
+        """Number of the values which fit into the channel, None if it is
+        unbounded"""
+        if self._capacity is None:
+            return None
+        return self._capacity - len(self._values)
+
+    def __init__(self, values=(), capacity=DEFAULT_CHANNEL_CAPACITY):
+        values = list(values)
+        self._capacity = capacity
+        self._values = deque()
+        if self.put_many(values) != len(values):
+            raise ChannelFull('%d values do not fit into the channel of %d'
+                              % (len(values), capacity))
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __repr__(self):
+        return 'Channel(%r, capacity=%r)' % (list(self._values),
+                                              self._capacity)
+
+    def full(self):
+        return self._capacity is not None and \
+            len(self._values) >= self._capacity
+
+    def put(self, value):
+        if self.full():
+            raise ChannelFull()
+        self._values.append(value)
+
+    def put_many(self, values):
+        """
+        Put as many of the values as there is free space for
+        :return: number of the values put into the channel
+        """
+        free_space = self.free_space
+        if free_space is None:
+            count = len(self._values)
+            self._values.extend(values)
+            return len(self._values) - count
+        count = 0
+        for value in values:
+            if count == free_space:
+                break
+            self._values.append(value)
+            count += 1
+        return count
+
+    def get(self):
+        if not self._values:
+            raise ChannelEmpty()
+        return self._values.popleft()
+
+    def get_many(self, count=None):
+        """
+        Take up to count values, all of them if count is None
+        :return: list of the values, the oldest one first
+        """
+        values = self._values
+        if count is None or count >= len(values):
+            taken = list(values)
+            values.clear()
+            return taken
+        return [values.popleft() for _ in range(count)]
+
+    def clear(self):
+        self._values.clear()
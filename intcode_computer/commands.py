@@ -109,6 +109,8 @@ class InputCommand(ExtendedCommand):
                          result_addr=result_addr)
 
     def execute(self, *args, **kwargs):
+        # the subscribers answer the input request by the outputs so far
+        self.delegate.output_buffer.flush()
         # notify subscribers that input is requested
         self.delegate.input_buffer.request_input()
         # at this point subscribers should already put data to the
@@ -1,7 +1,32 @@
+import asyncio
+import sys
+from collections import namedtuple
+
 from intcode_computer import OpCodeExtended, AddCommand, \
     MultiplyCommand, InputCommand, OutputCommand, JumpIfTrueCommand, \
     JumpIfFalseCommand, LessThanCommand, AdjustRelativeBaseCommand, \
     EqualsCommand, OutputBuffer, InputBuffer, DynamicMemory, Memory
+from intcode_computer.memory import MemoryTypes, TypedMemory, PagedMemory, \
+    ImageMemory
+from intcode_computer.decode_cache import DecodeCache
+from intcode_computer.channels import Channel, ChannelFull
+from intcode_computer.engines import EngineTypes, StopReasons, \
+    run_fast_engine, run_fast_slice, run_command_slice
+from intcode_computer.block_compiler import BlockCompiler, \
+    CompiledBlockCache, run_tiered_engine
+from intcode_computer.loop_accelerator import LoopAccelerator
+from intcode_computer.profiler import ExecutionProfile, run_profiled_engine
+from intcode_computer.tracer import TraceRecorder, run_traced_engine, \
+    DEFAULT_TRACE_CAPACITY
+from intcode_computer.memory import PAGE_SIZE
+from intcode_computer.output_history import HistoryPolicies, \
+    DEFAULT_HISTORY_CAPACITY, create_output_history
+
+# instructions executed by run_async() before the control is given back to
+# the event loop by default
+DEFAULT_YIELD_INTERVAL = 1000
+
+IOResult = namedtuple('IOResult', 'status outputs')
 
 
 class IntcodeComputer:
@@ -16,6 +41,15 @@ class IntcodeComputer:
         OpCodeExtended.EQUALS.value: EqualsCommand,
         OpCodeExtended.ADJUST_REL_BASE.value: AdjustRelativeBaseCommand
     }
+    MEMORY_MAPPING = {
+        MemoryTypes.LIST.value: DynamicMemory,
+        MemoryTypes.TYPED.value: TypedMemory,
+        MemoryTypes.PAGED.value: PagedMemory,
+        MemoryTypes.IMAGE.value: ImageMemory
+    }
+    # compiled blocks store any value right into the container, so it has to
+    # hold Python ints
+    TIERED_MEMORY_TYPES = (MemoryTypes.LIST.value, MemoryTypes.PAGED.value)
 
     @property
     def input_buffer(self):
@@ -25,6 +59,22 @@ class IntcodeComputer:
     def output_buffer(self):
         return self._output_buffer
 
+    @property
+    def input_channel(self):
+        return self._input_channel
+
+    @input_channel.setter
+    def input_channel(self, value):
+        self._input_channel = value
+
+    @property
+    def output_channel(self):
+        return self._output_channel
+
+    @output_channel.setter
+    def output_channel(self, value):
+        self._output_channel = value
+
     @property
     def command_pointer(self):
         return self._command_pointer
@@ -35,8 +85,14 @@ class IntcodeComputer:
 
     @property
     def output_history(self):
+        """Output values kept by the history policy, iterable from the
+        oldest one"""
         return self._output_history
 
+    @property
+    def history_policy(self):
+        return self._history_policy
+
     @property
     def relative_base(self):
         return self._relative_base
@@ -45,6 +101,33 @@ class IntcodeComputer:
     def relative_base(self, value):
         self._relative_base = value
 
+    @property
+    def engine(self):
+        return self._engine
+
+    @property
+    def loop_accelerator(self):
+        return self._loop_accelerator
+
+    @property
+    def memory_type(self):
+        return self._memory_type
+
+    @property
+    def profile(self):
+        """ExecutionProfile collected by run_program(), None if profiling
+        is off"""
+        return self._profile
+
+    @property
+    def tracer(self):
+        """TraceRecorder filled by run_program(), None if tracing is off"""
+        return self._tracer
+
+    @property
+    def decode_cache(self):
+        return self._decode_cache
+
     @property
     def memory(self):
         return self._memory
@@ -53,61 +136,342 @@ class IntcodeComputer:
     def memory(self, value):
         self.memory.container = value
 
-    def __init__(self, program, input_buffer=None, output_buffer=None):
-        self._memory = DynamicMemory(program)
+    def __init__(self, program, input_buffer=None, output_buffer=None,
+                 engine=EngineTypes.COMMAND.value, accelerate_loops=False,
+                 memory_type=MemoryTypes.LIST.value,
+                 history_policy=HistoryPolicies.LIST.value,
+                 history_capacity=DEFAULT_HISTORY_CAPACITY,
+                 history_path=None):
+        """
+        :param history_policy: HistoryPolicies value, how many of the output
+        values the output_history keeps and where
+        :param history_capacity: number of the values kept by the ring or
+        buffered by the spill history
+        :param history_path: file the spill history writes to, an anonymous
+        temporary file if None
+        """
+        self._engine = EngineTypes(engine).value
+        self._memory_type = MemoryTypes(memory_type).value
+        if accelerate_loops and self._engine != EngineTypes.TIERED.value:
+            raise ValueError('Loop acceleration requires the tiered engine')
+        if self._engine == EngineTypes.TIERED.value and \
+                self._memory_type not in self.TIERED_MEMORY_TYPES:
+            raise ValueError('The tiered engine does not support the %s '
+                             'memory' % self._memory_type)
+        # the fast engine doesn't use Command objects, so there is nothing to
+        # cache for it
+        if self._engine == EngineTypes.COMMAND.value:
+            self._decode_cache = DecodeCache()
+        elif self._engine == EngineTypes.TIERED.value:
+            self._decode_cache = CompiledBlockCache()
+        else:
+            self._decode_cache = None
+        self._memory = self.MEMORY_MAPPING[self._memory_type](
+            program, decode_cache=self._decode_cache)
+        self._block_compiler = BlockCompiler(self) \
+            if self._engine == EngineTypes.TIERED.value else None
+        self._loop_accelerator = \
+            LoopAccelerator(self, self._block_compiler) \
+            if accelerate_loops else None
         self._command_pointer = 0
         self._output_buffer = OutputBuffer(output_buffer)
         self._input_buffer = InputBuffer(input_buffer)
-        self._output_history = []
+        self._input_channel = None
+        self._output_channel = None
+        # input values given to run_until_io() and not consumed yet
+        self._queued_inputs = Channel(capacity=None)
+        self._history_policy = HistoryPolicies(history_policy).value
+        self._output_history = create_output_history(
+            self._history_policy, history_capacity, history_path)
         self._relative_base = 0
+        self._profile = None
+        self._tracer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Close the output history, the spill history writes the rest of
+        the values to its file. The history can't be appended to anymore"""
+        close = getattr(self._output_history, 'close', None)
+        if close is not None:
+            close()
+
+    def fork(self):
+        """
+        Create a copy of the computer which continues from the same state:
+        memory, command pointer, relative base, buffer values and output
+        history. The memory cells are shared with this computer until either
+        of them writes to them. Subscribers of the buffers and the channels
+        are not copied
+        :return: IntcodeComputer object
+        """
+        child = IntcodeComputer(
+            None, self.input_buffer.value, self.output_buffer.value,
+            engine=self._engine,
+            accelerate_loops=self._loop_accelerator is not None,
+            memory_type=self._memory_type)
+        child._memory = self._memory.fork(decode_cache=child.decode_cache)
+        child.command_pointer = self.command_pointer
+        child.relative_base = self.relative_base
+        child._history_policy = self._history_policy
+        child._output_history = self._output_history.copy()
+        child._queued_inputs = Channel(self._queued_inputs, capacity=None)
+        return child
 
     def _get_next_command(self):
         """
-        Generator method to return the required number of arguments for the
-        command at self.command_pointer
-        :return: op_code if op_code == 99 to indicate the end of program,
-        otherwise will return arguments
+        Generator method to return the decoded instruction at
+        self.command_pointer together with its length. Instructions are
+        decoded once and then taken from the decode cache until one of the
+        memory cells they occupy is overwritten
+        :return: nothing when op_code == 99 to indicate the end of program,
+        otherwise will yield (command, command_length) tuples
         """
         while True:
-            op_code = int(str(self.memory[self.command_pointer])[-2:])
-            if op_code == OpCodeExtended.TERM.value:
-                # return op_code if the op_code denotes the end of program
-                return op_code,
-
             command_pointer_stored_value = self.command_pointer
+            decoded = self._fetch_command(command_pointer_stored_value)
+            if decoded is None:
+                # stop execution if the op_code denotes the end of program
+                return
 
-            # get the required number of arguments based on the op_code
-            command_length = self.COMMAND_MAPPING[op_code].COMMAND_LENGTH
-            yield tuple(self.memory[
-                  self.command_pointer:self.command_pointer + command_length
-                  ])
+            yield decoded
+            command_length = decoded[1]
 
             # Check if the command_pointer hasn't been modified by one of the
             # JUMP commands
             if self.command_pointer == command_pointer_stored_value:
                 self.command_pointer += command_length
 
+    def _fetch_command(self, address):
+        """Return the (command, command_length) tuple for the instruction at
+        the address from the decode cache or decode it if it is not cached
+        yet"""
+        decode_cache = self._decode_cache
+        if decode_cache is None:
+            return self._decode_command(address)
+
+        decoded = decode_cache.get(address)
+        if decoded is None:
+            decoded = self._decode_command(address)
+            if decoded is not None:
+                decode_cache.store(address, decoded[1], decoded)
+        return decoded
+
+    def _decode_command(self, address):
+        """
+        Build a Command object for the instruction stored at the address
+        :return: (command, command_length) tuple or None if the op_code
+        denotes the end of program
+        """
+        op_code = int(str(self.memory[address])[-2:])
+        if op_code == OpCodeExtended.TERM.value:
+            return None
+
+        # get the required number of arguments based on the op_code
+        command_class = self.COMMAND_MAPPING[op_code]
+        command_length = command_class.COMMAND_LENGTH
+        command_parameters = tuple(self.memory[address:
+                                               address + command_length])
+        return command_class(self, *command_parameters), command_length
+
     def command_generator(self):
         """
         Generator method to return a Command object for the execution based
-        on op_code and arguments returned by _get_next_command() method
+        on the instructions returned by _get_next_command() method
         """
-        for command_parameters in self._get_next_command():
-            op_code = int(str(command_parameters[0])[-2:])
-            if op_code == OpCodeExtended.TERM.value:
-                # stop execution if the op_code denotes the end of program
-                return
-            else:
-                command_class = self.COMMAND_MAPPING[op_code]
-                yield command_class(self, *command_parameters)
+        for command, _ in self._get_next_command():
+            yield command
+
+    def execute_next_command(self):
+        """
+        Execute the single instruction at self.command_pointer with the
+        Command object
+        :return: False if the op_code denotes the end of program, True
+        otherwise
+        """
+        command_pointer_stored_value = self.command_pointer
+        decoded = self._fetch_command(command_pointer_stored_value)
+        if decoded is None:
+            return False
+
+        command, command_length = decoded
+        command.execute()
+        if self.command_pointer == command_pointer_stored_value:
+            self.command_pointer += command_length
+        return True
+
+    def enable_profiling(self, page_size=PAGE_SIZE):
+        """
+        Make run_program() execute the program with the instrumented loop
+        collecting the execution profile. Other ways to run the program
+        are not profiled
+        :return: ExecutionProfile object, the counters accumulate over the
+        runs
+        """
+        if self._tracer is not None:
+            raise ValueError('Profiling and tracing can not be used at once')
+        if self._profile is None:
+            self._profile = ExecutionProfile(page_size)
+        return self._profile
+
+    def disable_profiling(self):
+        self._profile = None
+
+    def enable_tracing(self, capacity=DEFAULT_TRACE_CAPACITY):
+        """
+        Make run_program() record every executed instruction into the ring
+        buffer of the capacity records. Other ways to run the program are
+        not traced
+        :return: TraceRecorder object
+        """
+        if self._profile is not None:
+            raise ValueError('Profiling and tracing can not be used at once')
+        if self._tracer is None:
+            self._tracer = TraceRecorder(capacity)
+        return self._tracer
+
+    def disable_tracing(self):
+        self._tracer = None
 
     def run_program(self):
         """
-        Subsequently execute commands from the self.memory
+        Subsequently execute commands from the self.memory. The batched
+        output subscribers get the rest of their batches once it stops
         """
+        try:
+            self._run_engine()
+        finally:
+            self._output_buffer.flush()
+
+    def _run_engine(self):
+        if self._profile is not None:
+            run_profiled_engine(self, self._profile)
+            return
+        if self._tracer is not None:
+            run_traced_engine(self, self._tracer)
+            return
+        if self._engine == EngineTypes.FAST.value:
+            run_fast_engine(self)
+            return
+        if self._engine == EngineTypes.TIERED.value:
+            run_tiered_engine(self, self._block_compiler,
+                              self._loop_accelerator)
+            return
+
         for command in self.command_generator():
             command.execute()
 
+    def run_slice(self, budget=None):
+        """
+        Execute the program until it halts, requests an input value, outputs
+        a value or executes the budget of instructions. The computer stops
+        right before the INPUT instruction, consume_input() executes it.
+        With the channels attached the computer runs on until the input
+        channel is empty or the output channel is full. The channels replace
+        the input and output buffers on every engine, so the buffer
+        observers are not notified of the channel I/O. Engines other than
+        the fast one run on the Command objects here. The batched output
+        subscribers get the rest of their batches once it stops, so do the
+        ones of run_until_io() and run_async() running on top of it
+        :param budget: maximum number of the instructions to execute
+        :return: (StopReasons member, number of the executed instructions)
+        tuple
+        """
+        if budget is None:
+            budget = sys.maxsize
+        try:
+            if self._engine == EngineTypes.FAST.value:
+                return run_fast_slice(self, budget)
+            return run_command_slice(self, budget)
+        finally:
+            self._output_buffer.flush()
+
+    def run_until_io(self, inputs=(), max_outputs=None):
+        """
+        Run the program until it needs an input value, has produced
+        max_outputs values or halts. The state is kept, so the next call
+        continues from there
+        :param inputs: input values for the program, the ones it doesn't
+        consume stay queued for the next calls. The attached input channel
+        is used instead of the queue if there is one. The input buffer
+        observers are not asked for these values
+        :param max_outputs: number of the output values to stop after, None
+        to stop only for the input or the halt
+        :return: IOResult with the status - StopReasons.HALTED,
+        INPUT_REQUIRED or OUTPUT - and the list of the output values
+        """
+        if max_outputs is not None and max_outputs < 1:
+            raise ValueError('max_outputs should be positive')
+        input_channel = self._input_channel
+        output_channel = self._output_channel
+        if input_channel is None:
+            self._input_channel = self._queued_inputs
+        inputs = list(inputs)
+        free_space = self._input_channel.free_space
+        if free_space is not None and free_space < len(inputs):
+            # nothing is queued, so the call may be retried
+            self._input_channel = input_channel
+            raise ChannelFull('The input channel has no space for the '
+                              'input values')
+        self._input_channel.put_many(inputs)
+        self._output_channel = Channel(capacity=max_outputs)
+        try:
+            reason, _ = self.run_slice()
+        finally:
+            outputs = self._output_channel.get_many()
+            self._input_channel = input_channel
+            self._output_channel = output_channel
+        if reason is StopReasons.OUTPUT_BLOCKED:
+            reason = StopReasons.OUTPUT
+        return IOResult(reason, outputs)
+
+    def consume_input(self, value):
+        """Execute the INPUT instruction the computer has stopped at with
+        the value"""
+        self.send_input_data(value)
+        self.execute_next_command()
+
+    async def run_async(self, input_source=None, output_sink=None,
+                        yield_every=DEFAULT_YIELD_INTERVAL):
+        """
+        Execute the program as a coroutine. The control is given back to the
+        event loop while waiting for an input value or for the output sink
+        and at least every yield_every instructions
+        :param input_source: coroutine function returning the next input
+        value or an object with such get() method, e.g. asyncio.Queue. The
+        input buffer observers are asked for the input if it is None
+        :param output_sink: coroutine function called with every output
+        value or an object with such put() method, e.g. asyncio.Queue
+        :param yield_every: number of the instructions executed between the
+        yields to the event loop
+        """
+        receive = getattr(input_source, 'get', input_source)
+        send = getattr(output_sink, 'put', output_sink)
+        budget = yield_every
+        while True:
+            reason, executed = self.run_slice(budget)
+            budget -= executed
+            if reason is StopReasons.HALTED:
+                return
+            if reason is StopReasons.INPUT_REQUIRED:
+                if receive is None:
+                    self.execute_next_command()
+                else:
+                    self.consume_input(await receive())
+                budget -= 1
+            elif reason is StopReasons.OUTPUT and send is not None:
+                await send(self.output_buffer.value)
+            elif reason is StopReasons.OUTPUT_BLOCKED:
+                # let the consumers drain the output channel
+                budget = 0
+            if budget <= 0:
+                await asyncio.sleep(0)
+                budget = yield_every
+
     def load_program(self, program):
         self.memory = program
         self.command_pointer = 0
@@ -0,0 +1,273 @@
+"""Conformance suite which runs the program of every day on all execution
+engines and memory backends of the IntcodeComputer and checks that they
+produce the same outputs and leave the computer in the same state. The
+cases with the channels run the program with run_until_io() while the
+buffer observers are subscribed, so every engine has to leave them out of
+the channel I/O the same way. The suite also checks that a write to the
+forked paged memory copies a single page.
+
+To run the suite execute from the project folder:
+
+python -m intcode_computer.conformance
+"""
+import time
+from collections import namedtuple
+from pathlib import Path
+
+from utils import ObserverMixin
+from intcode_computer.computer import IntcodeComputer
+from intcode_computer.engines import EngineTypes
+from intcode_computer.memory import MemoryTypes, PagedMemory, PAGE_SIZE, \
+    trimmed_memory
+from intcode_computer.program_image import write_program_image
+from intcode_computer.utils import parse_program
+
+INPUTS_FOLDER = Path(__file__).resolve().parent.parent / 'inputs'
+# pages of the memory forked by fork_copied_pages()
+FORK_PAGES = 4
+
+# names of the configurations running run_program() with the instrumented
+# loop of the profiler or the tracer in place of the engine
+PROFILED = 'profiled'
+TRACED = 'traced'
+INSTRUMENTED_ENGINES = (PROFILED, TRACED)
+
+ConformanceCase = namedtuple('ConformanceCase',
+                             'name input_file patches inputs channels',
+                             defaults=(False,))
+ConformanceResult = namedtuple('ConformanceResult',
+                               'case engine memory_type accelerate_loops '
+                               'state elapsed')
+
+
+def alternating_input(computer):
+    """Input policy for the interactive programs: answer with the parity of
+    the number of output pairs produced so far"""
+    return len(computer.output_history) // 2 % 2
+
+
+CONFORMANCE_CASES = (
+    ConformanceCase('day_2', 'task_2_input.txt', {1: 12, 2: 2}, ()),
+    ConformanceCase('day_2_part_2', 'task_2_part_2_input.txt',
+                    {1: 49, 2: 25}, ()),
+    ConformanceCase('day_5', 'task_5_input.txt', {}, (1,)),
+    ConformanceCase('day_5_part_2', 'task_5_part_2_input.txt', {}, (5,)),
+    ConformanceCase('day_7', 'task_7_input.txt', {}, (3, 0)),
+    ConformanceCase('day_7_phase_4', 'task_7_input.txt', {}, (4, 17)),
+    ConformanceCase('day_9', 'task_9_input.txt', {}, (1,)),
+    ConformanceCase('day_9_part_2', 'task_9_part_2_input.txt', {}, (2,)),
+    ConformanceCase('day_11', 'task_11_input.txt', {}, alternating_input),
+    ConformanceCase('day_11_part_2', 'task_11__part_2_input.txt', {},
+                    alternating_input),
+    ConformanceCase('day_13', 'task_13_input.txt', {}, ()),
+    ConformanceCase('day_5_channels', 'task_5_input.txt', {}, (1,), True),
+    ConformanceCase('day_9_channels', 'task_9_input.txt', {}, (1,), True),
+)
+
+
+class ScriptedInput(ObserverMixin):
+    """Provides the computer with the input values of the conformance case
+    whenever the input is requested"""
+    def __init__(self, computer, inputs):
+        self._computer = computer
+        if callable(inputs):
+            self._next_value = lambda: inputs(computer)
+        else:
+            values = iter(inputs)
+            self._next_value = lambda: next(values)
+        self.subscribe(computer.input_buffer, self.provide_input)
+
+    def provide_input(self, value):
+        if value:
+            self._computer.send_input_data(self._next_value())
+
+
+class BufferRecorder(ObserverMixin):
+    """Records the notifications of the input and output buffers of the
+    computer and answers the input requests with its own value"""
+    ANSWER = 777
+
+    def __init__(self, computer):
+        self._computer = computer
+        self.events = []
+        self.subscribe(computer.input_buffer, self.provide_input)
+        self.subscribe(computer.output_buffer, self.record_output)
+
+    def provide_input(self, value):
+        self.events.append(('input', value))
+        if value:
+            self._computer.send_input_data(self.ANSWER)
+
+    def record_output(self, value):
+        self.events.append(('output', value))
+
+    def detach(self):
+        self.unsubscribe(self._computer.input_buffer)
+        self.unsubscribe(self._computer.output_buffer)
+
+
+def run_channels(computer, inputs):
+    """
+    Run the program with run_until_io() until it halts or needs more input
+    values than given while the BufferRecorder is subscribed
+    :return: (status, outputs, events) tuple
+    """
+    recorder = BufferRecorder(computer)
+    result = computer.run_until_io(inputs)
+    recorder.detach()
+    return result.status.value, result.outputs, recorder.events
+
+
+def create_computer(program, engine, memory_type=MemoryTypes.LIST.value,
+                    accelerate_loops=False):
+    """
+    Create the computer of the configuration, see supported_configurations()
+    :return: IntcodeComputer object
+    """
+    if engine not in INSTRUMENTED_ENGINES:
+        return IntcodeComputer(program, engine=engine,
+                               memory_type=memory_type,
+                               accelerate_loops=accelerate_loops)
+    computer = IntcodeComputer(program, memory_type=memory_type)
+    if engine == PROFILED:
+        computer.enable_profiling()
+    else:
+        computer.enable_tracing()
+    return computer
+
+
+def run_case(case, engine, memory_type=MemoryTypes.LIST.value,
+             accelerate_loops=False):
+    """
+    Run the program of the conformance case on the given engine and memory
+    backend
+    :param accelerate_loops: accelerate the loops of the tiered engine
+    :return: ConformanceResult with the final (output_history, memory,
+    command_pointer, relative_base, channels) state of the computer, where
+    channels is the result of run_channels() for the cases with the
+    channels
+    """
+    program = parse_program(INPUTS_FOLDER / case.input_file)
+    for address, value in case.patches.items():
+        program[address] = value
+
+    image = None
+    if memory_type == MemoryTypes.IMAGE.value:
+        image = program = write_program_image(program)
+    computer = create_computer(program, engine, memory_type,
+                               accelerate_loops)
+    start = time.perf_counter()
+    if case.channels:
+        channels = run_channels(computer, case.inputs)
+    else:
+        feeder = ScriptedInput(computer, case.inputs)
+        computer.run_program()
+        feeder.unsubscribe(computer.input_buffer)
+        channels = None
+    elapsed = time.perf_counter() - start
+    if image is not None:
+        image.unlink()
+
+    state = (list(computer.output_history),
+             trimmed_memory(computer.memory),
+             computer.command_pointer,
+             computer.relative_base,
+             channels)
+    return ConformanceResult(case, engine, memory_type, accelerate_loops,
+                             state, elapsed)
+
+
+def supported_configurations(engines=None, memory_types=None):
+    """Return the (engine, memory_type, accelerate_loops) triples the
+    IntcodeComputer can be constructed with, the tiered engine comes both
+    with and without the loop acceleration. The INSTRUMENTED_ENGINES follow
+    the engines, create_computer() enables their instrumentation"""
+    if engines is None:
+        engines = [engine.value for engine in EngineTypes] + \
+            list(INSTRUMENTED_ENGINES)
+    if memory_types is None:
+        memory_types = [memory_type.value for memory_type in MemoryTypes]
+    configurations = []
+    for engine in engines:
+        for memory_type in memory_types:
+            if engine != EngineTypes.TIERED.value:
+                configurations.append((engine, memory_type, False))
+            elif memory_type in IntcodeComputer.TIERED_MEMORY_TYPES:
+                configurations.append((engine, memory_type, False))
+                configurations.append((engine, memory_type, True))
+    return configurations
+
+
+def configuration_name(engine, accelerate_loops=False):
+    """Return the engine name for the reports, marking the loop
+    acceleration"""
+    return engine + '+loops' if accelerate_loops else engine
+
+
+def run_conformance_suite(cases=CONFORMANCE_CASES, engines=None,
+                          memory_types=None):
+    """
+    Run every case on every engine and memory backend and compare the
+    results with the ones of the reference COMMAND engine on the LIST memory
+    :return: (results, mismatches) tuple, where mismatches is the list of
+    (case name, engine, memory_type) triples which diverged from the
+    reference
+    """
+    reference = (EngineTypes.COMMAND.value, MemoryTypes.LIST.value, False)
+
+    results = []
+    mismatches = []
+    for case in cases:
+        expected = run_case(case, *reference)
+        results.append(expected)
+        for configuration in supported_configurations(engines, memory_types):
+            if configuration == reference:
+                continue
+            result = run_case(case, *configuration)
+            results.append(result)
+            if result.state != expected.state:
+                engine, memory_type, accelerate_loops = configuration
+                mismatches.append((case.name,
+                                   configuration_name(engine,
+                                                      accelerate_loops),
+                                   memory_type))
+    return results, mismatches
+
+
+def fork_copied_pages():
+    """
+    Fork the paged memory holding FORK_PAGES pages and write one cell of
+    the fork
+    :return: number of the pages the write has copied, None if the write is
+    seen by the original memory
+    """
+    memory = PagedMemory(list(range(FORK_PAGES * PAGE_SIZE)))
+    fork = memory.fork()
+    address = PAGE_SIZE + 1
+    fork[address] = -1
+    if memory[address] != address or fork[address] != -1:
+        return None
+    shared = sum(1 for number, page in memory.pages.items()
+                 if fork.pages.get(number) is page)
+    return FORK_PAGES - shared
+
+
+if __name__ == '__main__':
+    copied_pages = fork_copied_pages()
+    if copied_pages != 1:
+        print('MISMATCH: one write to the forked memory copied %s pages' %
+              copied_pages)
+        raise SystemExit(1)
+    suite_results, suite_mismatches = run_conformance_suite()
+    for suite_result in suite_results:
+        print('%-16s %-12s %-6s %.4fs' % (
+            suite_result.case.name,
+            configuration_name(suite_result.engine,
+                               suite_result.accelerate_loops),
+            suite_result.memory_type, suite_result.elapsed))
+    if suite_mismatches:
+        for mismatch in suite_mismatches:
+            print('MISMATCH: %s on the %s engine with the %s memory' %
+                  mismatch)
+        raise SystemExit(1)
+    print('All engines conform')
@@ -0,0 +1,61 @@
+class DecodeCache:
+    """Per-program storage of already decoded instructions. Every entry is
+    keyed by the address of the instruction opcode and remembers which memory
+    cells the instruction occupies, so a write into any of those cells drops
+    only the affected entry and self-modifying programs keep working"""
+    @property
+    def entries(self):
+        return self._entries
+
+    @property
+    def owners(self):
+        """Mapping of the memory addresses to the cached entries covering
+        them"""
+        return self._owners
+
+    def __init__(self):
+        self._entries = {}
+        # memory address -> addresses of the cached instructions covering it
+        self._owners = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, address):
+        return address in self._entries
+
+    def get(self, address):
+        return self._entries.get(address)
+
+    def store(self, address, length, decoded):
+        """
+        Store the decoded instruction
+        :param address: address of the instruction opcode
+        :param length: number of memory cells the instruction occupies
+        :param decoded: decoded instruction object
+        """
+        self._entries[address] = decoded
+        self._add_owner(address, range(address, address + length))
+
+    def _add_owner(self, owner, cells):
+        """Mark the memory cells as occupied by the owner"""
+        owners = self._owners
+        for cell in cells:
+            cell_owners = owners.get(cell)
+            if cell_owners is None:
+                owners[cell] = {owner}
+            else:
+                cell_owners.add(owner)
+
+    def invalidate(self, address):
+        """Drop every cached instruction which occupies the given memory
+        address. Should be called on each memory write"""
+        owners = self._owners.pop(address, None)
+        if owners is None:
+            return
+        for owner in owners:
+            self._entries.pop(owner, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._owners.clear()
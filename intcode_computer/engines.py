@@ -0,0 +1,593 @@
+import sys
+from enum import Enum, unique
+
+from intcode_computer.commands import OpCodeExtended
+from intcode_computer.command_parameters import ParameterModes
+
+
+@unique
+class EngineTypes(Enum):
+    """Execution engines supported by the IntcodeComputer"""
+    COMMAND = 'command'
+    FAST = 'fast'
+    TIERED = 'tiered'
+
+
+_ADD = OpCodeExtended.ADD.value
+_MULT = OpCodeExtended.MULT.value
+_INPUT = OpCodeExtended.INPUT.value
+_OUTPUT = OpCodeExtended.OUTPUT.value
+_JUMP_IF_TRUE = OpCodeExtended.JUMP_IF_TRUE.value
+_JUMP_IF_FALSE = OpCodeExtended.JUMP_IF_FALSE.value
+_LESS_THAN = OpCodeExtended.LESS_THAN.value
+_EQUALS = OpCodeExtended.EQUALS.value
+_ADJUST_REL_BASE = OpCodeExtended.ADJUST_REL_BASE.value
+_TERM = OpCodeExtended.TERM.value
+
+_POSITION = ParameterModes.POSITION.value
+_IMMEDIATE = ParameterModes.IMMEDIATE.value
+_RELATIVE = ParameterModes.RELATIVE.value
+
+# op_code -> modes allowed for every parameter of the instruction. Result
+# parameters can't be in the IMMEDIATE mode
+_READ_MODES = (_POSITION, _IMMEDIATE, _RELATIVE)
+_WRITE_MODES = (_POSITION, _RELATIVE)
+INSTRUCTION_PARAMETERS = {
+    _ADD: (_READ_MODES, _READ_MODES, _WRITE_MODES),
+    _MULT: (_READ_MODES, _READ_MODES, _WRITE_MODES),
+    _INPUT: (_WRITE_MODES,),
+    _OUTPUT: (_READ_MODES,),
+    _JUMP_IF_TRUE: (_READ_MODES, _READ_MODES),
+    _JUMP_IF_FALSE: (_READ_MODES, _READ_MODES),
+    _LESS_THAN: (_READ_MODES, _READ_MODES, _WRITE_MODES),
+    _EQUALS: (_READ_MODES, _READ_MODES, _WRITE_MODES),
+    _ADJUST_REL_BASE: (_READ_MODES,),
+    _TERM: (),
+}
+
+
+def _build_decode_table():
+    """Build the mapping of every well-formed extended opcode to the
+    (op_code, mode_1, mode_2, mode_3) tuple"""
+    table = {}
+    for op_code, parameters in INSTRUCTION_PARAMETERS.items():
+        combinations = [()]
+        for allowed_modes in parameters:
+            combinations = [modes + (mode,) for modes in combinations
+                            for mode in allowed_modes]
+        for modes in combinations:
+            extended_opcode = op_code
+            for index, mode in enumerate(modes):
+                extended_opcode += mode * 10 ** (index + 2)
+            padded_modes = modes + (_POSITION,) * (3 - len(modes))
+            table[extended_opcode] = (op_code,) + padded_modes
+    return table
+
+
+DECODE_TABLE = _build_decode_table()
+
+
+def exchange_output(computer, address, relative_base, value):
+    """
+    Complete the OUTPUT instruction at the address: publish the value to the
+    output buffer observers and the output history
+    :return: (command_pointer, relative_base) tuple to continue from
+    """
+    computer.command_pointer = address
+    computer.relative_base = relative_base
+    computer.output_buffer.value = value
+    computer.output_history.append(value)
+    return _continue_after_io(computer, address)
+
+
+def exchange_input(computer, address, relative_base, mode, operand):
+    """
+    Complete the INPUT instruction at the address: request the input from the
+    observers and store it in the memory
+    :return: (command_pointer, relative_base) tuple to continue from
+    """
+    computer.command_pointer = address
+    computer.relative_base = relative_base
+    # the subscribers answer the input request by the outputs so far
+    computer.output_buffer.flush()
+    # subscribers should put data to the input_buffer
+    computer.input_buffer.request_input()
+    if mode == _RELATIVE:
+        operand += computer.relative_base
+    computer.memory[operand] = computer.input_buffer.value
+    return _continue_after_io(computer, address)
+
+
+def _continue_after_io(computer, address):
+    # observers might have moved the command pointer, e.g. reloaded the program
+    if computer.command_pointer == address:
+        return address + 2, computer.relative_base
+    return computer.command_pointer, computer.relative_base
+
+
+def run_fast_engine(computer, jump_hook=None):
+    """
+    Execute the program loaded into the computer with a flat dispatch loop.
+    Instructions are decoded with the DECODE_TABLE lookup and operate
+    directly on the memory container, so nothing is allocated per executed
+    instruction. Malformed instructions are delegated to the Command objects
+    to keep the behaviour of both engines identical. While the memory can't
+    be indexed directly, the loop goes through the Memory object instead of
+    the container. Writes into the cells of the instructions cached by the
+    decode cache of the computer, if it has one, invalidate them
+    :param jump_hook: function called with the target of every taken jump,
+    the execution stops before the target if it returns True
+    :return: True if the jump_hook has stopped the execution, False if the
+    program has halted
+    """
+    memory = computer.memory
+    decode = DECODE_TABLE.get
+    decode_cache = computer.decode_cache
+    owners = decode_cache.owners if decode_cache is not None else None
+
+    ip = computer.command_pointer
+    rb = computer.relative_base
+    # set while the control is handed over to the Command objects or to the
+    # observers, errors raised there are never retried
+    delegated = False
+
+    while True:
+        # some cells may hold values the container can't store, the Memory
+        # object resolves them until they are overwritten
+        mem = memory.container if memory.direct_access else memory
+        try:
+            while True:
+                decoded = decode(mem[ip])
+                if decoded is None:
+                    # let the Command objects handle (or reject) the
+                    # instruction the decode table doesn't know about
+                    computer.command_pointer = ip
+                    computer.relative_base = rb
+                    delegated = True
+                    if not computer.execute_next_command():
+                        return False
+                    delegated = False
+                    ip = computer.command_pointer
+                    rb = computer.relative_base
+                    break
+
+                op_code, mode_1, mode_2, mode_3 = decoded
+
+                if op_code == _TERM:
+                    computer.command_pointer = ip
+                    computer.relative_base = rb
+                    return False
+
+                # every remaining instruction reads the first parameter
+                # except the INPUT one which only writes to it
+                param_1 = mem[ip + 1]
+                if op_code != _INPUT:
+                    if mode_1 == _POSITION:
+                        param_1 = mem[param_1]
+                    elif mode_1 == _RELATIVE:
+                        param_1 = mem[rb + param_1]
+
+                if op_code == _ADJUST_REL_BASE:
+                    rb += param_1
+                    ip += 2
+                    continue
+
+                if op_code == _OUTPUT or op_code == _INPUT:
+                    delegated = True
+                    if op_code == _OUTPUT:
+                        ip, rb = exchange_output(computer, ip, rb, param_1)
+                    else:
+                        ip, rb = exchange_input(computer, ip, rb, mode_1,
+                                                param_1)
+                    delegated = False
+                    # observers might have reloaded the program
+                    break
+
+                param_2 = mem[ip + 2]
+
+                if op_code == _JUMP_IF_TRUE or op_code == _JUMP_IF_FALSE:
+                    # the jump target is only read if the jump is taken
+                    if (param_1 != 0) == (op_code == _JUMP_IF_TRUE):
+                        if mode_2 == _POSITION:
+                            param_2 = mem[param_2]
+                        elif mode_2 == _RELATIVE:
+                            param_2 = mem[rb + param_2]
+                        if param_2 != ip:
+                            ip = param_2
+                            if jump_hook is not None and jump_hook(ip):
+                                computer.command_pointer = ip
+                                computer.relative_base = rb
+                                return True
+                            continue
+                    ip += 3
+                    continue
+
+                if mode_2 == _POSITION:
+                    param_2 = mem[param_2]
+                elif mode_2 == _RELATIVE:
+                    param_2 = mem[rb + param_2]
+
+                result_addr = mem[ip + 3]
+                if mode_3 == _RELATIVE:
+                    result_addr += rb
+
+                if op_code == _ADD:
+                    mem[result_addr] = param_1 + param_2
+                elif op_code == _MULT:
+                    mem[result_addr] = param_1 * param_2
+                elif op_code == _LESS_THAN:
+                    mem[result_addr] = 1 if param_1 < param_2 else 0
+                else:
+                    mem[result_addr] = 1 if param_1 == param_2 else 0
+                if owners and result_addr in owners:
+                    decode_cache.invalidate(result_addr)
+                ip += 4
+        except (IndexError, OverflowError, ValueError):
+            if delegated:
+                raise
+            # the instruction touched memory the container doesn't hold or
+            # its result doesn't fit into it (typed containers raise
+            # OverflowError or ValueError). Nothing has been changed yet, so
+            # run it through the Memory object with the Command objects
+            computer.command_pointer = ip
+            computer.relative_base = rb
+            delegated = True
+            if not computer.execute_next_command():
+                return False
+            delegated = False
+            ip = computer.command_pointer
+            rb = computer.relative_base
+
+
+def run_instrumented_engine(computer, hook, missing=None):
+    """
+    Execute the program loaded into the computer calling the hook after
+    every executed instruction. The memory is accessed through the Memory
+    object, so the decode caches of the engines stay valid. This is the
+    loop the profiler and the tracer are built on, the engines never pay
+    for the instrumentation
+    :param hook: function called with the address, the extended opcode and
+    the relative base the instruction has started with, the addresses the
+    first and the second parameter have been read from, their values, the
+    address the result has been written to and its value. The fields the
+    instruction doesn't have are missing, so are the ones of the
+    instructions the decode table doesn't know about, those are executed by
+    the Command objects
+    :param missing: value passed for the missing fields
+    """
+    memory = computer.memory
+    decode = DECODE_TABLE.get
+
+    ip = computer.command_pointer
+    rb = computer.relative_base
+    while True:
+        address = ip
+        relative_base = rb
+        extended_opcode = memory[ip]
+        read_1 = operand_1 = read_2 = operand_2 = missing
+        write_address = write_value = missing
+        decoded = decode(extended_opcode)
+        if decoded is None:
+            computer.command_pointer = ip
+            computer.relative_base = rb
+            if not computer.execute_next_command():
+                return
+            ip = computer.command_pointer
+            rb = computer.relative_base
+            hook(address, extended_opcode, relative_base, read_1, operand_1,
+                 read_2, operand_2, write_address, write_value)
+            continue
+
+        op_code, mode_1, mode_2, mode_3 = decoded
+        if op_code == _TERM:
+            computer.command_pointer = ip
+            computer.relative_base = rb
+            return
+
+        param_1 = memory[ip + 1]
+        if op_code == _INPUT:
+            write_address = param_1 + rb if mode_1 == _RELATIVE else param_1
+            ip, rb = exchange_input(computer, ip, rb, mode_1, param_1)
+            write_value = memory[write_address]
+            hook(address, extended_opcode, relative_base, read_1, operand_1,
+                 read_2, operand_2, write_address, write_value)
+            continue
+
+        if mode_1 == _POSITION:
+            read_1 = param_1
+            param_1 = memory[param_1]
+        elif mode_1 == _RELATIVE:
+            read_1 = rb + param_1
+            param_1 = memory[read_1]
+        operand_1 = param_1
+
+        if op_code == _ADJUST_REL_BASE:
+            rb += param_1
+            ip += 2
+        elif op_code == _OUTPUT:
+            ip, rb = exchange_output(computer, ip, rb, param_1)
+        elif op_code == _JUMP_IF_TRUE or op_code == _JUMP_IF_FALSE:
+            # the jump target is only read if the jump is taken
+            if (param_1 != 0) == (op_code == _JUMP_IF_TRUE):
+                param_2 = memory[ip + 2]
+                if mode_2 == _POSITION:
+                    read_2 = param_2
+                    param_2 = memory[param_2]
+                elif mode_2 == _RELATIVE:
+                    read_2 = rb + param_2
+                    param_2 = memory[read_2]
+                operand_2 = param_2
+                ip = param_2 if param_2 != ip else ip + 3
+            else:
+                ip += 3
+        else:
+            param_2 = memory[ip + 2]
+            if mode_2 == _POSITION:
+                read_2 = param_2
+                param_2 = memory[param_2]
+            elif mode_2 == _RELATIVE:
+                read_2 = rb + param_2
+                param_2 = memory[read_2]
+            operand_2 = param_2
+
+            write_address = memory[ip + 3]
+            if mode_3 == _RELATIVE:
+                write_address += rb
+            if op_code == _ADD:
+                write_value = param_1 + param_2
+            elif op_code == _MULT:
+                write_value = param_1 * param_2
+            elif op_code == _LESS_THAN:
+                write_value = 1 if param_1 < param_2 else 0
+            else:
+                write_value = 1 if param_1 == param_2 else 0
+            memory[write_address] = write_value
+            ip += 4
+        hook(address, extended_opcode, relative_base, read_1, operand_1,
+             read_2, operand_2, write_address, write_value)
+
+
+@unique
+class StopReasons(Enum):
+    """Reasons the sliced execution gives the control back to the caller"""
+    HALTED = 'halted'
+    INPUT_REQUIRED = 'input_required'
+    OUTPUT = 'output'
+    OUTPUT_BLOCKED = 'output_blocked'
+    BUDGET_SPENT = 'budget_spent'
+
+
+def _execute_delegated(computer):
+    """
+    Execute the instruction at the command pointer with the Command objects.
+    INPUT and OUTPUT instructions use the channels of the computer if they
+    are attached, the same way run_fast_slice() does: the channels replace
+    the input and output buffers, so their observers are not notified
+    :return: (reason, executed) tuple, where reason is the StopReasons member
+    if the execution has to stop before or after the instruction or None and
+    executed is the number of the executed instructions, 0 or 1
+    """
+    memory = computer.memory
+    address = computer.command_pointer
+    extended_opcode = memory[address]
+    # the digits beyond the modes of the parameters are ignored, the same
+    # way the Command objects do
+    op_code = extended_opcode % 100
+    mode = extended_opcode // 100 % 10
+    if op_code == _INPUT:
+        input_channel = computer.input_channel
+        if not input_channel:
+            return StopReasons.INPUT_REQUIRED, 0
+        if mode in _WRITE_MODES:
+            return _exchange_channel(computer, op_code, mode,
+                                     memory[address + 1])
+        # the Command objects decide what the malformed instruction does
+        computer.send_input_data(input_channel.values[0])
+        computer.execute_next_command()
+        input_channel.values.popleft()
+        return None, 1
+    if op_code == _OUTPUT and computer.output_channel is not None and \
+            mode in _READ_MODES:
+        return _exchange_channel(computer, op_code, mode,
+                                 memory[address + 1])
+    if not computer.execute_next_command():
+        return StopReasons.HALTED, 0
+    if op_code == _OUTPUT:
+        return StopReasons.OUTPUT, 1
+    return None, 1
+
+
+def _exchange_channel(computer, op_code, mode, operand):
+    """
+    Execute the INPUT or OUTPUT instruction at the command pointer with the
+    channel instead of the buffers
+    :return: (reason, executed) tuple as _execute_delegated() does
+    """
+    memory = computer.memory
+    if mode == _RELATIVE:
+        operand += computer.relative_base
+    if op_code == _INPUT:
+        input_channel = computer.input_channel
+        # the value is taken only once it has been stored
+        memory[operand] = input_channel.values[0]
+        input_channel.values.popleft()
+        computer.command_pointer += 2
+        return None, 1
+
+    output_channel = computer.output_channel
+    if output_channel.full():
+        return StopReasons.OUTPUT_BLOCKED, 0
+    value = operand if mode == _IMMEDIATE else memory[operand]
+    output_channel.values.append(value)
+    computer.output_history.append(value)
+    computer.command_pointer += 2
+    if output_channel.full():
+        return StopReasons.OUTPUT_BLOCKED, 1
+    return None, 1
+
+
+def run_command_slice(computer, budget):
+    """
+    Execute at most budget instructions with the Command objects. The
+    execution stops right before an INPUT instruction and right after an
+    OUTPUT one, see run_fast_slice() for the attached channels
+    :return: (StopReasons member, number of the executed instructions) tuple
+    """
+    executed = 0
+    while executed < budget:
+        reason, count = _execute_delegated(computer)
+        executed += count
+        if reason is not None:
+            return reason, executed
+    return StopReasons.BUDGET_SPENT, executed
+
+
+def run_fast_slice(computer, budget):
+    """
+    Execute at most budget instructions with the flat dispatch loop of the
+    fast engine. The execution stops right before an INPUT instruction and
+    right after an OUTPUT one. If the input channel is attached to the
+    computer, INPUT instructions take its values and the execution stops
+    only once it is empty. If the output channel is attached, the values are
+    put there instead of the output buffer and the execution stops only
+    once it is full
+    :return: (StopReasons member, number of the executed instructions) tuple
+    """
+    memory = computer.memory
+    decode = DECODE_TABLE.get
+    input_channel = computer.input_channel
+    inputs = input_channel.values if input_channel is not None else None
+    output_channel = computer.output_channel
+    if output_channel is not None:
+        outputs = output_channel.values
+        output_capacity = output_channel.capacity \
+            if output_channel.capacity is not None else sys.maxsize
+        output_history = computer.output_history
+    else:
+        outputs = None
+
+    ip = computer.command_pointer
+    rb = computer.relative_base
+    executed = 0
+    # set when the next instruction has to be executed by the Command objects
+    fallback = False
+    # set while the control is handed over to the observers
+    delegated = False
+
+    while executed < budget:
+        if fallback:
+            fallback = False
+            computer.command_pointer = ip
+            computer.relative_base = rb
+            reason, count = _execute_delegated(computer)
+            executed += count
+            if reason is not None:
+                return reason, executed
+            ip = computer.command_pointer
+            rb = computer.relative_base
+            continue
+
+        # see run_fast_engine()
+        mem = memory.container if memory.direct_access else memory
+        try:
+            while executed < budget:
+                decoded = decode(mem[ip])
+                if decoded is None:
+                    fallback = True
+                    break
+
+                op_code, mode_1, mode_2, mode_3 = decoded
+                if op_code == _INPUT and inputs:
+                    result_addr = mem[ip + 1]
+                    if mode_1 == _RELATIVE:
+                        result_addr += rb
+                    # the value is taken only once it has been stored
+                    mem[result_addr] = inputs[0]
+                    inputs.popleft()
+                    ip += 2
+                    executed += 1
+                    continue
+                if op_code == _TERM or op_code == _INPUT:
+                    computer.command_pointer = ip
+                    computer.relative_base = rb
+                    return (StopReasons.HALTED if op_code == _TERM
+                            else StopReasons.INPUT_REQUIRED), executed
+
+                param_1 = mem[ip + 1]
+                if mode_1 == _POSITION:
+                    param_1 = mem[param_1]
+                elif mode_1 == _RELATIVE:
+                    param_1 = mem[rb + param_1]
+
+                if op_code == _ADJUST_REL_BASE:
+                    rb += param_1
+                    ip += 2
+                    executed += 1
+                    continue
+
+                if op_code == _OUTPUT and outputs is not None:
+                    if len(outputs) >= output_capacity:
+                        computer.command_pointer = ip
+                        computer.relative_base = rb
+                        return StopReasons.OUTPUT_BLOCKED, executed
+                    outputs.append(param_1)
+                    output_history.append(param_1)
+                    ip += 2
+                    executed += 1
+                    if len(outputs) >= output_capacity:
+                        computer.command_pointer = ip
+                        computer.relative_base = rb
+                        return StopReasons.OUTPUT_BLOCKED, executed
+                    continue
+
+                if op_code == _OUTPUT:
+                    delegated = True
+                    ip, rb = exchange_output(computer, ip, rb, param_1)
+                    computer.command_pointer = ip
+                    computer.relative_base = rb
+                    return StopReasons.OUTPUT, executed + 1
+
+                param_2 = mem[ip + 2]
+
+                if op_code == _JUMP_IF_TRUE or op_code == _JUMP_IF_FALSE:
+                    if (param_1 != 0) == (op_code == _JUMP_IF_TRUE):
+                        if mode_2 == _POSITION:
+                            param_2 = mem[param_2]
+                        elif mode_2 == _RELATIVE:
+                            param_2 = mem[rb + param_2]
+                        if param_2 != ip:
+                            ip = param_2
+                            executed += 1
+                            continue
+                    ip += 3
+                    executed += 1
+                    continue
+
+                if mode_2 == _POSITION:
+                    param_2 = mem[param_2]
+                elif mode_2 == _RELATIVE:
+                    param_2 = mem[rb + param_2]
+
+                result_addr = mem[ip + 3]
+                if mode_3 == _RELATIVE:
+                    result_addr += rb
+
+                if op_code == _ADD:
+                    mem[result_addr] = param_1 + param_2
+                elif op_code == _MULT:
+                    mem[result_addr] = param_1 * param_2
+                elif op_code == _LESS_THAN:
+                    mem[result_addr] = 1 if param_1 < param_2 else 0
+                else:
+                    mem[result_addr] = 1 if param_1 == param_2 else 0
+                ip += 4
+                executed += 1
+        except (IndexError, OverflowError, ValueError):
+            if delegated:
+                raise
+            # see run_fast_engine(), nothing has been changed yet
+            fallback = True
+
+    computer.command_pointer = ip
+    computer.relative_base = rb
+    return StopReasons.BUDGET_SPENT, executed
@@ -0,0 +1,528 @@
+"""Differential fuzzer of the engines and memory backends of the
+IntcodeComputer. Random valid programs with bounded loops, random parameter
+modes, input/output and self-modifying code are run on every engine and
+memory backend. The outputs, the final memory, the relative base, the
+command pointer and the number of the executed instructions are compared
+with the ones of the reference COMMAND engine on the LIST memory, the
+diverging programs are minimized into small reproducers:
+
+    python -m intcode_computer.fuzzer --programs 500 --seed 1
+
+Every program is run twice per configuration: with run_program() and the
+input buffer observers, and with run_slice() and the channels while the
+buffer observers are subscribed, the latter counts the executed
+instructions. The tiered engine has no slice path of
+its own, its run_slice() executes the Command objects, so the compiled
+blocks and the loop accelerator are covered by run_program() only and
+their instruction counts are not compared. So is the instrumented loop of
+the profiled and the traced configurations.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from collections import namedtuple, defaultdict
+
+from intcode_computer.channels import Channel
+from intcode_computer.commands import OpCodeExtended
+from intcode_computer.command_parameters import ParameterModes
+from intcode_computer.conformance import BufferRecorder, ScriptedInput, \
+    INSTRUMENTED_ENGINES, create_computer, supported_configurations, \
+    configuration_name
+from intcode_computer.engines import EngineTypes, StopReasons
+from intcode_computer.memory import MemoryTypes, trimmed_memory
+from intcode_computer.program_image import write_program_image
+
+# the reference configuration every other one is compared with
+REFERENCE = (EngineTypes.COMMAND.value, MemoryTypes.LIST.value, False)
+# the code has to fit below the constants, the data follows them
+CONSTANTS_ADDRESS = 1000
+COUNTERS_ADDRESS = 1400
+WRITABLE_ADDRESS = 1500
+WRITABLE_SIZE = 64
+# cells beyond the program the writes may grow the memory to
+FAR_ADDRESSES = (4000, 8000)
+MAX_LOOPS = 3
+MAX_BODY_LENGTH = 24
+# well above the HOT_BLOCK_THRESHOLD, so the loop bodies get compiled
+MAX_ITERATIONS = 40
+MAX_ADJUSTMENT = 4
+# instructions run_slice() executes before the program is declared stuck,
+# the generated programs execute a few thousand at most
+MAX_STEPS = 10 ** 5
+# immediate values which don't fit into 64 bits or come close to it
+BIG_VALUES = (2 ** 40, -2 ** 45, 2 ** 63 - 1, 2 ** 70, -2 ** 66)
+
+FuzzCase = namedtuple('FuzzCase',
+                      'seed program inputs instructions counters')
+Divergence = namedtuple('Divergence', 'seed engine memory_type '
+                                      'accelerate_loops expected actual '
+                                      'program inputs')
+FuzzReport = namedtuple('FuzzReport',
+                        'programs skipped divergences throughput')
+
+_POSITION = ParameterModes.POSITION.value
+_IMMEDIATE = ParameterModes.IMMEDIATE.value
+_RELATIVE = ParameterModes.RELATIVE.value
+
+_BINARY = 'binary'
+_INPUT = 'input'
+_OUTPUT = 'output'
+_JUMP = 'jump'
+_ADJUST = 'adjust'
+_PATCH = 'patch'
+_KIND_WEIGHTS = {_BINARY: 45, _INPUT: 8, _OUTPUT: 12, _JUMP: 12,
+                 _ADJUST: 10, _PATCH: 8}
+_KIND_LENGTHS = {_BINARY: 4, _INPUT: 2, _OUTPUT: 2, _JUMP: 3, _ADJUST: 2,
+                 _PATCH: 4}
+_BINARY_OP_CODES = (OpCodeExtended.ADD, OpCodeExtended.MULT,
+                    OpCodeExtended.LESS_THAN, OpCodeExtended.EQUALS)
+_READ_MODES = (_POSITION, _IMMEDIATE, _RELATIVE)
+_WRITE_MODES = (_POSITION, _RELATIVE)
+# instructions of the same length doing nothing, the minimizer puts them
+# in place of the removed ones to keep the addresses
+_NO_OPS = {2: [109, 0], 3: [1106, 1, 0], 4: [109, 0, 109, 0]}
+
+
+def _instruction(op_code, modes, *params):
+    extended_opcode = op_code.value
+    for index, mode in enumerate(modes):
+        extended_opcode += mode * 10 ** (index + 2)
+    return [extended_opcode] + list(params)
+
+
+class _ProgramBuilder:
+    """Generates the program keeping track of the relative base, every
+    relative parameter addresses the intended cell"""
+    def __init__(self, rng):
+        self._rng = rng
+        self._constants = []
+        self._relative_base = WRITABLE_ADDRESS
+
+    def constant(self, value):
+        """Return the address of the read-only cell holding the value"""
+        self._constants.append(value)
+        return CONSTANTS_ADDRESS + len(self._constants) - 1
+
+    def read(self, value=None):
+        """
+        :param value: value the parameter should read, either immediate or
+        from a constant cell. A random value or cell if None
+        :return: (mode, parameter) tuple
+        """
+        rng = self._rng
+        mode = rng.choice(_READ_MODES)
+        if value is None:
+            if mode == _IMMEDIATE:
+                if rng.random() < 0.05:
+                    return mode, rng.choice(BIG_VALUES)
+                return mode, rng.randint(-50, 50)
+            address = rng.randrange(WRITABLE_ADDRESS + WRITABLE_SIZE)
+        elif mode == _IMMEDIATE:
+            return mode, value
+        else:
+            address = self.constant(value)
+        if mode == _RELATIVE:
+            return mode, address - self._relative_base
+        return mode, address
+
+    def write(self, far=True):
+        rng = self._rng
+        if far and rng.random() < 0.1:
+            address = rng.randrange(*FAR_ADDRESSES)
+        else:
+            address = rng.randrange(WRITABLE_ADDRESS,
+                                    WRITABLE_ADDRESS + WRITABLE_SIZE)
+        mode = rng.choice(_WRITE_MODES)
+        if mode == _RELATIVE:
+            return mode, address - self._relative_base
+        return mode, address
+
+    def adjust(self, amount):
+        self._relative_base += amount
+
+    def fill(self, program):
+        """Append the constants to the program"""
+        if len(program) > CONSTANTS_ADDRESS:
+            raise ValueError('The code does not fit below the constants')
+        if len(self._constants) > COUNTERS_ADDRESS - CONSTANTS_ADDRESS:
+            raise ValueError('Too many constants')
+        program += [0] * (CONSTANTS_ADDRESS - len(program))
+        program += self._constants
+
+
+def generate_program(seed):
+    """
+    Generate the random valid program: bounded loops of random instructions.
+    The jumps only go forward within the loop body and never skip the
+    relative base adjustments, the self-modifying instructions switch the
+    op_codes and the modes of the instructions which take any of them
+    :return: FuzzCase
+    """
+    rng = random.Random(seed)
+    builder = _ProgramBuilder(rng)
+    program = _instruction(OpCodeExtended.ADJUST_REL_BASE, (_IMMEDIATE,),
+                           WRITABLE_ADDRESS)
+    instructions = []
+    counters = {}
+    inputs_needed = 0
+    kinds_population = list(_KIND_WEIGHTS)
+    weights = list(_KIND_WEIGHTS.values())
+
+    for loop in range(rng.randint(1, MAX_LOOPS)):
+        iterations = rng.randint(1, MAX_ITERATIONS)
+        counter = COUNTERS_ADDRESS + loop
+        counters[counter] = iterations
+        kinds = rng.choices(kinds_population, weights,
+                            k=rng.randint(1, MAX_BODY_LENGTH))
+        patchable = [index for index, kind in enumerate(kinds)
+                     if kind == _BINARY]
+        if not patchable:
+            kinds = [_BINARY if kind == _PATCH else kind for kind in kinds]
+            patchable = [index for index, kind in enumerate(kinds)
+                         if kind == _BINARY]
+        patch_targets = {index: rng.choice(patchable)
+                         for index, kind in enumerate(kinds)
+                         if kind == _PATCH}
+
+        start = len(program)
+        addresses = []
+        address = start
+        for kind in kinds:
+            addresses.append(address)
+            address += _KIND_LENGTHS[kind]
+        tail = address
+
+        drift = 0
+        for index, kind in enumerate(kinds):
+            if kind == _BINARY:
+                op_code = rng.choice(_BINARY_OP_CODES)
+                if index in patch_targets.values():
+                    # any patched op_code and modes read and write valid
+                    # addresses
+                    modes = (rng.choice((_POSITION, _IMMEDIATE)),
+                             rng.choice((_POSITION, _IMMEDIATE)),
+                             _POSITION)
+                    params = [rng.randrange(WRITABLE_ADDRESS + WRITABLE_SIZE)
+                              for _ in range(2)]
+                    params.append(rng.randrange(
+                        WRITABLE_ADDRESS, WRITABLE_ADDRESS + WRITABLE_SIZE))
+                else:
+                    (mode_1, param_1), (mode_2, param_2) = \
+                        builder.read(), builder.read()
+                    mode_3, param_3 = builder.write()
+                    modes = (mode_1, mode_2, mode_3)
+                    params = [param_1, param_2, param_3]
+                cells = _instruction(op_code, modes, *params)
+            elif kind == _INPUT:
+                mode, param = builder.write(far=False)
+                cells = _instruction(OpCodeExtended.INPUT, (mode,), param)
+                inputs_needed += iterations
+            elif kind == _OUTPUT:
+                mode, param = builder.read()
+                cells = _instruction(OpCodeExtended.OUTPUT, (mode,), param)
+            elif kind == _JUMP:
+                op_code = rng.choice((OpCodeExtended.JUMP_IF_TRUE,
+                                      OpCodeExtended.JUMP_IF_FALSE))
+                # skipping an adjustment would lose the track of the
+                # relative base
+                limit = next((later for later in range(index + 1, len(kinds))
+                              if kinds[later] == _ADJUST), len(kinds))
+                target_index = rng.randint(index + 1, limit)
+                target = addresses[target_index] \
+                    if target_index < len(kinds) else tail
+                mode_1, param_1 = builder.read()
+                mode_2, param_2 = builder.read(target)
+                cells = _instruction(op_code, (mode_1, mode_2), param_1,
+                                     param_2)
+            elif kind == _ADJUST:
+                amount = rng.randint(-MAX_ADJUSTMENT, MAX_ADJUSTMENT)
+                mode, param = builder.read(amount)
+                cells = _instruction(OpCodeExtended.ADJUST_REL_BASE, (mode,),
+                                     param)
+                builder.adjust(amount)
+                drift += amount
+            else:
+                target = addresses[patch_targets[index]]
+                value = rng.choice(_BINARY_OP_CODES).value + \
+                    rng.choice((_POSITION, _IMMEDIATE)) * 100 + \
+                    rng.choice((_POSITION, _IMMEDIATE)) * 1000
+                cells = _instruction(OpCodeExtended.ADD,
+                                     (_IMMEDIATE, _IMMEDIATE, _POSITION),
+                                     value, 0, target)
+            instructions.append((addresses[index], len(cells)))
+            program += cells
+
+        if drift:
+            program += _instruction(OpCodeExtended.ADJUST_REL_BASE,
+                                    (_IMMEDIATE,), -drift)
+            builder.adjust(-drift)
+        program += _instruction(OpCodeExtended.ADD, (_POSITION, _IMMEDIATE),
+                                counter, -1, counter)
+        program += _instruction(OpCodeExtended.JUMP_IF_TRUE,
+                                (_POSITION, _IMMEDIATE), counter, start)
+    program.append(OpCodeExtended.TERM.value)
+
+    builder.fill(program)
+    program += [0] * (WRITABLE_ADDRESS + WRITABLE_SIZE - len(program))
+    for counter, iterations in counters.items():
+        program[counter] = iterations
+    for address in range(WRITABLE_ADDRESS, WRITABLE_ADDRESS + WRITABLE_SIZE):
+        program[address] = rng.randint(-20, 20)
+    inputs = [rng.randint(-100, 100) for _ in range(inputs_needed)]
+    return FuzzCase(seed, program, inputs, instructions, sorted(counters))
+
+
+def _guarded(function):
+    try:
+        return function()
+    except Exception as error:
+        return 'error', type(error).__name__, str(error)
+
+
+def execute(program, inputs, engine, memory_type, accelerate_loops=False):
+    """
+    Run the program on the configuration with run_slice() and, if it has
+    halted within MAX_STEPS instructions, with run_program()
+    :return: (state, instructions, elapsed) tuple, where the state is the
+    comparable tuple of the final states of both runs and instructions is
+    the number of the instructions run_slice() has executed
+    """
+    image = None
+    if memory_type == MemoryTypes.IMAGE.value:
+        image = write_program_image(program)
+
+    def load():
+        return create_computer(image if image is not None else list(program),
+                               engine, memory_type, accelerate_loops)
+
+    def run_program():
+        computer = load()
+        feeder = ScriptedInput(computer, inputs)
+        started = time.perf_counter()
+        computer.run_program()
+        elapsed = time.perf_counter() - started
+        feeder.unsubscribe(computer.input_buffer)
+        return (tuple(computer.output_history),
+                tuple(trimmed_memory(computer.memory)),
+                computer.relative_base, computer.command_pointer), elapsed
+
+    def run_slice():
+        computer = load()
+        computer.input_channel = Channel(inputs, capacity=None)
+        computer.output_channel = Channel(capacity=None)
+        # the channels replace the buffers, the observers stay silent
+        recorder = BufferRecorder(computer)
+        reason, executed = computer.run_slice(MAX_STEPS)
+        recorder.detach()
+        return (reason.value, tuple(computer.output_channel.values),
+                tuple(trimmed_memory(computer.memory)),
+                computer.relative_base, computer.command_pointer,
+                tuple(recorder.events)), executed
+
+    try:
+        sliced = _guarded(run_slice)
+        # run_program() has no budget, a minimized program may loop forever
+        if sliced[0] != 'error' and \
+                sliced[0][0] == StopReasons.HALTED.value:
+            native = _guarded(run_program)
+        else:
+            native = ('error', 'NotHalted', '')
+    finally:
+        if image is not None:
+            image.unlink()
+    elapsed = native[1] if native[0] != 'error' else 0.0
+    instructions = sliced[1] if sliced[0] != 'error' else 0
+    state = (native[0] if native[0] != 'error' else native,
+             sliced[0] if sliced[0] != 'error' else sliced,
+             instructions)
+    return state, instructions, elapsed
+
+
+def _is_valid(state):
+    """Return True if both runs have halted without errors"""
+    return all(part[0] != 'error' for part in state[:2])
+
+
+def diverges(program, inputs, engine, memory_type, accelerate_loops=False):
+    """Return True if the configuration ends up in another state than the
+    reference one which runs the program without errors"""
+    expected, _, _ = execute(program, inputs, *REFERENCE)
+    if not _is_valid(expected):
+        return False
+    actual, _, _ = execute(program, inputs, engine, memory_type,
+                           accelerate_loops)
+    return actual != expected
+
+
+def minimize(case, engine, memory_type, accelerate_loops=False):
+    """
+    Shrink the diverging program: replace its instructions by no-ops of the
+    same length, lower the loop iterations and drop the input values as long
+    as the configuration still diverges
+    :return: (program, inputs) tuple
+    """
+    program = list(case.program)
+    inputs = list(case.inputs)
+    remaining = list(case.instructions)
+
+    chunk = len(remaining)
+    while chunk:
+        index = 0
+        while index < len(remaining):
+            candidate = list(program)
+            for address, length in remaining[index:index + chunk]:
+                candidate[address:address + length] = _NO_OPS[length]
+            if diverges(candidate, inputs, engine, memory_type,
+                        accelerate_loops):
+                program = candidate
+                del remaining[index:index + chunk]
+            else:
+                index += chunk
+        chunk //= 2
+
+    for counter in case.counters:
+        while program[counter] > 1:
+            candidate = list(program)
+            candidate[counter] = program[counter] // 2
+            if not diverges(candidate, inputs, engine, memory_type,
+                            accelerate_loops):
+                break
+            program = candidate
+
+    while inputs and diverges(program, inputs[:-1], engine, memory_type,
+                              accelerate_loops):
+        inputs.pop()
+    return program, inputs
+
+
+def fuzz(programs=100, seed=0, engines=None, memory_types=None,
+         minimize_divergences=True, progress=None):
+    """
+    Generate the programs and run them on every supported configuration
+    :param seed: seed of the first program, the next ones are consecutive
+    :param progress: function called with every Divergence
+    :return: FuzzReport with the number of the programs, the number of
+    them skipped as the reference failed on them, the list of the
+    Divergence objects and the mapping of the (engine, memory_type) pairs
+    to their instructions per second, the engine of the accelerated tiered
+    configuration is named tiered+loops
+    """
+    configurations = [configuration for configuration
+                      in supported_configurations(engines, memory_types)
+                      if configuration != REFERENCE]
+    instructions_run = defaultdict(int)
+    time_spent = defaultdict(float)
+    divergences = []
+    skipped = 0
+    for case_seed in range(seed, seed + programs):
+        case = generate_program(case_seed)
+        expected, instructions, elapsed = execute(case.program, case.inputs,
+                                                  *REFERENCE)
+        if not _is_valid(expected):
+            skipped += 1
+            continue
+        for configuration in (REFERENCE,) + tuple(configurations):
+            engine, memory_type, accelerate_loops = configuration
+            if configuration == REFERENCE:
+                actual = expected
+            else:
+                actual, instructions, elapsed = execute(
+                    case.program, case.inputs, *configuration)
+            name = (configuration_name(engine, accelerate_loops),
+                    memory_type)
+            instructions_run[name] += instructions
+            time_spent[name] += elapsed
+            if actual == expected:
+                continue
+            program, inputs = case.program, case.inputs
+            if minimize_divergences:
+                program, inputs = minimize(case, *configuration)
+                expected_minimized, _, _ = execute(program, inputs,
+                                                   *REFERENCE)
+                actual, _, _ = execute(program, inputs, *configuration)
+            else:
+                expected_minimized = expected
+            divergence = Divergence(case_seed, engine, memory_type,
+                                    accelerate_loops, expected_minimized,
+                                    actual, program, inputs)
+            divergences.append(divergence)
+            if progress is not None:
+                progress(divergence)
+
+    throughput = {configuration: instructions_run[configuration] /
+                  time_spent[configuration]
+                  for configuration in time_spent
+                  if time_spent[configuration]}
+    return FuzzReport(programs, skipped, divergences, throughput)
+
+
+def report_to_dict(report):
+    return {
+        'programs': report.programs,
+        'skipped': report.skipped,
+        'divergences': [{
+            'seed': divergence.seed,
+            'engine': divergence.engine,
+            'memory_type': divergence.memory_type,
+            'accelerate_loops': divergence.accelerate_loops,
+            'expected': repr(divergence.expected),
+            'actual': repr(divergence.actual),
+            'program': ','.join(map(str, trimmed_memory(divergence.program))),
+            'inputs': divergence.inputs,
+        } for divergence in report.divergences],
+        'throughput': [{'engine': engine, 'memory_type': memory_type,
+                        'instructions_per_second': instructions_per_second}
+                       for (engine, memory_type), instructions_per_second
+                       in sorted(report.throughput.items())],
+    }
+
+
+def _print_divergence(divergence):
+    print('DIVERGENCE: seed %d on the %s engine with the %s memory' %
+          (divergence.seed, configuration_name(divergence.engine,
+                                               divergence.accelerate_loops),
+           divergence.memory_type))
+    print('  program: %s' % ','.join(map(str,
+                                         trimmed_memory(divergence.program))))
+    print('  inputs: %s' % divergence.inputs)
+    print('  expected: %r' % (divergence.expected,))
+    print('  actual: %r' % (divergence.actual,))
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(
+        description='Compare the engines and the memory backends of the '
+                    'IntcodeComputer on random programs')
+    parser.add_argument('--programs', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the first program')
+    parser.add_argument('--engines', nargs='+',
+                        choices=[engine.value for engine in EngineTypes] +
+                        list(INSTRUMENTED_ENGINES))
+    parser.add_argument('--memory-types', nargs='+',
+                        choices=[memory_type.value
+                                 for memory_type in MemoryTypes])
+    parser.add_argument('--no-minimize', action='store_true',
+                        help='report the diverging programs as generated')
+    parser.add_argument('--output', help='path of the JSON report')
+    options = parser.parse_args(arguments)
+
+    report = fuzz(options.programs, options.seed, options.engines,
+                  options.memory_types, not options.no_minimize,
+                  progress=_print_divergence)
+    for (engine, memory_type), instructions_per_second in \
+            sorted(report.throughput.items()):
+        print('%-12s %-6s %12.0f instr/s' % (engine, memory_type,
+                                             instructions_per_second))
+    print('%d programs, %d skipped, %d divergences' %
+          (report.programs, report.skipped, len(report.divergences)))
+    if options.output:
+        with open(options.output, 'w') as report_file:
+            json.dump(report_to_dict(report), report_file, indent=2)
+    return 1 if report.divergences else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
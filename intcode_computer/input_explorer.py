@@ -0,0 +1,178 @@
+from collections import namedtuple, OrderedDict
+
+from utils import ObserverMixin
+
+# snapshots and results kept by the InputExplorer by default
+DEFAULT_MAX_SNAPSHOTS = 4096
+
+ExplorationResult = namedtuple('ExplorationResult',
+                               'outputs halted consumed computer')
+
+
+class _InputsExhausted(Exception):
+    """Raised from the input callback to stop the computer which requested
+    more input values than the explored sequence has"""
+
+
+class _TrieNode:
+    """Node of the trie of the input values supplied so far. It may hold the
+    snapshot of the computer requesting the next input value and the result
+    of the program which halted after consuming exactly this prefix"""
+    __slots__ = ('parent', 'value', 'children', 'snapshot', 'result')
+
+    def __init__(self, parent, value):
+        self.parent = parent
+        self.value = value
+        self.children = {}
+        self.snapshot = None
+        self.result = None
+
+    def child(self, value):
+        node = self.children.get(value)
+        if node is None:
+            node = self.children[value] = _TrieNode(self, value)
+        return node
+
+
+class _SnapshotFeeder(ObserverMixin):
+    """Supplies the input values of the explored sequence to the computer and
+    stores the snapshot of the computer on every input request"""
+    @property
+    def node(self):
+        return self._node
+
+    @property
+    def consumed(self):
+        return self._consumed
+
+    def __init__(self, explorer, computer, node, inputs, consumed):
+        self._explorer = explorer
+        self._computer = computer
+        self._node = node
+        self._inputs = inputs
+        self._consumed = consumed
+        self.subscribe(computer.input_buffer, self.provide_input)
+
+    def provide_input(self, value):
+        if not value:
+            return
+        if self._node.snapshot is None:
+            self._node.snapshot = self._computer.fork()
+        self._explorer._remember(self._node)
+
+        if self._consumed == len(self._inputs):
+            raise _InputsExhausted()
+        value = self._inputs[self._consumed]
+        self._consumed += 1
+        self._node = self._node.child(value)
+        self._computer.send_input_data(value)
+
+
+class InputExplorer:
+    """Runs one program with many input sequences. The state of the computer
+    is saved every time the input is requested into the trie keyed by the
+    input values supplied so far, so a new sequence resumes from the
+    snapshot of its longest already explored prefix instead of starting from
+    the beginning. The least recently used snapshots are evicted once there
+    are more than max_snapshots of them"""
+    @property
+    def snapshots(self):
+        """Number of the snapshots and results currently stored"""
+        return len(self._entries)
+
+    @property
+    def executed_runs(self):
+        return self._executed_runs
+
+    @property
+    def cached_results(self):
+        return self._cached_results
+
+    def __init__(self, computer, max_snapshots=DEFAULT_MAX_SNAPSHOTS):
+        # the explored computer itself is never changed
+        self._origin = computer.fork()
+        self._max_snapshots = max_snapshots
+        self._root = _TrieNode(None, None)
+        # LRU order of the nodes holding a snapshot or a result
+        self._entries = OrderedDict()
+        self._executed_runs = 0
+        self._cached_results = 0
+
+    def run(self, inputs):
+        """
+        Run the program with the sequence of input values
+        :param inputs: iterable of the input values
+        :return: ExplorationResult with the outputs of the program, flag
+        whether it has halted or requested more input values than given,
+        the number of the input values consumed and a copy of the computer
+        in its final state
+        """
+        inputs = tuple(inputs)
+        node = self._root
+        resume_node, resume_depth = None, 0
+        for depth in range(len(inputs) + 1):
+            if node.result is not None:
+                # the program halts before reading the rest of the inputs
+                self._remember(node)
+                self._cached_results += 1
+                return self._copy_result(node.result)
+            if node.snapshot is not None:
+                resume_node, resume_depth = node, depth
+            if depth == len(inputs):
+                break
+            node = node.children.get(inputs[depth])
+            if node is None:
+                break
+
+        if resume_node is None:
+            computer = self._origin.fork()
+            resume_node = self._root
+        else:
+            self._remember(resume_node)
+            computer = resume_node.snapshot.fork()
+
+        feeder = _SnapshotFeeder(self, computer, resume_node, inputs,
+                                 resume_depth)
+        self._executed_runs += 1
+        try:
+            computer.run_program()
+        except _InputsExhausted:
+            # the computer is left right before the INPUT instruction
+            feeder.unsubscribe(computer.input_buffer)
+            return ExplorationResult(list(computer.output_history), False,
+                                     feeder.consumed, computer)
+        feeder.unsubscribe(computer.input_buffer)
+
+        result = ExplorationResult(list(computer.output_history), True,
+                                   feeder.consumed, computer)
+        feeder.node.result = result
+        self._remember(feeder.node)
+        return self._copy_result(result)
+
+    def _remember(self, node):
+        """Mark the node as the most recently used one and evict the least
+        recently used snapshots if there are too many of them"""
+        entries = self._entries
+        if node in entries:
+            entries.move_to_end(node)
+            return
+        entries[node] = None
+        while len(entries) > self._max_snapshots:
+            evicted, _ = entries.popitem(last=False)
+            evicted.snapshot = None
+            evicted.result = None
+            self._prune(evicted)
+
+    @staticmethod
+    def _prune(node):
+        """Drop the branch of the trie which leads to nothing stored"""
+        while node.parent is not None and not node.children and \
+                node.snapshot is None and node.result is None:
+            del node.parent.children[node.value]
+            node = node.parent
+
+    @staticmethod
+    def _copy_result(result):
+        # the stored computer is never given away, it could be run further
+        return result._replace(outputs=list(result.outputs),
+                               computer=result.computer.fork())
@@ -0,0 +1,320 @@
+"""Lockstep engine which runs many variants of one program at once. The
+states of all the virtual machines are kept in NumPy arrays: the memory
+matrix with a row per machine (lane) and the vectors of the command pointers
+and relative bases. Every step executes one instruction on every running
+lane, lanes at different instructions are grouped by their opcode.
+
+Lanes which leave the vectorized model - access memory out of the matrix,
+overflow 64 bits or execute a malformed instruction - are finished by the
+scalar IntcodeComputer, so every lane gets exactly the scalar results:
+
+    variants = [Variant({1: noun, 2: verb}, ())
+                for noun in range(100) for verb in range(100)]
+    results = run_lockstep(program, variants, observed_cells=(0,))
+
+The engine requires NumPy.
+"""
+try:
+    import numpy as np
+except ImportError:  # the lockstep engine is optional
+    np = None
+
+from intcode_computer.batch import BatchResult, run_with_inputs
+from intcode_computer.computer import IntcodeComputer
+from intcode_computer.engines import EngineTypes, DECODE_TABLE, \
+    INSTRUCTION_PARAMETERS
+from intcode_computer.commands import OpCodeExtended
+from intcode_computer.command_parameters import ParameterModes
+
+# every row of the memory matrix is this many times longer than the program
+# by default
+DEFAULT_MEMORY_FACTOR = 2
+# products which may not fit into 64 bits are left to the scalar computer
+_SAFE_PRODUCT = 2.0 ** 62
+
+_RUNNING, _HALTED, _BLOCKED, _ESCAPED = range(4)
+
+_ADD = OpCodeExtended.ADD.value
+_MULT = OpCodeExtended.MULT.value
+_INPUT = OpCodeExtended.INPUT.value
+_OUTPUT = OpCodeExtended.OUTPUT.value
+_JUMP_IF_TRUE = OpCodeExtended.JUMP_IF_TRUE.value
+_JUMP_IF_FALSE = OpCodeExtended.JUMP_IF_FALSE.value
+_LESS_THAN = OpCodeExtended.LESS_THAN.value
+_EQUALS = OpCodeExtended.EQUALS.value
+_ADJUST_REL_BASE = OpCodeExtended.ADJUST_REL_BASE.value
+_TERM = OpCodeExtended.TERM.value
+
+_IMMEDIATE = ParameterModes.IMMEDIATE.value
+_RELATIVE = ParameterModes.RELATIVE.value
+
+
+def _add_overflows(left, right, result):
+    # the wrapped sum has the sign different from both of the terms
+    return ((left ^ result) & (right ^ result)) < 0
+
+
+class LockstepMachine:
+    """Runs every variant of the program on its own lane of the NumPy arrays.
+    Lanes which halt or request more input values than their variant has
+    are masked out, lanes which can't be executed with the vector
+    operations are handed over to the scalar IntcodeComputer"""
+    @property
+    def steps(self):
+        return self._steps
+
+    @property
+    def escaped_lanes(self):
+        """Number of the lanes finished by the scalar computer"""
+        return len(self._scalar_results)
+
+    def __init__(self, program, variants, memory_size=None,
+                 engine=EngineTypes.FAST.value):
+        if np is None:
+            raise ImportError('The lockstep engine requires numpy')
+        self._program = list(program)
+        self._variants = list(variants)
+        self._engine = engine
+        lanes = len(self._variants)
+        if memory_size is None:
+            memory_size = len(self._program) * DEFAULT_MEMORY_FACTOR
+        self._width = max(memory_size, len(self._program))
+
+        self._memory = np.zeros((lanes, self._width), dtype=np.int64)
+        self._pointer = np.zeros(lanes, dtype=np.int64)
+        self._relative_base = np.zeros(lanes, dtype=np.int64)
+        self._state = np.full(lanes, _RUNNING, dtype=np.int8)
+        self._outputs = [[] for _ in range(lanes)]
+        self._input_index = np.zeros(lanes, dtype=np.int64)
+        input_width = max((len(variant.inputs) for variant in self._variants),
+                          default=0)
+        self._inputs = np.zeros((lanes, input_width), dtype=np.int64)
+        self._input_count = np.zeros(lanes, dtype=np.int64)
+        # lane -> (outputs, memory, halted) of the lanes finished by the
+        # scalar computer
+        self._scalar_results = {}
+        self._steps = 0
+
+        try:
+            self._memory[:, :len(self._program)] = self._program
+        except OverflowError:
+            # the program itself doesn't fit into 64 bits
+            self._escape(np.arange(lanes))
+            return
+        unfit = []
+        for lane, variant in enumerate(self._variants):
+            try:
+                for address, value in variant.patches.items():
+                    if not 0 <= address < self._width:
+                        raise IndexError(address)
+                    self._memory[lane, address] = value
+                self._inputs[lane, :len(variant.inputs)] = variant.inputs
+                self._input_count[lane] = len(variant.inputs)
+            except (IndexError, OverflowError):
+                unfit.append(lane)
+        self._escape(np.array(unfit, dtype=np.int64))
+
+    def run(self):
+        """Execute the steps until every lane halts, blocks or escapes"""
+        while self.step():
+            pass
+
+    def step(self):
+        """
+        Execute one instruction on every running lane
+        :return: False if there are no running lanes left
+        """
+        lanes = np.flatnonzero(self._state == _RUNNING)
+        if not lanes.size:
+            return False
+        self._steps += 1
+
+        pointers = self._pointer[lanes]
+        lanes = self._keep(lanes, (pointers >= 0) & (pointers < self._width))
+        op_codes = self._memory[lanes, self._pointer[lanes]]
+        if op_codes.size and (op_codes == op_codes[0]).all():
+            # the lanes haven't diverged, nothing to sort
+            extended_opcodes = [int(op_codes[0])]
+        else:
+            extended_opcodes = np.unique(op_codes).tolist()
+        for extended_opcode in extended_opcodes:
+            group = lanes[op_codes == extended_opcode]
+            decoded = DECODE_TABLE.get(extended_opcode)
+            if decoded is None:
+                # the Command objects handle (or reject) it
+                self._escape(group)
+            else:
+                self._execute(group, decoded)
+        return True
+
+    def results(self, observed_cells=()):
+        """
+        :return: list of BatchResult objects in the order of the variants
+        """
+        # the unallocated cells read as zeroes
+        columns = {address: self._memory[:, address].tolist()
+                   if 0 <= address < self._width
+                   else [0] * len(self._variants)
+                   for address in observed_cells}
+        halted_lanes = (self._state == _HALTED).tolist()
+
+        results = []
+        for lane, variant in enumerate(self._variants):
+            if lane in self._scalar_results:
+                outputs, memory, halted = self._scalar_results[lane]
+                cells = {address: memory[address] if address < len(memory)
+                         else 0 for address in observed_cells}
+            else:
+                outputs = list(self._outputs[lane])
+                cells = {address: column[lane]
+                         for address, column in columns.items()}
+                halted = halted_lanes[lane]
+            results.append(BatchResult(lane, variant, outputs, cells,
+                                       halted))
+        return results
+
+    def _execute(self, lanes, decoded):
+        op_code = decoded[0]
+        if op_code == _TERM:
+            self._state[lanes] = _HALTED
+            return
+
+        parameter_count = len(INSTRUCTION_PARAMETERS[op_code])
+        lanes = self._keep(
+            lanes, self._pointer[lanes] + parameter_count < self._width)
+        # the jump target is only checked when the jump is taken
+        checked = (1,) if op_code in (_JUMP_IF_TRUE, _JUMP_IF_FALSE) \
+            else range(1, parameter_count + 1)
+        for parameter in checked:
+            lanes = self._keep_valid_address(lanes, parameter,
+                                             decoded[parameter])
+        if not lanes.size:
+            return
+
+        if op_code in (_ADD, _MULT, _LESS_THAN, _EQUALS):
+            left = self._read(lanes, 1, decoded[1])
+            right = self._read(lanes, 2, decoded[2])
+            if op_code == _ADD:
+                result = left + right
+                fits = ~_add_overflows(left, right, result)
+            elif op_code == _MULT:
+                fits = np.abs(left.astype(np.float64) *
+                              right.astype(np.float64)) < _SAFE_PRODUCT
+                result = left * right
+            elif op_code == _LESS_THAN:
+                result = (left < right).astype(np.int64)
+                fits = None
+            else:
+                result = (left == right).astype(np.int64)
+                fits = None
+            if fits is not None and not fits.all():
+                lanes, result = self._keep(lanes, fits), result[fits]
+            self._memory[lanes, self._address(lanes, 3, decoded[3])] = result
+            self._pointer[lanes] += 4
+        elif op_code == _ADJUST_REL_BASE:
+            value = self._read(lanes, 1, decoded[1])
+            relative_base = self._relative_base[lanes]
+            result = relative_base + value
+            fits = ~_add_overflows(relative_base, value, result)
+            lanes, result = self._keep(lanes, fits), result[fits]
+            self._relative_base[lanes] = result
+            self._pointer[lanes] += 2
+        elif op_code == _OUTPUT:
+            values = self._read(lanes, 1, decoded[1])
+            for lane, value in zip(lanes.tolist(), values.tolist()):
+                self._outputs[lane].append(value)
+            self._pointer[lanes] += 2
+        elif op_code == _INPUT:
+            has_input = self._input_index[lanes] < self._input_count[lanes]
+            self._state[lanes[~has_input]] = _BLOCKED
+            lanes = lanes[has_input]
+            self._memory[lanes, self._address(lanes, 1, decoded[1])] = \
+                self._inputs[lanes, self._input_index[lanes]]
+            self._input_index[lanes] += 1
+            self._pointer[lanes] += 2
+        else:
+            condition = self._read(lanes, 1, decoded[1])
+            taken = condition != 0 if op_code == _JUMP_IF_TRUE \
+                else condition == 0
+            self._pointer[lanes[~taken]] += 3
+            lanes = self._keep_valid_address(lanes[taken], 2, decoded[2])
+            pointers = self._pointer[lanes]
+            targets = self._read(lanes, 2, decoded[2])
+            # a jump to the jump itself moves to the next instruction
+            self._pointer[lanes] = np.where(targets != pointers, targets,
+                                            pointers + 3)
+
+    def _operand(self, lanes, parameter):
+        return self._memory[lanes, self._pointer[lanes] + parameter]
+
+    def _address(self, lanes, parameter, mode):
+        address = self._operand(lanes, parameter)
+        if mode == _RELATIVE:
+            address = address + self._relative_base[lanes]
+        return address
+
+    def _read(self, lanes, parameter, mode):
+        if mode == _IMMEDIATE:
+            return self._operand(lanes, parameter)
+        return self._memory[lanes, self._address(lanes, parameter, mode)]
+
+    def _keep_valid_address(self, lanes, parameter, mode):
+        """Escape the lanes which address the parameter out of the memory
+        matrix"""
+        if mode == _IMMEDIATE or not lanes.size:
+            return lanes
+        address = self._address(lanes, parameter, mode)
+        return self._keep(lanes, (address >= 0) & (address < self._width))
+
+    def _keep(self, lanes, mask):
+        """Escape the lanes which don't match the mask and return the rest"""
+        if not mask.all():
+            self._escape(lanes[~mask])
+            return lanes[mask]
+        return lanes
+
+    def _lane_memory(self, lane):
+        """Return the memory of the lane as a list without the trailing
+        zeroes past the program"""
+        row = self._memory[lane]
+        used = np.flatnonzero(row)
+        length = max(len(self._program),
+                     int(used[-1]) + 1 if used.size else 0)
+        return row[:length].tolist()
+
+    def _escape(self, lanes):
+        """Finish the lanes with the scalar IntcodeComputer"""
+        for lane in lanes.tolist():
+            variant = self._variants[lane]
+            if self._steps == 0:
+                # the variant doesn't fit into the matrix at all
+                computer = IntcodeComputer(list(self._program),
+                                           engine=self._engine)
+                for address, value in variant.patches.items():
+                    computer.memory[address] = value
+                inputs = variant.inputs
+            else:
+                computer = IntcodeComputer(self._lane_memory(lane),
+                                           engine=self._engine)
+                inputs = variant.inputs[int(self._input_index[lane]):]
+            computer.command_pointer = int(self._pointer[lane])
+            computer.relative_base = int(self._relative_base[lane])
+            computer.output_history.extend(self._outputs[lane])
+            halted = run_with_inputs(computer, inputs)
+            self._scalar_results[lane] = (list(computer.output_history),
+                                          list(computer.memory), halted)
+            self._state[lane] = _ESCAPED
+
+
+def run_lockstep(program, variants, observed_cells=(), memory_size=None,
+                 engine=EngineTypes.FAST.value):
+    """
+    Run every variant of the program on the lockstep engine
+    :param memory_size: number of the memory cells of every lane, the lanes
+    addressing the memory past it are finished by the scalar computer
+    :param engine: engine of the scalar computer
+    :return: list of BatchResult objects in the order of the variants
+    """
+    machine = LockstepMachine(program, variants, memory_size, engine)
+    machine.run()
+    return machine.results(observed_cells)
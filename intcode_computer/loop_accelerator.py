@@ -0,0 +1,294 @@
+from collections import namedtuple
+
+from intcode_computer.commands import OpCodeExtended
+from intcode_computer.command_parameters import ParameterModes
+
+# loops which would exit earlier are left to run as usual
+MIN_ACCELERATED_ITERATIONS = 4
+
+# result of the comparison of two affine expressions
+Comparison = namedtuple('Comparison', 'op_code left right')
+LoopSummary = namedtuple('LoopSummary',
+                         'start end instruction_count inductions '
+                         'assignments flags condition continue_if_true')
+
+
+class LoopPatternMismatch(Exception):
+    """Raised when the loop body can't be summarized. Structural mismatches
+    depend only on the code of the loop and the relative base and are never
+    retried, the other ones depend on the values of the loop cells"""
+    def __init__(self, message, structural=True):
+        super().__init__(message)
+        self.structural = structural
+
+
+def _constant(value):
+    return {None: value}
+
+
+def _add(left, right):
+    result = dict(left)
+    for cell, coefficient in right.items():
+        result[cell] = result.get(cell, 0) + coefficient
+    return {cell: coefficient for cell, coefficient in result.items()
+            if coefficient != 0 or cell is None}
+
+
+def _scale(expression, factor):
+    return {cell: coefficient * factor
+            for cell, coefficient in expression.items()
+            if coefficient * factor != 0 or cell is None}
+
+
+def _is_constant(expression):
+    return all(cell is None for cell in expression)
+
+
+class LoopAccelerator:
+    """Recognizes counting loops: basic blocks which jump back to their own
+    start and only do arithmetic on memory cells. The body is executed
+    symbolically once, every written cell must turn out to be either an
+    induction cell (increased by a constant on every iteration), a cell
+    assigned a constant or a comparison flag. The loop condition then gives
+    the number of iterations and the final state is stored at once"""
+    @property
+    def accelerated_loops(self):
+        return self._accelerated_loops
+
+    @property
+    def skipped_instructions(self):
+        return self._skipped_instructions
+
+    def __init__(self, computer, block_compiler,
+                 min_iterations=MIN_ACCELERATED_ITERATIONS):
+        self._computer = computer
+        self._block_compiler = block_compiler
+        self._min_iterations = min_iterations
+        # (block start, relative base) -> block which can't be accelerated
+        self._mismatches = {}
+        self._accelerated_loops = 0
+        self._skipped_instructions = 0
+
+    def accelerate(self, block, relative_base):
+        """
+        Try to run the loop formed by the compiled block to completion
+        :return: command pointer to continue from or None if the loop has
+        not been accelerated and should run as usual
+        """
+        key = (block.start, relative_base)
+        if self._mismatches.get(key) is block:
+            return None
+
+        memory = self._computer.memory
+        try:
+            summary = self.summarize(
+                self._block_compiler.scan_block(block.start),
+                relative_base, memory.container)
+            iterations = self._count_iterations(summary, memory.container)
+        except LoopPatternMismatch as mismatch:
+            if mismatch.structural:
+                self._mismatches[key] = block
+            return None
+
+        if iterations < self._min_iterations:
+            return None
+
+        last_iteration = iterations - 1
+        final_values = {}
+        for cell, step in summary.inductions.items():
+            final_values[cell] = memory[cell] + iterations * step
+        final_values.update(summary.assignments)
+        for cell, comparison in summary.flags.items():
+            final_values[cell] = self._evaluate_comparison(
+                comparison, summary, memory.container, last_iteration)
+
+        # the Memory object invalidates whatever code was overwritten
+        for cell, value in final_values.items():
+            memory[cell] = value
+
+        self._accelerated_loops += 1
+        self._skipped_instructions += iterations * summary.instruction_count
+        return summary.end
+
+    def summarize(self, instructions, relative_base, container):
+        """
+        Execute one iteration of the loop body symbolically
+        :return: LoopSummary object
+        """
+        if not instructions:
+            raise LoopPatternMismatch('Empty loop body')
+        start = instructions[0][0]
+        jump_address, jump_op_code, jump_modes, jump_operands = \
+            instructions[-1]
+        end = jump_address + len(jump_operands) + 1
+        if jump_op_code not in (OpCodeExtended.JUMP_IF_TRUE.value,
+                                OpCodeExtended.JUMP_IF_FALSE.value):
+            raise LoopPatternMismatch('Loop body does not end with a jump')
+        if jump_modes[1] != ParameterModes.IMMEDIATE.value or \
+                jump_operands[1] != start or jump_address == start:
+            raise LoopPatternMismatch('Jump does not lead to the loop start')
+
+        def resolve(mode, operand):
+            address = operand
+            if mode == ParameterModes.RELATIVE.value:
+                address += relative_base
+            if not 0 <= address < len(container):
+                # the memory seldom grows under a running loop, it is not
+                # worth retrying
+                raise LoopPatternMismatch('Address outside of the memory')
+            return address
+
+        body = instructions[:-1]
+        written = set()
+        for address, op_code, modes, operands in body:
+            if op_code not in (OpCodeExtended.ADD.value,
+                               OpCodeExtended.MULT.value,
+                               OpCodeExtended.LESS_THAN.value,
+                               OpCodeExtended.EQUALS.value):
+                raise LoopPatternMismatch('Op code %d in the loop body' %
+                                          op_code)
+            written.add(resolve(modes[2], operands[2]))
+        if any(start <= cell < end for cell in written):
+            raise LoopPatternMismatch('Loop body modifies its own code')
+
+        environment = {}
+
+        def read(mode, operand):
+            if mode == ParameterModes.IMMEDIATE.value:
+                return _constant(operand)
+            address = resolve(mode, operand)
+            if address in environment:
+                return environment[address]
+            if address in written:
+                return {None: 0, address: 1}
+            # cells the loop doesn't write keep their values
+            return _constant(container[address])
+
+        def read_affine(mode, operand):
+            value = read(mode, operand)
+            if isinstance(value, Comparison):
+                raise LoopPatternMismatch('Comparison used in arithmetic')
+            return value
+
+        for address, op_code, modes, operands in body:
+            left = read_affine(modes[0], operands[0])
+            right = read_affine(modes[1], operands[1])
+            if op_code == OpCodeExtended.ADD.value:
+                value = _add(left, right)
+            elif op_code == OpCodeExtended.MULT.value:
+                if _is_constant(left):
+                    value = _scale(right, left[None])
+                elif _is_constant(right):
+                    value = _scale(left, right[None])
+                else:
+                    raise LoopPatternMismatch('Non-linear multiplication')
+            else:
+                value = Comparison(op_code, left, right)
+            environment[resolve(modes[2], operands[2])] = value
+
+        inductions = {}
+        assignments = {}
+        flags = {}
+        for cell in written:
+            value = environment[cell]
+            if isinstance(value, Comparison):
+                flags[cell] = value
+            elif _is_constant(value):
+                assignments[cell] = value[None]
+            elif set(value) == {None, cell} and value[cell] == 1:
+                inductions[cell] = value[None]
+            else:
+                raise LoopPatternMismatch('Cell %d is not an induction '
+                                          'variable' % cell)
+
+        condition = read(jump_modes[0], jump_operands[0])
+        expressions = list(flags.values()) + [condition]
+        for expression in expressions:
+            parts = (expression.left, expression.right) \
+                if isinstance(expression, Comparison) else (expression,)
+            for part in parts:
+                if any(cell is not None and cell not in inductions
+                       for cell in part):
+                    raise LoopPatternMismatch('Condition depends on a '
+                                              'non-induction cell')
+
+        return LoopSummary(
+            start, end, len(instructions), inductions, assignments, flags,
+            condition, jump_op_code == OpCodeExtended.JUMP_IF_TRUE.value)
+
+    @staticmethod
+    def _progression(expression, summary, container):
+        """Return (initial value, step) of the affine expression over the
+        loop iterations"""
+        initial = expression.get(None, 0)
+        step = 0
+        for cell, coefficient in expression.items():
+            if cell is not None:
+                initial += coefficient * container[cell]
+                step += coefficient * summary.inductions[cell]
+        return initial, step
+
+    def _evaluate_comparison(self, comparison, summary, container,
+                             iteration):
+        left, left_step = self._progression(comparison.left, summary,
+                                            container)
+        right, right_step = self._progression(comparison.right, summary,
+                                              container)
+        left += iteration * left_step
+        right += iteration * right_step
+        if comparison.op_code == OpCodeExtended.LESS_THAN.value:
+            return 1 if left < right else 0
+        return 1 if left == right else 0
+
+    def _count_iterations(self, summary, container):
+        """
+        Get the number of iterations the loop is going to run from now on
+        including the last one which exits the loop
+        """
+        condition = summary.condition
+        if isinstance(condition, Comparison):
+            left, left_step = self._progression(condition.left, summary,
+                                                container)
+            right, right_step = self._progression(condition.right, summary,
+                                                  container)
+            difference, step = left - right, left_step - right_step
+            # the jump checks the flag: 1 if the comparison holds
+            holds_when = '<0' \
+                if condition.op_code == OpCodeExtended.LESS_THAN.value \
+                else '==0'
+        else:
+            difference, step = self._progression(condition, summary,
+                                                  container)
+            # the jump checks the value itself: true if it is not zero
+            holds_when = '!=0'
+
+        negations = {'<0': '>=0', '==0': '!=0', '!=0': '==0'}
+        continue_when = holds_when if summary.continue_if_true \
+            else negations[holds_when]
+
+        exit_iteration = self._first_exit(continue_when, difference, step)
+        if exit_iteration is None:
+            raise LoopPatternMismatch('Loop never exits', structural=False)
+        return exit_iteration + 1
+
+    @staticmethod
+    def _first_exit(continue_when, value, step):
+        """Get the first iteration k >= 0 for which value + k * step doesn't
+        satisfy the continue_when relation to zero"""
+        if continue_when == '<0':
+            if value >= 0:
+                return 0
+            return None if step <= 0 else (-value + step - 1) // step
+        if continue_when == '>=0':
+            if value < 0:
+                return 0
+            return None if step >= 0 else value // -step + 1
+        if continue_when == '==0':
+            if value != 0:
+                return 0
+            return None if step == 0 else 1
+        if value == 0:
+            return 0
+        if step == 0 or -value % step != 0 or -value // step < 0:
+            return None
+        return -value // step
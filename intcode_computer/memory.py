@@ -1,28 +1,112 @@
+import copy
+from array import array
+from enum import Enum, unique
+
+from intcode_computer.program_image import ProgramImage, BIG_CELL, \
+    pack_cells
+
+
+def trimmed_memory(container):
+    """Return the memory content without the trailing zeroes. Unallocated
+    cells read as zeroes, so engines may grow the memory differently"""
+    cells = list(container)
+    while cells and cells[-1] == 0:
+        cells.pop()
+    return cells
+
+
+@unique
+class MemoryTypes(Enum):
+    """Memory backends supported by the IntcodeComputer"""
+    LIST = 'list'
+    TYPED = 'typed'
+    PAGED = 'paged'
+    IMAGE = 'image'
+
+
+# marks the cells of the TypedMemory which don't fit into 64 bits
+_BIG_CELL = BIG_CELL
+# number of cells in one page of the PagedMemory
+PAGE_SIZE = 4096
+
+
 class Memory:
     """Storage for the IntComputer class. It should store the command
     instructions to run the program. This class behaves as a normal list
     except it may contain some additional logic if required"""
     @property
     def container(self):
+        """Storage of the cells. Accessing it gives the memory its own copy
+        of the cells shared with the forked memories, so the container may
+        be modified directly"""
+        if self._share_count[0] > 1:
+            self._unshare()
         return self._container
 
     @container.setter
     def container(self, value):
+        if self._share_count[0] > 1:
+            self._unshare(copy_cells=False)
         self._container = value
+        if self._decode_cache is not None:
+            self._decode_cache.clear()
 
-    @container.setter
-    def container(self, value):
-        self._container = value
+    @property
+    def decode_cache(self):
+        return self._decode_cache
 
-    def __init__(self, program=None):
+    @decode_cache.setter
+    def decode_cache(self, value):
+        """DecodeCache object that should be notified about every write"""
+        self._decode_cache = value
+
+    def __init__(self, program=None, decode_cache=None):
         self._container = program if program is not None else []
+        self._decode_cache = decode_cache
+        # number of the memories sharing the container, shared by all of them
+        self._share_count = [1]
+
+    @property
+    def direct_access(self):
+        """True if every cell of the container holds the actual value of the
+        memory cell, so the engines may index the container directly"""
+        return True
 
     def __getitem__(self, item):
         return self._container.__getitem__(item)
 
     def __setitem__(self, key, value):
+        if self._share_count[0] > 1:
+            self._unshare()
+        if self._decode_cache is not None:
+            self._decode_cache.invalidate(key)
         return self._container.__setitem__(key, value)
 
+    def __len__(self):
+        return len(self._container)
+
+    def __iter__(self):
+        return iter(self._container)
+
+    def fork(self, decode_cache=None):
+        """
+        Create a copy of the memory which shares the cells with this one.
+        The cells are copied by the memory which modifies them first
+        :param decode_cache: DecodeCache object of the new memory
+        :return: Memory object of the same class
+        """
+        child = copy.copy(self)
+        child._decode_cache = decode_cache
+        self._share_count[0] += 1
+        return child
+
+    def _unshare(self, copy_cells=True):
+        """Stop sharing the container with the forked memories"""
+        self._share_count[0] -= 1
+        self._share_count = [1]
+        if copy_cells:
+            self._container = self._container[:]
+
 
 class DynamicMemory(Memory):
     """This class behaves exactly as its superclass but also it is capable
@@ -52,4 +136,377 @@ class DynamicMemory(Memory):
         current_size = len(self._container)
         items_to_add = index - current_size
         items_to_add = (items_to_add * 3) + 1
+        self._allocate(items_to_add)
+
+    def _allocate(self, items_to_add):
         self.container.extend([0]*items_to_add)
+
+
+class TypedMemory(DynamicMemory):
+    """Dynamic memory stored in a compact array of signed 64 bit integers.
+    Values which don't fit into 64 bits are kept as Python ints in a side
+    table and their cells are marked in the array. The engines index the
+    container directly only while there are no such cells. The array saves
+    the int object of every cell the list keeps, but every read from it
+    creates one, so this backend trades speed for footprint"""
+    @property
+    def container(self):
+        return Memory.container.fget(self)
+
+    @container.setter
+    def container(self, value):
+        self._big_cells = {}
+        Memory.container.fset(self, self._pack(value))
+
+    @property
+    def big_cells(self):
+        """Mapping of the addresses to the values which don't fit into the
+        array"""
+        return self._big_cells
+
+    @property
+    def direct_access(self):
+        return not self._big_cells
+
+    def __init__(self, program=None, decode_cache=None):
+        self._big_cells = {}
+        super().__init__(self._pack(program if program is not None else []),
+                         decode_cache=decode_cache)
+
+    def __getitem__(self, item):
+        try:
+            value = self._container[item]
+        except IndexError:
+            if item >= len(self._container):
+                self._reallocate_memory(item)
+                return 0
+            raise
+        if self._big_cells:
+            # only the marked cells and the slices need the side table
+            if value == _BIG_CELL:
+                return self._big_cells.get(self._address(item), value)
+            if item.__class__ is slice:
+                return self._resolve(item, value)
+        return value
+
+    def __setitem__(self, key, value):
+        if self._share_count[0] > 1:
+            self._unshare()
+        if self._decode_cache is not None:
+            self._decode_cache.invalidate(key)
+        try:
+            self._container[key] = value
+        except IndexError:
+            if key >= len(self._container):
+                self._reallocate_memory(key)
+                return self.__setitem__(key, value)
+            raise
+        except OverflowError:
+            self._container[key] = _BIG_CELL
+            self._big_cells[self._address(key)] = value
+            return
+        if self._big_cells:
+            self._big_cells.pop(self._address(key), None)
+
+    def __iter__(self):
+        big_cells = self._big_cells
+        for address, value in enumerate(self._container):
+            yield big_cells.get(address, value) if value == _BIG_CELL \
+                else value
+
+    def _unshare(self, copy_cells=True):
+        super()._unshare(copy_cells)
+        self._big_cells = dict(self._big_cells)
+
+    def _address(self, key):
+        # negative keys index the memory from its end like the list does
+        return key + len(self._container) if key < 0 else key
+
+    def _resolve(self, item, value):
+        """Replace the marks of the big cells in the slice read from the
+        array by the actual values"""
+        addresses = range(*item.indices(len(self._container)))
+        return [self._big_cells.get(address, cell)
+                if cell == _BIG_CELL else cell
+                for address, cell in zip(addresses, value)]
+
+    def _pack(self, program):
+        """Convert the program to the array moving the values which don't
+        fit into it to the big cells"""
+        packed, self._big_cells = pack_cells(program)
+        return packed
+
+    def _allocate(self, items_to_add):
+        self.container.frombytes(
+            bytes(items_to_add * self._container.itemsize))
+
+
+class PagedMemory(Memory):
+    """Sparse memory which never allocates the cells between the program and
+    a far address. The container is a dense list starting at the address 0,
+    it holds the program and grows page by page while the accessed addresses
+    stay next to its end. Any other address belongs to a fixed size page
+    which is allocated on the first write, unallocated cells read as zeroes.
+    The number of allocated pages may be limited with max_pages. Forking
+    moves the dense container to the pages, so the forked memories copy
+    only the pages they access and take them back into the container"""
+    # the container takes over the pages next to its end
+    GROWS_CONTAINER = True
+
+    @property
+    def pages(self):
+        """Page table: mapping of the page numbers to the pages out of the
+        dense container"""
+        return self._pages
+
+    @property
+    def pages_touched(self):
+        """Number of pages allocated so far including the dense container"""
+        return -(-len(self._container) // self._page_size) + len(self._pages)
+
+    @property
+    def container(self):
+        return Memory.container.fget(self)
+
+    @container.setter
+    def container(self, value):
+        self._pages = {}
+        self._private_pages = set()
+        Memory.container.fset(self, value)
+
+    def __init__(self, program=None, decode_cache=None,
+                 page_size=PAGE_SIZE, max_pages=None):
+        super().__init__(program, decode_cache=decode_cache)
+        self._page_size = page_size
+        self._max_pages = max_pages
+        self._pages = {}
+        # pages which aren't shared with the forked memories
+        self._private_pages = set()
+
+    def __getitem__(self, item):
+        if item.__class__ is slice:
+            return [self[address] for address in
+                    range(item.start or 0, item.stop, item.step or 1)]
+        try:
+            return self._container[item]
+        except IndexError:
+            if item < 0:
+                raise
+        return self._read_page(item)
+
+    def __setitem__(self, key, value):
+        if self._share_count[0] > 1:
+            self._unshare()
+        if self._decode_cache is not None:
+            self._decode_cache.invalidate(key)
+        try:
+            self._container[key] = value
+        except IndexError:
+            if key < 0:
+                raise
+            self._write_page(key, value)
+
+    def __len__(self):
+        if not self._pages:
+            return len(self._container)
+        return (max(self._pages) + 1) * self._page_size
+
+    def __iter__(self):
+        yield from self._container
+        for address in range(len(self._container), len(self)):
+            page = self._pages.get(address // self._page_size)
+            yield page[address % self._page_size] if page is not None else 0
+
+    def fork(self, decode_cache=None):
+        # the pages stay shared until one of the memories writes to them
+        if self.GROWS_CONTAINER:
+            self._split_container()
+        child = super().fork(decode_cache)
+        if self.GROWS_CONTAINER:
+            # the container is empty, nothing to share
+            self._share_count[0] -= 1
+            child._share_count = [1]
+            child._container = []
+        child._pages = dict(self._pages)
+        child._private_pages = set()
+        self._private_pages = set()
+        return child
+
+    def _split_container(self):
+        """Move the cells of the dense container to the pages"""
+        container = self._container
+        page_size = self._page_size
+        for start in range(0, len(container), page_size):
+            page = container[start:start + page_size]
+            if len(page) < page_size:
+                page.extend([0] * (page_size - len(page)))
+            self._pages[start // page_size] = page
+        if self._share_count[0] > 1:
+            self._unshare(copy_cells=False)
+        self._container = []
+
+    def _read_page(self, address):
+        """Read the address out of the container"""
+        page_number, offset = divmod(address, self._page_size)
+        if self.GROWS_CONTAINER and \
+                page_number * self._page_size <= len(self._container):
+            # keep the memory next to the program dense
+            self._extend_container(page_number)
+            return self._container[address]
+        page = self._pages.get(page_number)
+        return page[offset] if page is not None else 0
+
+    def _write_page(self, address, value):
+        """Write to the address out of the container"""
+        page_number, offset = divmod(address, self._page_size)
+        if self.GROWS_CONTAINER and \
+                page_number * self._page_size <= len(self._container):
+            self._extend_container(page_number)
+            self._container[address] = value
+            return
+        page = self._pages.get(page_number)
+        if page is None:
+            self._check_limit()
+            page = [0] * self._page_size
+        elif page_number not in self._private_pages:
+            page = page[:]
+        else:
+            page[offset] = value
+            return
+        self._pages[page_number] = page
+        self._private_pages.add(page_number)
+        page[offset] = value
+
+    def _extend_container(self, page_number):
+        """Grow the dense container up to the end of the page and move the
+        content of the page into it"""
+        self._check_limit()
+        start = page_number * self._page_size
+        page = self._pages.pop(page_number, None)
+        self._private_pages.discard(page_number)
+        container = self.container
+        if page is None:
+            container.extend(
+                [0] * (start + self._page_size - len(container)))
+        else:
+            container.extend(page[len(container) - start:])
+
+    def _check_limit(self):
+        if self._max_pages is not None and \
+                self.pages_touched >= self._max_pages:
+            raise MemoryError('The memory is limited to %d pages' %
+                              self._max_pages)
+
+
+class ImageMemory(PagedMemory):
+    """Memory on top of a ProgramImage. The container is a private
+    copy-on-write mapping of the image file, so computers mapping the same
+    image share the pages they don't write to, even across processes. The
+    addresses past the image belong to the pages of the PagedMemory and the
+    values which don't fit into 64 bits are kept in the big cells like in
+    the TypedMemory. A program given as a list is packed into an array"""
+    GROWS_CONTAINER = False
+
+    @property
+    def image(self):
+        return self._image
+
+    @property
+    def big_cells(self):
+        return self._big_cells
+
+    @property
+    def direct_access(self):
+        return not self._big_cells
+
+    @property
+    def container(self):
+        # whoever takes the container may write to it directly
+        self._written = True
+        return Memory.container.fget(self)
+
+    @container.setter
+    def container(self, value):
+        PagedMemory.container.fset(self, self._map(value))
+
+    def __init__(self, program=None, decode_cache=None,
+                 page_size=PAGE_SIZE, max_pages=None):
+        super().__init__(self._map(program), decode_cache=decode_cache,
+                         page_size=page_size, max_pages=max_pages)
+
+    def __getitem__(self, item):
+        if item.__class__ is slice:
+            return [self[address] for address in
+                    range(item.start or 0, item.stop, item.step or 1)]
+        try:
+            value = self._container[item]
+        except IndexError:
+            if item < 0:
+                raise
+            return self._read_page(item)
+        if value == _BIG_CELL and self._big_cells:
+            return self._big_cells.get(self._address(item), value)
+        return value
+
+    def __setitem__(self, key, value):
+        if self._share_count[0] > 1:
+            self._unshare()
+        if self._decode_cache is not None:
+            self._decode_cache.invalidate(key)
+        self._written = True
+        try:
+            self._container[key] = value
+        except IndexError:
+            if key < 0:
+                raise
+            self._write_page(key, value)
+            return
+        except (OverflowError, ValueError):
+            # the memoryview of the image raises ValueError
+            self._container[key] = _BIG_CELL
+            self._big_cells[self._address(key)] = value
+            return
+        if self._big_cells:
+            self._big_cells.pop(self._address(key), None)
+
+    def __iter__(self):
+        big_cells = self._big_cells
+        for address, value in enumerate(super().__iter__()):
+            yield big_cells.get(address, value) if value == _BIG_CELL \
+                else value
+
+    def fork(self, decode_cache=None):
+        child = super().fork(decode_cache)
+        if self._image is not None and not self._written:
+            # a new mapping of the untouched image costs nothing until it
+            # is written to
+            self._share_count[0] -= 1
+            child._share_count = [1]
+            child._container = self._image.map()
+            child._big_cells = dict(self._big_cells)
+        return child
+
+    def _map(self, program):
+        """Return the container for the program: the mapping of the image
+        or the array the list of values is packed into"""
+        self._written = False
+        if isinstance(program, ProgramImage):
+            self._image = program
+            self._big_cells = dict(program.big_cells)
+            return program.map()
+        self._image = None
+        packed, self._big_cells = pack_cells(
+            program if program is not None else [])
+        return packed
+
+    def _unshare(self, copy_cells=True):
+        super()._unshare(copy_cells=False)
+        if copy_cells:
+            cells = array('q')
+            cells.frombytes(memoryview(self._container).cast('B'))
+            self._container = cells
+        self._big_cells = dict(self._big_cells)
+
+    def _address(self, key):
+        # negative keys index the memory from its end like the list does
+        return key + len(self._container) if key < 0 else key
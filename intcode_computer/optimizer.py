@@ -0,0 +1,530 @@
+"""Offline peephole optimizer for Intcode programs.
+
+The optimizer discovers the code reachable from the address 0, proves which
+cells are never written and never read as data, and rewrites the
+instructions stored in such cells:
+
+* constant propagation: POSITION parameters reading never written cells
+  become IMMEDIATE ones,
+* jump threading: jumps leading to unconditional jumps (or to jumps which
+  are never taken) are retargeted to the final destination,
+* dead-store elimination: runs of arithmetic instructions writing cells
+  nobody reads are skipped with a single jump.
+
+The optimized image has the same layout as the original one, so it can be
+executed by any engine of the IntcodeComputer. The instructions reading
+with the RELATIVE mode or rewritten by the program are left as they are and
+only turn off the optimizations depending on them. Programs writing with
+the RELATIVE mode are optimized only if the caller knows the cells such
+writes land on, e.g. the stack past the code:
+
+    optimize_program(program, relative_area_start=len(program))
+
+Programs jumping to computed addresses or rewriting the opcodes can't be
+proven safe and are returned unchanged.
+
+To optimize the program file execute from the project folder:
+
+python -m intcode_computer.optimizer <input file> [<output file>]
+"""
+from collections import namedtuple
+
+from intcode_computer.commands import OpCodeExtended
+from intcode_computer.command_parameters import ParameterModes
+from intcode_computer.computer import IntcodeComputer
+from intcode_computer.engines import DECODE_TABLE, INSTRUCTION_PARAMETERS
+
+Instruction = namedtuple('Instruction', 'address op_code modes operands')
+OptimizationReport = namedtuple(
+    'OptimizationReport',
+    'optimized reason constant_regions propagated_operands threaded_jumps '
+    'eliminated_stores')
+OptimizationResult = namedtuple('OptimizationResult', 'program report')
+
+_JUMP_OP_CODES = (OpCodeExtended.JUMP_IF_TRUE.value,
+                  OpCodeExtended.JUMP_IF_FALSE.value)
+_STORE_OP_CODES = (OpCodeExtended.ADD.value, OpCodeExtended.MULT.value,
+                   OpCodeExtended.LESS_THAN.value,
+                   OpCodeExtended.EQUALS.value)
+_POSITION = ParameterModes.POSITION.value
+_IMMEDIATE = ParameterModes.IMMEDIATE.value
+_RELATIVE = ParameterModes.RELATIVE.value
+
+
+class NotOptimizableError(Exception):
+    """Raised when the program can't be analyzed statically"""
+
+
+def _instruction_length(instruction):
+    return len(instruction.operands) + 1
+
+
+def _encode(op_code, modes):
+    extended_opcode = op_code
+    for index, mode in enumerate(modes):
+        extended_opcode += mode * 10 ** (index + 2)
+    return extended_opcode
+
+
+class ProgramAnalysis:
+    """Static description of the program: reachable instructions, memory
+    cells which can be written and cells which are read as data"""
+    def __init__(self, program, variable_cells=(), relative_area_start=None):
+        """
+        :param relative_area_start: address the cells accessed with the
+        RELATIVE mode start from, None if they can be anywhere
+        """
+        self.program = program
+        self.variable_cells = frozenset(variable_cells)
+        self.relative_area_start = relative_area_start
+        self.instructions = {}
+        # memory cell -> addresses of the instructions occupying it
+        self.code_cells = {}
+        self.written_cells = set()
+        self.read_cells = set()
+        self._analyze()
+
+    def _fetch(self, address):
+        if not 0 <= address < len(self.program):
+            raise NotOptimizableError('Execution leaves the program at %d' %
+                                      address)
+        return self.program[address]
+
+    def _cell(self, address):
+        """Return the initial value of the data cell, the cells beyond the
+        program start as 0"""
+        if address < 0:
+            raise NotOptimizableError('Negative address %d' % address)
+        if address >= len(self.program):
+            return 0
+        return self.program[address]
+
+    def is_variable(self, cell):
+        """Check whether the cell can change before the program runs or
+        be written with the RELATIVE mode"""
+        return cell in self.variable_cells or \
+            self.relative_area_start is not None and \
+            cell >= self.relative_area_start
+
+    def _decode(self, address):
+        decoded = DECODE_TABLE.get(self._fetch(address))
+        if decoded is None:
+            raise NotOptimizableError('Unknown instruction at %d' % address)
+        op_code = decoded[0]
+        parameter_count = len(INSTRUCTION_PARAMETERS[op_code])
+        modes = decoded[1:parameter_count + 1]
+        operands = tuple(self._fetch(address + offset)
+                         for offset in range(1, parameter_count + 1))
+        return Instruction(address, op_code, modes, operands)
+
+    def constant_value(self, mode, operand):
+        """Return the value of the parameter if it can't change during the
+        execution, None otherwise"""
+        if mode == _IMMEDIATE:
+            return operand
+        if mode == _RELATIVE or operand < 0 or \
+                operand in self.written_cells or self.is_variable(operand):
+            return None
+        return self._cell(operand)
+
+    def _successors(self, instruction):
+        next_address = instruction.address + _instruction_length(instruction)
+        op_code = instruction.op_code
+        if op_code == OpCodeExtended.TERM.value:
+            return []
+        if op_code not in _JUMP_OP_CODES:
+            return [next_address]
+
+        target_mode, target_operand = instruction.modes[1], \
+            instruction.operands[1]
+        if target_mode == _RELATIVE:
+            if self.relative_area_start is None:
+                raise NotOptimizableError('Jump to the relative address at '
+                                          '%d' % instruction.address)
+            self._returns.add(instruction.address)
+            return [] if self._always_taken(instruction) else [next_address]
+        if target_mode == _POSITION:
+            if self.is_variable(target_operand):
+                raise NotOptimizableError('Jump to the variable address at '
+                                          '%d' % instruction.address)
+            # verified against the written cells once the traversal is done
+            self._jump_table_cells.add(target_operand)
+        target = self._cell(target_operand) if target_mode == _POSITION \
+            else target_operand
+        # a jump to itself moves to the next instruction
+        target = target if target != instruction.address else next_address
+        if self._always_taken(instruction):
+            return [target]
+        return [next_address, target]
+
+    def _always_taken(self, instruction):
+        """Check whether the jump never moves to the next instruction, the
+        condition is verified against the written cells once the
+        traversal is done"""
+        if instruction.modes[0] != _IMMEDIATE or \
+                (instruction.operands[0] != 0) != \
+                (instruction.op_code == OpCodeExtended.JUMP_IF_TRUE.value):
+            return False
+        self._unconditional_jumps.add(instruction.address)
+        return True
+
+    def _pushed_constants(self):
+        """Return the constants the instructions write with the RELATIVE
+        mode, e.g. the return addresses put on the stack"""
+        constants = set()
+        for instruction in self.instructions.values():
+            if instruction.op_code not in _STORE_OP_CODES or \
+                    instruction.modes != (_IMMEDIATE, _IMMEDIATE, _RELATIVE):
+                continue
+            param_1, param_2 = instruction.operands[:2]
+            if instruction.op_code == OpCodeExtended.ADD.value:
+                constants.add(param_1 + param_2)
+            elif instruction.op_code == OpCodeExtended.MULT.value:
+                constants.add(param_1 * param_2)
+        return constants
+
+    def _analyze(self):
+        self._jump_table_cells = set()
+        # addresses of the jumps to the RELATIVE mode targets
+        self._returns = set()
+        self._unconditional_jumps = set()
+        jump_targets = set()
+        pending = [0]
+        while pending:
+            address = pending.pop()
+            if address in self.instructions:
+                continue
+            instruction = self._decode(address)
+            self.instructions[address] = instruction
+            for cell in range(address,
+                              address + _instruction_length(instruction)):
+                self.code_cells.setdefault(cell, set()).add(address)
+            successors = self._successors(instruction)
+            if address in self._unconditional_jumps:
+                jump_targets.update(successors)
+            elif instruction.op_code in _JUMP_OP_CODES:
+                jump_targets.update(successors[1:])
+            pending.extend(successors)
+            if not pending and self._returns:
+                # the program keeping its stack in the RELATIVE mode area is
+                # trusted to jump there only to return after the calls, i.e.
+                # to the addresses put on the stack which follow the jumps
+                returns = self._pushed_constants() & {
+                    address + _instruction_length(instruction)
+                    for address, instruction in self.instructions.items()
+                    if instruction.op_code in _JUMP_OP_CODES}
+                jump_targets.update(returns)
+                pending.extend(returns - set(self.instructions))
+
+        # set when the program may read any cell
+        self.unknown_reads = False
+        writers = {}
+        for instruction in self.instructions.values():
+            parameters = INSTRUCTION_PARAMETERS[instruction.op_code]
+            for allowed_modes, mode, operand in zip(
+                    parameters, instruction.modes, instruction.operands):
+                if mode == _RELATIVE:
+                    if self.relative_area_start is not None:
+                        continue
+                    if _IMMEDIATE not in allowed_modes:
+                        raise NotOptimizableError(
+                            'RELATIVE mode write at %d' %
+                            instruction.address)
+                    self.unknown_reads = True
+                if mode != _POSITION:
+                    continue
+                if _IMMEDIATE not in allowed_modes:
+                    self.written_cells.add(operand)
+                    writers.setdefault(operand, []).append(
+                        instruction.address)
+                else:
+                    self.read_cells.add(operand)
+
+        if self._jump_table_cells & (self.written_cells |
+                                     self.variable_cells):
+            raise NotOptimizableError('Jump to a computed address')
+        if self.relative_area_start is not None and \
+                max(self.code_cells) >= self.relative_area_start:
+            raise NotOptimizableError('The code overlaps the RELATIVE mode '
+                                      'area')
+
+        # the order of the straight-line run of instructions starting at the
+        # address 0 is known as long as nothing jumps into it
+        prefix = {}
+        address = 0
+        while address in self.instructions and address not in jump_targets:
+            instruction = self.instructions[address]
+            prefix[address] = len(prefix)
+            if instruction.op_code in _JUMP_OP_CODES or \
+                    instruction.op_code == OpCodeExtended.TERM.value:
+                break
+            address += _instruction_length(instruction)
+
+        self.self_modifying = set()
+        for cell in set(self.code_cells) & self.written_cells:
+            for owner in self.code_cells[cell]:
+                if owner in prefix and all(
+                        writer in prefix and prefix[writer] >= prefix[owner]
+                        for writer in writers[cell]):
+                    # the instruction has been executed before the write
+                    continue
+                instruction = self.instructions[owner]
+                index = cell - owner - 1
+                if index < 0 or instruction.op_code in _JUMP_OP_CODES and (
+                        index > 0 or owner in self._unconditional_jumps) or \
+                        _IMMEDIATE not in \
+                        INSTRUCTION_PARAMETERS[instruction.op_code][index]:
+                    raise NotOptimizableError('Program rewrites the '
+                                              'instruction at %d' % owner)
+                # the parameter of the instruction is computed, the
+                # instruction itself and the jumps through it are kept
+                if instruction.modes[index] != _IMMEDIATE:
+                    # the instruction reads a computed address
+                    self.unknown_reads = True
+                self.self_modifying.add(owner)
+
+    def constant_regions(self):
+        """Return the list of (start, end) ranges of the code which is never
+        written"""
+        regions = []
+        for cell in sorted(self.code_cells):
+            if regions and regions[-1][1] == cell:
+                regions[-1][1] = cell + 1
+            else:
+                regions.append([cell, cell + 1])
+        return [tuple(region) for region in regions]
+
+    def is_rewritable(self, instruction, observed_cells):
+        """Check whether the cells of the instruction can be changed without
+        anybody noticing"""
+        # the program might read the instruction as data
+        if instruction.address in self.self_modifying or self.unknown_reads:
+            return False
+        parameters = INSTRUCTION_PARAMETERS[instruction.op_code]
+        for offset in range(_instruction_length(instruction)):
+            cell = instruction.address + offset
+            if len(self.code_cells[cell]) > 1:
+                return False
+            # the result address itself is never rewritten, so the program
+            # may use it as data once the instruction has been executed
+            if offset > 0 and _IMMEDIATE not in parameters[offset - 1]:
+                continue
+            if cell in self.read_cells or cell in self.written_cells or \
+                    self.is_variable(cell) or cell in observed_cells:
+                return False
+        return True
+
+
+class PeepholeOptimizer:
+    def __init__(self, program, observed_cells=(), variable_cells=(),
+                 relative_area_start=None):
+        """
+        :param program: parsed program as returned by parse_program
+        :param observed_cells: cells whose final values matter to the caller
+        :param variable_cells: cells patched before running the program, e.g
+        the noun and verb of the Day 2
+        :param relative_area_start: address the cells accessed with the
+        RELATIVE mode start from, e.g. the length of the program keeping its
+        stack past the code. None if they can be anywhere, the programs
+        writing with the RELATIVE mode are not optimized then
+        """
+        self._program = list(program)
+        self._observed_cells = frozenset(observed_cells)
+        self._variable_cells = frozenset(variable_cells)
+        self._relative_area_start = relative_area_start
+
+    def optimize(self):
+        """
+        :return: OptimizationResult with the new program image and the report
+        of the applied optimizations
+        """
+        try:
+            analysis = ProgramAnalysis(self._program, self._variable_cells,
+                                       self._relative_area_start)
+        except NotOptimizableError as error:
+            report = OptimizationReport(False, str(error), [], 0, 0, 0)
+            return OptimizationResult(list(self._program), report)
+
+        image = list(self._program)
+        instructions = {address: instruction for address, instruction
+                        in analysis.instructions.items()
+                        if analysis.is_rewritable(instruction,
+                                                  self._observed_cells)}
+
+        propagated = self._propagate_constants(analysis, instructions, image)
+        threaded = self._thread_jumps(analysis, instructions, image)
+        eliminated = self._eliminate_dead_stores(analysis, instructions,
+                                                 image)
+
+        report = OptimizationReport(True, None, analysis.constant_regions(),
+                                    propagated, threaded, eliminated)
+        return OptimizationResult(image, report)
+
+    @staticmethod
+    def _store(instruction, image, instructions):
+        image[instruction.address] = _encode(instruction.op_code,
+                                             instruction.modes)
+        for offset, operand in enumerate(instruction.operands, 1):
+            image[instruction.address + offset] = operand
+        instructions[instruction.address] = instruction
+
+    def _propagate_constants(self, analysis, instructions, image):
+        propagated = 0
+        for address, instruction in list(instructions.items()):
+            parameters = INSTRUCTION_PARAMETERS[instruction.op_code]
+            modes = list(instruction.modes)
+            operands = list(instruction.operands)
+            for index, allowed_modes in enumerate(parameters):
+                if modes[index] != _POSITION or \
+                        _IMMEDIATE not in allowed_modes:
+                    continue
+                value = analysis.constant_value(modes[index], operands[index])
+                if value is not None:
+                    modes[index] = _IMMEDIATE
+                    operands[index] = value
+                    propagated += 1
+            if tuple(modes) != instruction.modes:
+                self._store(instruction._replace(modes=tuple(modes),
+                                                 operands=tuple(operands)),
+                            image, instructions)
+        return propagated
+
+    @staticmethod
+    def _jump_outcome(instruction):
+        """Return True if the jump is always taken, False if it is never
+        taken and None if it depends on the execution"""
+        if instruction.op_code not in _JUMP_OP_CODES or \
+                instruction.modes[0] != _IMMEDIATE:
+            return None
+        condition = instruction.operands[0] != 0
+        if instruction.op_code == OpCodeExtended.JUMP_IF_FALSE.value:
+            condition = not condition
+        return condition
+
+    def _final_destination(self, analysis, instructions, address):
+        """Follow the chain of unconditional and never taken jumps starting
+        at the address"""
+        visited = set()
+        while address not in visited:
+            visited.add(address)
+            instruction = instructions.get(address)
+            if instruction is None:
+                # the instruction is not rewritable, but it is still safe to
+                # follow if its code never changes
+                instruction = analysis.instructions.get(address)
+                if instruction is None or \
+                        address in analysis.self_modifying or any(
+                            cell in analysis.written_cells
+                            for cell in range(address, address +
+                                              _instruction_length(
+                                                  instruction))):
+                    return address
+            outcome = self._jump_outcome(instruction)
+            if outcome is None:
+                return address
+            if outcome is False:
+                address += _instruction_length(instruction)
+            elif instruction.modes[1] == _IMMEDIATE and \
+                    instruction.operands[1] != address:
+                address = instruction.operands[1]
+            else:
+                return address
+        return address
+
+    def _thread_jumps(self, analysis, instructions, image):
+        threaded = 0
+        for address, instruction in list(instructions.items()):
+            if instruction.op_code not in _JUMP_OP_CODES or \
+                    instruction.modes[1] != _IMMEDIATE:
+                continue
+            target = instruction.operands[1]
+            if target == address:
+                continue
+            destination = self._final_destination(analysis, instructions,
+                                                  target)
+            if destination != target and destination != address:
+                operands = (instruction.operands[0], destination)
+                self._store(instruction._replace(operands=operands), image,
+                            instructions)
+                threaded += 1
+        return threaded
+
+    def _eliminate_dead_stores(self, analysis, instructions, image):
+        if analysis.unknown_reads:
+            return 0
+
+        def is_dead(instruction):
+            return instruction is not None and \
+                instruction.op_code in _STORE_OP_CODES and \
+                instruction.operands[2] not in analysis.read_cells and \
+                instruction.operands[2] not in self._observed_cells and \
+                instruction.modes[2] == _POSITION and \
+                not analysis.is_variable(instruction.operands[2]) and \
+                instruction.operands[2] not in analysis.code_cells
+
+        eliminated = 0
+        skipped = set()
+        for address in sorted(instructions):
+            instruction = instructions[address]
+            if address in skipped or not is_dead(instruction):
+                continue
+            # skip the whole run of the dead stores with a single jump
+            end = address
+            while is_dead(instructions.get(end)):
+                skipped.add(end)
+                eliminated += 1
+                end += _instruction_length(instructions[end])
+            jump = Instruction(address, OpCodeExtended.JUMP_IF_TRUE.value,
+                               (_IMMEDIATE, _IMMEDIATE), (1, end))
+            self._store(jump, image, instructions)
+        return eliminated
+
+
+def optimize_program(program, observed_cells=(), variable_cells=(),
+                     relative_area_start=None):
+    """Shortcut for the PeepholeOptimizer(...).optimize() call"""
+    return PeepholeOptimizer(program, observed_cells, variable_cells,
+                             relative_area_start).optimize()
+
+
+def verify_equivalence(original, optimized, samples, observed_cells=(),
+                       engine='command'):
+    """
+    Run both images side by side and compare their outputs and observed
+    cells
+    :param samples: iterable of (patches, inputs) pairs, where patches is a
+    dict of the memory cells to set before running and inputs is a sequence
+    of the input values
+    :return: list of the samples the images disagree on
+    """
+    mismatches = []
+    for patches, inputs in samples:
+        results = []
+        for image in (original, optimized):
+            program = list(image)
+            for address, value in patches.items():
+                program[address] = value
+            computer = IntcodeComputer(program, engine=engine)
+            values = iter(inputs)
+            computer.input_buffer.subscribe(
+                computer, lambda requested, computer=computer, values=values:
+                computer.send_input_data(next(values)))
+            computer.run_program()
+            results.append((computer.output_history,
+                            [computer.memory[cell]
+                             for cell in sorted(observed_cells)]))
+        if results[0] != results[1]:
+            mismatches.append((patches, inputs))
+    return mismatches
+
+
+if __name__ == '__main__':
+    import sys
+    from intcode_computer.utils import parse_program
+
+    source_program = parse_program(sys.argv[1])
+    result = optimize_program(source_program)
+    print(result.report)
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], 'w') as output_file:
+            output_file.write(','.join(str(cell) for cell in result.program))
@@ -0,0 +1,442 @@
+"""Retention policies of the output values kept by the IntcodeComputer in
+its output_history. The plain list keeps every value, the other policies
+bound or compact the history of the long running programs:
+
+    computer = IntcodeComputer(program, history_policy='ring',
+                               history_capacity=100)
+    computer.run_program()
+    last_values = list(computer.output_history)
+
+Every history is iterable from the oldest value kept to the newest one.
+"""
+import os
+import tempfile
+from array import array
+from collections import deque
+from enum import Enum, unique
+
+from intcode_computer.program_image import BIG_CELL
+
+# values kept by the ring and buffered by the spill history by default
+DEFAULT_HISTORY_CAPACITY = 64 * 1024
+# added to the path of the spill file for the file of the big values
+BIG_VALUES_SUFFIX = '.big'
+
+
+@unique
+class HistoryPolicies(Enum):
+    """Retention policies of the output history"""
+    # unbounded list of every value
+    LIST = 'list'
+    OFF = 'off'
+    # the last history_capacity values
+    RING = 'ring'
+    # every value as a signed 64 bit integer
+    TYPED = 'typed'
+    # every value, the ones beyond the buffer of history_capacity values are
+    # written to a file
+    SPILL = 'spill'
+
+
+class DisabledHistory:
+    """Drops every value, only counts them"""
+    @property
+    def total(self):
+        """Number of the values ever appended"""
+        return self._total
+
+    def __init__(self):
+        self._total = 0
+
+    def __len__(self):
+        return 0
+
+    def __iter__(self):
+        return iter(())
+
+    def __getitem__(self, index):
+        raise IndexError('The output history is disabled')
+
+    def append(self, value):
+        self._total += 1
+
+    def extend(self, values):
+        for _ in values:
+            self._total += 1
+
+    def clear(self):
+        self._total = 0
+
+    def copy(self):
+        history = DisabledHistory()
+        history._total = self._total
+        return history
+
+
+class RingHistory:
+    """Keeps the last capacity values"""
+    @property
+    def capacity(self):
+        return self._values.maxlen
+
+    @property
+    def total(self):
+        return self._total + len(self._values)
+
+    def __init__(self, capacity=DEFAULT_HISTORY_CAPACITY):
+        if capacity < 1:
+            raise ValueError('The ring should keep at least one value')
+        self._values = deque(maxlen=capacity)
+        # values pushed out of the ring
+        self._total = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __getitem__(self, index):
+        return self._values[index]
+
+    def append(self, value):
+        values = self._values
+        if len(values) == values.maxlen:
+            self._total += 1
+        values.append(value)
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def clear(self):
+        self._values.clear()
+        self._total = 0
+
+    def copy(self):
+        history = RingHistory(self.capacity)
+        history._values.extend(self._values)
+        history._total = self._total
+        return history
+
+
+class TypedHistory:
+    """Keeps every value in an array of signed 64 bit integers, the values
+    which don't fit are kept aside"""
+    @property
+    def total(self):
+        return len(self._values)
+
+    def __init__(self):
+        self._values = array('q')
+        # index to value mapping of the values which don't fit into 64 bits
+        self._big_values = {}
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        big_values = self._big_values
+        if not big_values:
+            return iter(self._values)
+        return (big_values.get(index, value) if value == BIG_CELL else value
+                for index, value in enumerate(self._values))
+
+    def __getitem__(self, index):
+        value = self._values[index]
+        if value == BIG_CELL and self._big_values:
+            if index < 0:
+                index += len(self._values)
+            value = self._big_values.get(index, value)
+        return value
+
+    def append(self, value):
+        try:
+            self._values.append(value)
+        except OverflowError:
+            self._big_values[len(self._values)] = value
+            self._values.append(BIG_CELL)
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def clear(self):
+        self._values = array('q')
+        self._big_values = {}
+
+    def copy(self):
+        history = TypedHistory()
+        history._values.extend(self._values)
+        history._big_values.update(self._big_values)
+        return history
+
+
+class _SpillFiles:
+    """Files of the values and of the big values written by the spill
+    history. The copies of the history read the values written before
+    they were made from the same files, the files are closed once nobody
+    uses them"""
+    def __init__(self, path=None):
+        self.values = open(path, 'w+b') if path is not None \
+            else tempfile.TemporaryFile()
+        self.big_values = open(path + BIG_VALUES_SUFFIX, 'w+') \
+            if path is not None else tempfile.TemporaryFile('w+')
+        self.users = 1
+
+    def release(self):
+        self.users -= 1
+        if not self.users:
+            self.values.close()
+            self.big_values.close()
+
+
+class SpillHistory:
+    """Keeps every value, writing them to the file in segments of capacity
+    signed 64 bit integers, so only the latest segment is in the memory.
+    The values which don't fit into 64 bits are marked in the segments and
+    written with their indexes to the file with the BIG_VALUES_SUFFIX as
+    the lines of text. The copies share the values written so far and
+    write the new ones to their own anonymous temporary files"""
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def path(self):
+        """Path of the spill file, None for an anonymous temporary file"""
+        return self._path
+
+    @property
+    def total(self):
+        return self._spilled + len(self._buffer)
+
+    def __init__(self, capacity=DEFAULT_HISTORY_CAPACITY, path=None):
+        if capacity < 1:
+            raise ValueError('The spill buffer should hold at least one '
+                             'value')
+        self._capacity = capacity
+        self._path = path
+        # the temporary files are created by the first spill
+        self._files = _SpillFiles(path) if path is not None else None
+        # (files, values, big values) of the values written before the
+        # copy was made, read only
+        self._shared = []
+        self._buffer = array('q')
+        # number of the values written to the files, the shared ones
+        # included
+        self._spilled = 0
+        # number of the values and of the big values written to own files
+        self._own_spilled = 0
+        self._own_big_spilled = 0
+        # index to value mapping of the big values of the buffered segment
+        self._big_values = {}
+        # number of the big values written to the files
+        self._big_spilled = 0
+        self._closed = False
+
+    def __len__(self):
+        return self.total
+
+    def __iter__(self):
+        if not self._big_values and not self._big_spilled:
+            for segment in self.segments():
+                yield from segment
+            return
+        big_values = self._iterate_big_values()
+        big_index, big_value = next(big_values, (None, None))
+        index = 0
+        for segment in self.segments():
+            for value in segment:
+                if index == big_index:
+                    value = big_value
+                    big_index, big_value = next(big_values, (None, None))
+                yield value
+                index += 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.total
+        if not 0 <= index < self.total:
+            raise IndexError('Output history index out of range')
+        if index >= self._spilled:
+            value = self._buffer[index - self._spilled]
+            if value == BIG_CELL:
+                value = self._big_values.get(index, value)
+            return value
+
+        start = 0
+        for files, count, _ in self._spilled_parts():
+            if index < start + count:
+                break
+            start += count
+        value_file = files.values
+        value_file.flush()
+        value_file.seek((index - start) * self._buffer.itemsize)
+        value = array('q')
+        value.fromfile(value_file, 1)
+        if value[0] != BIG_CELL:
+            return value[0]
+        for big_index, big_value in self._iterate_big_values():
+            if big_index == index:
+                return big_value
+        return value[0]
+
+    def segments(self):
+        """
+        :return: generator of the arrays of the stored values, the spilled
+        segments read back from the files followed by the buffered one
+        """
+        yield from self._spilled_segments()
+        if self._buffer:
+            yield array('q', self._buffer)
+
+    def append(self, value):
+        buffer = self._buffer
+        try:
+            buffer.append(value)
+        except OverflowError:
+            self._big_values[self._spilled + len(buffer)] = value
+            buffer.append(BIG_CELL)
+        if len(buffer) == self._capacity:
+            self._spill()
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def flush(self):
+        """Write the buffered values to the files"""
+        if self._buffer:
+            self._spill()
+        if self._files is not None:
+            self._files.values.flush()
+            self._files.big_values.flush()
+
+    def clear(self):
+        self._release_shared()
+        files = self._files
+        if files is not None and files.users > 1:
+            # the copies still read the values, the file of the path gets
+            # replaced
+            files.release()
+            if self._path is not None:
+                for path in (self._path, self._path + BIG_VALUES_SUFFIX):
+                    os.remove(path)
+            files = self._files = _SpillFiles(self._path) \
+                if self._path is not None else None
+        elif files is not None:
+            for spill_file in (files.values, files.big_values):
+                spill_file.seek(0)
+                spill_file.truncate()
+        self._buffer = array('q')
+        self._spilled = self._own_spilled = 0
+        self._big_values = {}
+        self._big_spilled = self._own_big_spilled = 0
+
+    def close(self):
+        if self._closed:
+            return
+        if self._path is not None:
+            self.flush()
+        self._closed = True
+        self._release_shared()
+        if self._files is not None:
+            self._files.release()
+            self._files = None
+
+    def copy(self):
+        """Copy sharing the spilled values, the new values of the copy are
+        written to anonymous temporary files"""
+        history = SpillHistory(self._capacity)
+        history._shared = list(self._spilled_parts())
+        for files, _, _ in history._shared:
+            files.users += 1
+        history._spilled = self._spilled
+        history._big_spilled = self._big_spilled
+        history._buffer = array('q', self._buffer)
+        history._big_values = dict(self._big_values)
+        return history
+
+    def _spill(self):
+        if self._files is None:
+            self._files = _SpillFiles()
+        files = self._files
+        # reading the segments back moves the position of the file
+        files.values.seek(0, 2)
+        self._buffer.tofile(files.values)
+        self._spilled += len(self._buffer)
+        self._own_spilled += len(self._buffer)
+        self._buffer = array('q')
+        if self._big_values:
+            files.big_values.seek(0, 2)
+            files.big_values.writelines('%d %d\n' % item for item
+                                        in sorted(self._big_values.items()))
+            self._big_spilled += len(self._big_values)
+            self._own_big_spilled += len(self._big_values)
+            self._big_values = {}
+
+    def _release_shared(self):
+        for files, _, _ in self._shared:
+            files.release()
+        self._shared = []
+
+    def _spilled_parts(self):
+        """Generate the (files, values, big values) tuples of the spilled
+        values in their order, the shared ones first"""
+        yield from self._shared
+        if self._own_spilled:
+            yield self._files, self._own_spilled, self._own_big_spilled
+
+    def _iterate_big_values(self):
+        """Generate the (index, value) pairs of the big values in the order
+        of the indexes, the spilled ones first"""
+        for files, _, count in self._spilled_parts():
+            big_file = files.big_values
+            big_file.flush()
+            position = 0
+            for _ in range(count):
+                # the other users of the file may move its position
+                big_file.seek(position)
+                index, value = big_file.readline().split()
+                position = big_file.tell()
+                yield int(index), int(value)
+        yield from sorted(self._big_values.items())
+
+    def _spilled_segments(self):
+        itemsize = self._buffer.itemsize
+        for files, count, _ in self._spilled_parts():
+            spill_file = files.values
+            spill_file.flush()
+            position = 0
+            end = count * itemsize
+            while position < end:
+                spill_file.seek(position)
+                segment = array('q')
+                segment.fromfile(spill_file, min(self._capacity,
+                                                 (end - position) //
+                                                 itemsize))
+                position = spill_file.tell()
+                yield segment
+
+
+def create_output_history(policy=HistoryPolicies.LIST.value,
+                          capacity=DEFAULT_HISTORY_CAPACITY, path=None):
+    """
+    :param policy: HistoryPolicies value
+    :param capacity: number of the values kept by the ring or buffered by the
+    spill history
+    :param path: file the spill history writes to, an anonymous temporary
+    file if None
+    :return: the output history object, list for the LIST policy
+    """
+    policy = HistoryPolicies(policy)
+    if policy is HistoryPolicies.LIST:
+        return []
+    if policy is HistoryPolicies.OFF:
+        return DisabledHistory()
+    if policy is HistoryPolicies.RING:
+        return RingHistory(capacity)
+    if policy is HistoryPolicies.TYPED:
+        return TypedHistory()
+    return SpillHistory(capacity, path)
@@ -0,0 +1,190 @@
+"""Execution profile of the IntcodeComputer. Profiling is switched on per
+computer with enable_profiling(), run_program() then executes the program
+with the instrumented loop of the engines module instead of the engine of the
+computer, so the engines themselves never pay for it:
+
+    profile = computer.enable_profiling()
+    computer.run_program()
+    print(profile.heat_map())
+    profile.save_json('profile.json')
+"""
+import json
+import math
+import time
+from collections import defaultdict
+
+from intcode_computer.commands import OpCodeExtended
+from intcode_computer.command_parameters import ParameterModes
+from intcode_computer.engines import DECODE_TABLE, INSTRUCTION_PARAMETERS, \
+    run_instrumented_engine
+from intcode_computer.memory import PAGE_SIZE
+
+# characters of the heat map from the coldest to the hottest address
+HEAT_MAP_SHADES = ' .:-=+*#%@'
+# addresses per line of the heat map by default
+DEFAULT_HEAT_MAP_WIDTH = 64
+
+
+def describe_opcode(extended_opcode):
+    """Return the name of the instruction with the modes of its parameters,
+    e.g. MULT(POSITION,IMMEDIATE,POSITION)"""
+    decoded = DECODE_TABLE.get(extended_opcode)
+    if decoded is None:
+        return str(extended_opcode)
+    op_code = OpCodeExtended(decoded[0])
+    if op_code == OpCodeExtended.TERM:
+        return op_code.name
+    parameters = len(INSTRUCTION_PARAMETERS[op_code.value])
+    modes = [ParameterModes(mode).name
+             for mode in decoded[1:1 + parameters]]
+    return '%s(%s)' % (op_code.name, ','.join(modes))
+
+
+class ExecutionProfile:
+    """Counters collected while the program runs"""
+    @property
+    def page_size(self):
+        return self._page_size
+
+    @property
+    def instructions(self):
+        return self._instructions
+
+    @property
+    def wall_time(self):
+        """Seconds spent in the profiled runs"""
+        return self._wall_time
+
+    @property
+    def max_relative_base(self):
+        return self._max_relative_base
+
+    @property
+    def opcode_counts(self):
+        """Mapping of the extended opcodes - the op_code together with the
+        parameter modes - to the number of their executions"""
+        return self._opcode_counts
+
+    @property
+    def address_counts(self):
+        """Mapping of the instruction addresses to the number of their
+        executions"""
+        return self._address_counts
+
+    @property
+    def page_reads(self):
+        """Mapping of the page numbers to the number of the parameter reads
+        from the page"""
+        return self._page_reads
+
+    @property
+    def page_writes(self):
+        return self._page_writes
+
+    def __init__(self, page_size=PAGE_SIZE):
+        self._page_size = page_size
+        self._instructions = 0
+        self._wall_time = 0.0
+        self._max_relative_base = 0
+        self._opcode_counts = defaultdict(int)
+        self._address_counts = defaultdict(int)
+        self._page_reads = defaultdict(int)
+        self._page_writes = defaultdict(int)
+
+    def op_code_totals(self):
+        """Number of the executions of every op_code regardless of the
+        modes"""
+        totals = defaultdict(int)
+        for extended_opcode, count in self._opcode_counts.items():
+            totals[OpCodeExtended(int(str(extended_opcode)[-2:])).name] += \
+                count
+        return dict(totals)
+
+    def to_dict(self):
+        return {
+            'instructions': self._instructions,
+            'wall_time': self._wall_time,
+            'max_relative_base': self._max_relative_base,
+            'op_codes': self.op_code_totals(),
+            'opcodes': {describe_opcode(extended_opcode): count
+                        for extended_opcode, count
+                        in sorted(self._opcode_counts.items())},
+            'addresses': {str(address): count for address, count
+                          in sorted(self._address_counts.items())},
+            'page_size': self._page_size,
+            'page_reads': {str(page): count for page, count
+                           in sorted(self._page_reads.items())},
+            'page_writes': {str(page): count for page, count
+                            in sorted(self._page_writes.items())},
+        }
+
+    def to_json(self, indent=None):
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def save_json(self, path, indent=2):
+        with open(path, 'w') as profile_file:
+            profile_file.write(self.to_json(indent))
+
+    def heat_map(self, width=DEFAULT_HEAT_MAP_WIDTH):
+        """
+        Draw the execution counts of the addresses, a line per width
+        addresses. The shades follow the logarithm of the counts
+        :return: string with the lines prefixed by their first address
+        """
+        if not self._address_counts:
+            return ''
+        hottest = math.log(max(self._address_counts.values()) + 1)
+        last_line = max(self._address_counts) // width
+        lines = []
+        for line in range(last_line + 1):
+            start = line * width
+            shades = []
+            for address in range(start, start + width):
+                count = self._address_counts.get(address, 0)
+                shade = int(math.log(count + 1) / hottest *
+                            (len(HEAT_MAP_SHADES) - 1))
+                shades.append(HEAT_MAP_SHADES[shade])
+            lines.append('%6d %s' % (start, ''.join(shades)))
+        return '\n'.join(lines)
+
+    def clear(self):
+        self.__init__(self._page_size)
+
+
+def run_profiled_engine(computer, profile):
+    """
+    Execute the program loaded into the computer with
+    run_instrumented_engine() counting the executed instructions and the
+    memory accesses into the profile. Instructions the decode table doesn't
+    know about are counted without their memory accesses
+    """
+    page_size = profile.page_size
+    opcode_counts = profile.opcode_counts
+    address_counts = profile.address_counts
+    page_reads = profile.page_reads
+    page_writes = profile.page_writes
+    counters = [0, profile.max_relative_base]
+
+    def count(address, extended_opcode, relative_base, read_1, operand_1,
+              read_2, operand_2, write_address, write_value):
+        opcode_counts[extended_opcode] += 1
+        address_counts[address] += 1
+        counters[0] += 1
+        if relative_base > counters[1]:
+            counters[1] = relative_base
+        if read_1 is not None:
+            page_reads[read_1 // page_size] += 1
+        if read_2 is not None:
+            page_reads[read_2 // page_size] += 1
+        if write_address is not None:
+            page_writes[write_address // page_size] += 1
+
+    started = time.perf_counter()
+    try:
+        run_instrumented_engine(computer, count)
+    finally:
+        profile._instructions += counters[0]
+        profile._wall_time += time.perf_counter() - started
+        # the relative base the last instruction has left is seen by no hook
+        profile._max_relative_base = max(counters[1],
+                                         computer.relative_base)
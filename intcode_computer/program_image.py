@@ -0,0 +1,278 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from pathlib import Path
+
+# marks the cells which don't fit into 64 bits, their values are kept aside
+BIG_CELL = -2 ** 63
+# zeroed cells stored after the program by default, the programs use them
+# as the working memory. They are left as a hole in the file, so neither
+# the disk nor the memory is spent until they are written
+DEFAULT_RESERVED_CELLS = 64 * 1024
+# folder created next to the program sources for their compiled images
+CACHE_FOLDER = '__intcode_cache__'
+IMAGE_SUFFIX = '.image'
+
+# magic, byte order, format version, number of the program cells, number of
+# the reserved cells, size of the big cells table and the hash of the source
+# the image has been compiled from. The cells follow the header, the table
+# of the big cells follows the reserved cells
+_HEADER = struct.Struct('<8scB6xQQQ32s')
+_MAGIC = b'INTCODE\0'
+_VERSION = 1
+_BYTE_ORDERS = {'little': b'<', 'big': b'>'}
+
+
+def parse_program_text(puzzle_input_file):
+    """Parse the list of values from the text file of the comma separated
+    values"""
+    sequence = []
+    with open(puzzle_input_file, 'r') as puzzle_input:
+        for line in puzzle_input:
+            sequence.extend([int(x) for x in line.split(',')])
+    return sequence
+
+
+def pack_cells(program):
+    """
+    Pack the program values into an array of signed 64 bit integers
+    :return: (array, big_cells) tuple, where big_cells is the mapping of the
+    addresses to the values which don't fit into the array
+    """
+    big_cells = {}
+    try:
+        return array('q', program), big_cells
+    except OverflowError:
+        packed = array('q')
+        for address, value in enumerate(program):
+            try:
+                packed.append(value)
+            except OverflowError:
+                packed.append(BIG_CELL)
+                big_cells[address] = value
+        return packed, big_cells
+
+
+class ProgramImage:
+    """Program packed into a file of native 64 bit integers. Every process
+    maps the file into its memory instead of parsing and copying the
+    program: the pages of the file are shared by all the mappings and a
+    mapping gets its private copy only of the pages written to. The object
+    itself is small and may be sent to other processes. close() unmaps the
+    mappings made by map(), leaving the image as a context manager closes
+    it and removes the temporary image file"""
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def length(self):
+        """Number of the program cells"""
+        return self._length
+
+    @property
+    def reserved(self):
+        """Number of the zeroed cells mapped after the program"""
+        return self._reserved
+
+    @property
+    def big_cells(self):
+        return self._big_cells
+
+    @property
+    def source_hash(self):
+        """Hash of the source the image has been compiled from, empty if
+        unknown"""
+        return self._source_hash
+
+    @property
+    def temporary(self):
+        """True if the file is removed once the image is left as a context
+        manager"""
+        return self._temporary
+
+    def __init__(self, path, length, reserved=0, big_cells=None,
+                 source_hash=b'', temporary=False):
+        self._path = str(path)
+        self._length = length
+        self._reserved = reserved
+        self._big_cells = big_cells if big_cells is not None else {}
+        self._source_hash = source_hash
+        self._temporary = temporary
+        self._file = None
+        # (mmap, memoryview) pairs returned by map()
+        self._mappings = []
+
+    def __len__(self):
+        return self._length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        if self._temporary:
+            self.unlink()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # every process opens and maps the file on its own
+        state['_file'] = None
+        state['_mappings'] = []
+        return state
+
+    def map(self):
+        """
+        Map the image into the memory of the process copy-on-write
+        :return: writable memoryview of the 64 bit cells, writes are never
+        seen by other mappings nor stored in the file
+        """
+        if not self._length + self._reserved:
+            return array('q')
+        if self._file is None:
+            self._file = open(self._path, 'rb')
+        mapping = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_COPY)
+        end = _HEADER.size + (self._length + self._reserved) * 8
+        cells = memoryview(mapping)[_HEADER.size:end].cast('q')
+        self._mappings.append((mapping, cells))
+        return cells
+
+    def cells(self):
+        """
+        :return: list of the program values
+        """
+        with open(self._path, 'rb') as image_file:
+            image_file.seek(_HEADER.size)
+            cells = array('q')
+            cells.fromfile(image_file, self._length)
+        program = cells.tolist()
+        for address, value in self._big_cells.items():
+            program[address] = value
+        return program
+
+    def close(self):
+        """Close the file and the mappings, the memories using them can't be
+        accessed anymore"""
+        for mapping, cells in self._mappings:
+            cells.release()
+            mapping.close()
+        self._mappings = []
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def unlink(self):
+        """Close and remove the image file, existing mappings stay valid"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+
+def write_program_image(program, path=None,
+                        reserved=DEFAULT_RESERVED_CELLS, source_hash=b''):
+    """
+    Write the program into the image file
+    :param path: path of the file, a temporary file is created if None
+    :param reserved: number of the zeroed cells to add after the program
+    :param source_hash: hash of the source the program has been parsed from
+    :return: ProgramImage object, temporary if the path is None
+    """
+    temporary = path is None
+    cells, big_cells = pack_cells(program)
+    table = json.dumps(sorted(big_cells.items())).encode() \
+        if big_cells else b''
+    if path is None:
+        descriptor, path = tempfile.mkstemp(prefix='intcode-',
+                                            suffix=IMAGE_SUFFIX)
+        os.close(descriptor)
+    with open(path, 'wb') as image_file:
+        image_file.write(_HEADER.pack(
+            _MAGIC, _BYTE_ORDERS[sys.byteorder], _VERSION, len(cells),
+            reserved, len(table), source_hash))
+        cells.tofile(image_file)
+        # the reserved cells are left as a hole in the file
+        image_file.seek(_HEADER.size +
+                        (len(cells) + reserved) * cells.itemsize)
+        image_file.write(table)
+        image_file.truncate()
+    return ProgramImage(path, len(cells), reserved, big_cells, source_hash,
+                        temporary)
+
+
+def read_program_image(path):
+    """
+    Open the image written by write_program_image()
+    :return: ProgramImage object
+    :raise ValueError: if the file is not a complete image this machine can
+    map
+    """
+    with open(path, 'rb') as image_file:
+        header = image_file.read(_HEADER.size)
+        if len(header) != _HEADER.size:
+            raise ValueError('%s is not an Intcode image' % path)
+        magic, byte_order, version, length, reserved, table_size, \
+            source_hash = _HEADER.unpack(header)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError('%s is not an Intcode image' % path)
+        if byte_order != _BYTE_ORDERS[sys.byteorder]:
+            raise ValueError('%s has been written on a machine with another '
+                             'byte order' % path)
+        # a crashed writer or a partial copy leaves the file short
+        if os.path.getsize(path) < \
+                _HEADER.size + (length + reserved) * 8 + table_size:
+            raise ValueError('%s is truncated' % path)
+        big_cells = {}
+        if table_size:
+            image_file.seek(_HEADER.size + (length + reserved) * 8)
+            big_cells = {address: value for address, value
+                         in json.loads(image_file.read(table_size))}
+    return ProgramImage(path, length, reserved, big_cells, source_hash)
+
+
+def load_program_image(source_path, reserved=DEFAULT_RESERVED_CELLS):
+    """
+    Load the program from the text file through the cache of the compiled
+    images. The image is stored in the CACHE_FOLDER next to the source under
+    the hash of the source content, so the sources with the same content
+    share it, and parsed again only when the content changes:
+
+        with load_program_image(path) as image:
+            computer = IntcodeComputer(image, memory_type='image')
+            computer.run_program()
+
+    :return: ProgramImage object, ready to be mapped
+    """
+    source_path = Path(source_path)
+    source_hash = hashlib.sha256(source_path.read_bytes()).digest()
+    cache_folder = source_path.parent / CACHE_FOLDER
+    image_path = cache_folder / (source_hash.hex() + IMAGE_SUFFIX)
+    try:
+        image = read_program_image(image_path)
+        if image.source_hash == source_hash and image.reserved == reserved:
+            return image
+    except (OSError, ValueError):
+        pass
+
+    program = parse_program_text(source_path)
+    cache_folder.mkdir(exist_ok=True)
+    descriptor, temporary_path = tempfile.mkstemp(
+        prefix=image_path.name, suffix='.tmp', dir=str(cache_folder))
+    os.close(descriptor)
+    try:
+        image = write_program_image(program, temporary_path, reserved,
+                                    source_hash)
+        # the image appears at once, so concurrent loaders never read it
+        # half written
+        os.replace(temporary_path, str(image_path))
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+    return ProgramImage(image_path, image.length, reserved, image.big_cells,
+                        source_hash)
@@ -0,0 +1,241 @@
+"""Persistent cache of the results of the deterministic runs. A run depends
+only on the program, the memory patches and the input values, so its
+outputs, the digest of its final memory and the number of the executed
+instructions are stored on disk under the hash of these three:
+
+    with ResultCache() as cache:
+        result = run_cached(program, {1: 12, 2: 2}, (), cache=cache)
+
+Entries are evicted least recently used first once the store outgrows its
+size limit. Every entry is tied to the fingerprint of the source code of
+the package, the store is emptied when the implementation changes.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from pathlib import Path
+
+from intcode_computer.channels import Channel
+from intcode_computer.computer import IntcodeComputer
+from intcode_computer.engines import EngineTypes, StopReasons
+from intcode_computer.memory import MemoryTypes, trimmed_memory
+
+# size of the stored entries the store is trimmed to by default
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_CACHE_PATH = Path(os.environ.get('XDG_CACHE_HOME',
+                                         Path.home() / '.cache')) / \
+    'intcode_computer' / 'results.sqlite'
+# stored size of an entry besides its outputs
+_ENTRY_OVERHEAD = 128
+
+CachedResult = namedtuple('CachedResult',
+                          'outputs memory_digest instructions halted cached')
+
+_PACKAGE_FOLDER = Path(__file__).resolve().parent
+# folders of the sources the VM is built from, the buffers rely on the
+# observers of the utils package
+_SOURCE_FOLDERS = (_PACKAGE_FOLDER, _PACKAGE_FOLDER.parent / 'utils')
+_implementation_fingerprint = None
+
+
+def implementation_fingerprint():
+    """Return the hash of the source code of the package and the utils it
+    depends on, it changes with any change of the VM implementation"""
+    global _implementation_fingerprint
+    if _implementation_fingerprint is None:
+        digest = hashlib.sha256()
+        for folder in _SOURCE_FOLDERS:
+            for source in sorted(folder.glob('*.py')):
+                digest.update(('%s/%s' % (folder.name, source.name))
+                              .encode())
+                digest.update(source.read_bytes())
+        _implementation_fingerprint = digest.hexdigest()
+    return _implementation_fingerprint
+
+
+def result_key(program, patches=None, inputs=()):
+    """Return the content hash of the program, the memory patches and the
+    input values"""
+    digest = hashlib.sha256()
+    digest.update(','.join(map(str, program)).encode())
+    digest.update(b'|')
+    digest.update(','.join('%d:%d' % item
+                           for item in sorted((patches or {}).items()))
+                  .encode())
+    digest.update(b'|')
+    digest.update(','.join(map(str, inputs)).encode())
+    return digest.hexdigest()
+
+
+def memory_digest(memory):
+    """Return the hash of the memory content without the trailing zeroes"""
+    return hashlib.sha256(
+        ','.join(map(str, trimmed_memory(memory))).encode()).hexdigest()
+
+
+class ResultCache:
+    """SQLite store of the results keyed by result_key()"""
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    @property
+    def size(self):
+        """Stored size of all the entries in bytes, counted since the store
+        has been opened"""
+        return self._size
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES,
+                 fingerprint=None):
+        """
+        :param path: path of the store, ':memory:' keeps it in the memory
+        :param fingerprint: version of the implementation the entries are
+        valid for, implementation_fingerprint() by default
+        """
+        self._path = str(path)
+        self._max_bytes = max_bytes
+        self._fingerprint = fingerprint if fingerprint is not None \
+            else implementation_fingerprint()
+        self._hits = 0
+        self._misses = 0
+        if self._path != ':memory:':
+            Path(self._path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self._path)
+        self._connection.executescript(
+            'CREATE TABLE IF NOT EXISTS meta '
+            '(name TEXT PRIMARY KEY, value TEXT);'
+            'CREATE TABLE IF NOT EXISTS entries '
+            '(key TEXT PRIMARY KEY, outputs TEXT, memory_digest TEXT, '
+            'instructions INTEGER, halted INTEGER, size INTEGER, '
+            'last_used REAL);'
+            'CREATE INDEX IF NOT EXISTS entries_last_used '
+            'ON entries (last_used);')
+        self._discard_stale_entries()
+        self._size = self._connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def __len__(self):
+        return self._connection.execute(
+            'SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get(self, key):
+        """
+        :return: CachedResult stored under the key, None if there is none
+        """
+        row = self._connection.execute(
+            'SELECT outputs, memory_digest, instructions, halted '
+            'FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        with self._connection:
+            self._connection.execute(
+                'UPDATE entries SET last_used = ? WHERE key = ?',
+                (time.time(), key))
+        outputs, digest, instructions, halted = row
+        return CachedResult(json.loads(outputs), digest, instructions,
+                            bool(halted), True)
+
+    def put(self, key, result):
+        """Store the result and evict the least recently used entries if
+        the store has grown too big"""
+        outputs = json.dumps(result.outputs)
+        size = len(outputs) + _ENTRY_OVERHEAD
+        with self._connection:
+            replaced = self._connection.execute(
+                'SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+            self._connection.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, outputs, result.memory_digest, result.instructions,
+                 int(result.halted), size, time.time()))
+            self._size += size - (replaced[0] if replaced is not None else 0)
+            self._evict()
+
+    def clear(self):
+        with self._connection:
+            self._connection.execute('DELETE FROM entries')
+        self._size = 0
+
+    def close(self):
+        self._connection.close()
+
+    def _evict(self):
+        excess = self.size - self._max_bytes
+        if excess <= 0:
+            return
+        evicted = []
+        for key, size in self._connection.execute(
+                'SELECT key, size FROM entries ORDER BY last_used'):
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size
+            self._size -= size
+        self._connection.executemany('DELETE FROM entries WHERE key = ?',
+                                     evicted)
+
+    def _discard_stale_entries(self):
+        row = self._connection.execute(
+            "SELECT value FROM meta WHERE name = 'implementation'").fetchone()
+        if row is not None and row[0] == self._fingerprint:
+            return
+        with self._connection:
+            self._connection.execute('DELETE FROM entries')
+            self._connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('implementation', ?)",
+                (self._fingerprint,))
+
+
+def run_cached(program, patches=None, inputs=(), cache=None,
+               engine=EngineTypes.FAST.value,
+               memory_type=MemoryTypes.LIST.value):
+    """
+    Run the program with the memory patches and the input values or take
+    its result from the cache
+    :param cache: ResultCache object, the program is always run if None
+    :return: CachedResult, halted is False if the program has requested more
+    input values than given
+    """
+    program = list(program)
+    inputs = tuple(inputs)
+    key = result_key(program, patches, inputs) if cache is not None else None
+    if cache is not None:
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+    computer = IntcodeComputer(program, engine=engine,
+                               memory_type=memory_type)
+    for address, value in (patches or {}).items():
+        computer.memory[address] = value
+    computer.input_channel = Channel(inputs, capacity=None)
+    computer.output_channel = Channel(capacity=None)
+    reason, instructions = computer.run_slice()
+    result = CachedResult(list(computer.output_history),
+                          memory_digest(computer.memory), instructions,
+                          reason is StopReasons.HALTED, False)
+    if cache is not None:
+        cache.put(key, result)
+    return result
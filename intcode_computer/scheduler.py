@@ -0,0 +1,278 @@
+"""Cooperative scheduler running a network of computers in one process.
+Every computer gets its input and output channel and is run in turns for
+an instruction budget or until it blocks on them. The output values are
+moved to the input channels of the connected computers between the turns:
+
+    scheduler = Scheduler()
+    for name, phase in zip('ABCDE', phases):
+        scheduler.add(name, computer.fork(), inputs=[phase])
+    for source, target in zip('ABCDE', 'BCDEA'):
+        scheduler.connect(source, target)
+    scheduler.send('A', [0])
+    scheduler.run()
+"""
+import time
+from collections import namedtuple
+from enum import Enum, unique
+
+from intcode_computer.channels import Channel, DEFAULT_CHANNEL_CAPACITY
+from intcode_computer.engines import StopReasons
+
+# instructions a computer executes in one turn by default
+DEFAULT_BUDGET = 1000
+
+VMStats = namedtuple('VMStats', 'state instructions blocked_time turns')
+
+
+@unique
+class VMStates(Enum):
+    """States of the computers owned by the Scheduler"""
+    READY = 'ready'
+    WAITING_FOR_INPUT = 'waiting_for_input'
+    WAITING_FOR_OUTPUT = 'waiting_for_output'
+    HALTED = 'halted'
+
+
+@unique
+class SchedulerStates(Enum):
+    """Reasons Scheduler.run() returns for"""
+    FINISHED = 'finished'
+    # the computers wait for the input nobody in the network is going to
+    # send, it may be sent from the outside
+    IDLE = 'idle'
+    # some computers can't put their output anywhere
+    DEADLOCK = 'deadlock'
+    MAX_ROUNDS = 'max_rounds'
+
+
+class _ScheduledVM:
+    __slots__ = ('name', 'computer', 'state', 'targets', 'router',
+                 'frame_size', 'routed', 'instructions', 'blocked_time',
+                 'blocked_since', 'turns')
+
+    def __init__(self, name, computer):
+        self.name = name
+        self.computer = computer
+        self.state = VMStates.READY
+        self.targets = []
+        self.router = None
+        self.frame_size = 1
+        # (target, values) tuple returned by the router for the frame the
+        # target had no space for
+        self.routed = None
+        self.instructions = 0
+        self.blocked_time = 0.0
+        self.blocked_since = None
+        self.turns = 0
+
+
+class Scheduler:
+    """Runs the computers round-robin, each of them for the budget of
+    instructions per turn or until it halts, waits for an input value or
+    fills its output channel"""
+    @property
+    def budget(self):
+        return self._budget
+
+    @property
+    def rounds(self):
+        return self._rounds
+
+    @property
+    def names(self):
+        return list(self._vms)
+
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self._budget = budget
+        self._vms = {}
+        self._rounds = 0
+
+    def add(self, name, computer, inputs=(),
+            input_capacity=DEFAULT_CHANNEL_CAPACITY,
+            output_capacity=DEFAULT_CHANNEL_CAPACITY):
+        """
+        Add the computer to the network, its channels are replaced with the
+        ones of the scheduler
+        :param name: hashable name to connect the computer by
+        :param inputs: input values queued for the computer
+        """
+        if name in self._vms:
+            raise ValueError('Computer %r is already scheduled' % (name,))
+        computer.input_channel = Channel(inputs, capacity=input_capacity)
+        computer.output_channel = Channel(capacity=output_capacity)
+        self._vms[name] = _ScheduledVM(name, computer)
+        return computer
+
+    def computer(self, name):
+        return self._vms[name].computer
+
+    def connect(self, source, *targets):
+        """Send every output value of the source computer to the inputs of
+        the target computers. A value is moved once all of the targets have
+        space for it"""
+        vm = self._vms[source]
+        if vm.router is not None:
+            raise ValueError('Outputs of %r are routed already' % (source,))
+        for target in targets:
+            vm.targets.append(self._vms[target].computer.input_channel)
+
+    def route(self, source, router, frame_size=1):
+        """
+        Route the output values of the source computer by the function
+        :param router: function called with the list of frame_size output
+        values, returning the (target, values) tuple with the name of the
+        computer and the values to send to it or None to drop the frame.
+        The router is called once per frame, the values wait for the space
+        in the target channel, run() raises ValueError for more values than
+        the channel can ever hold
+        """
+        vm = self._vms[source]
+        if vm.targets:
+            raise ValueError('Outputs of %r are connected already' %
+                             (source,))
+        vm.router = router
+        vm.frame_size = frame_size
+
+    def send(self, name, values):
+        """Queue the input values for the computer from the outside"""
+        values = list(values)
+        channel = self._vms[name].computer.input_channel
+        if channel.put_many(values) != len(values):
+            raise ValueError('The input channel of %r is full' % (name,))
+
+    def outputs(self, name):
+        """Take the output values of the computer nothing is connected to"""
+        return self._vms[name].computer.output_channel.get_many()
+
+    def state(self, name):
+        return self._vms[name].state
+
+    def reset(self):
+        """Empty the channels and forget the states and the statistics of
+        the computers, so the network runs again once their programs are
+        reloaded. The connections are kept"""
+        self._rounds = 0
+        for vm in self._vms.values():
+            vm.computer.input_channel.values.clear()
+            vm.computer.output_channel.values.clear()
+            vm.state = VMStates.READY
+            vm.routed = None
+            vm.instructions = 0
+            vm.blocked_time = 0.0
+            vm.blocked_since = None
+            vm.turns = 0
+
+    def stats(self):
+        """
+        :return: mapping of the names to the VMStats of the computers, the
+        blocked time includes the current wait
+        """
+        now = time.perf_counter()
+        stats = {}
+        for name, vm in self._vms.items():
+            blocked_time = vm.blocked_time
+            if vm.blocked_since is not None:
+                blocked_time += now - vm.blocked_since
+            stats[name] = VMStats(vm.state, vm.instructions, blocked_time,
+                                  vm.turns)
+        return stats
+
+    def run(self, max_rounds=None):
+        """
+        Run the computers until all of them halt or none of them can move on
+        :param max_rounds: number of the rounds to stop after, every
+        computer gets a turn per round
+        :return: SchedulerStates member
+        """
+        rounds = 0
+        while max_rounds is None or rounds < max_rounds:
+            rounds += 1
+            self._rounds += 1
+            progress = False
+            for vm in self._vms.values():
+                # halted computers may still have undelivered values
+                progress |= self._deliver(vm)
+                if vm.state is not VMStates.HALTED:
+                    progress |= self._turn(vm)
+                    progress |= self._deliver(vm)
+
+            if not progress:
+                states = {vm.state for vm in self._vms.values()}
+                if states <= {VMStates.HALTED}:
+                    return SchedulerStates.FINISHED
+                if VMStates.WAITING_FOR_OUTPUT in states:
+                    return SchedulerStates.DEADLOCK
+                return SchedulerStates.IDLE
+        return SchedulerStates.MAX_ROUNDS
+
+    def _turn(self, vm):
+        """
+        Run the computer for the budget
+        :return: True if it has executed any instruction
+        """
+        reason, executed = vm.computer.run_slice(self._budget)
+        now = time.perf_counter()
+        if executed:
+            vm.turns += 1
+            vm.instructions += executed
+            if vm.blocked_since is not None:
+                vm.blocked_time += now - vm.blocked_since
+                vm.blocked_since = None
+
+        if reason is StopReasons.HALTED:
+            state = VMStates.HALTED
+        elif reason is StopReasons.INPUT_REQUIRED:
+            state = VMStates.WAITING_FOR_INPUT
+        elif reason is StopReasons.OUTPUT_BLOCKED:
+            state = VMStates.WAITING_FOR_OUTPUT
+        else:
+            state = VMStates.READY
+        if state is VMStates.WAITING_FOR_INPUT or \
+                state is VMStates.WAITING_FOR_OUTPUT:
+            if vm.blocked_since is None:
+                vm.blocked_since = now
+        elif vm.blocked_since is not None:
+            vm.blocked_time += now - vm.blocked_since
+            vm.blocked_since = None
+        vm.state = state
+        return executed > 0
+
+    def _deliver(self, vm):
+        """
+        Move the output values of the computer to the connected inputs
+        :return: True if any value has been moved
+        """
+        outputs = vm.computer.output_channel.values
+        moved = False
+        if vm.router is not None:
+            frame_size = vm.frame_size
+            while vm.routed is not None or len(outputs) >= frame_size:
+                if vm.routed is None:
+                    frame = [outputs.popleft() for _ in range(frame_size)]
+                    vm.routed = vm.router(frame)
+                    moved = True
+                    if vm.routed is None:
+                        continue
+                target, values = vm.routed
+                channel = self._vms[target].computer.input_channel
+                if channel.capacity is not None and \
+                        len(values) > channel.capacity:
+                    # the frame would wait for the space forever
+                    raise ValueError(
+                        '%d values routed from %r exceed the input channel '
+                        'capacity of %r' % (len(values), vm.name, target))
+                if channel.free_space is not None and \
+                        channel.free_space < len(values):
+                    break
+                channel.put_many(values)
+                vm.routed = None
+                moved = True
+        elif vm.targets:
+            while outputs:
+                if any(target.full() for target in vm.targets):
+                    break
+                value = outputs.popleft()
+                for target in vm.targets:
+                    target.values.append(value)
+                moved = True
+        return moved
@@ -0,0 +1,580 @@
+"""Symbolic execution of Intcode programs. Chosen memory cells and input
+values are symbols, ADD and MULT instructions build polynomials of them
+instead of numbers. A comparison or a jump depending on a symbol forks the
+execution into two paths, each of them remembers the condition it has
+assumed. The final expression of any cell is then solved for the symbols
+instead of running the program for every combination of them:
+
+    executor = SymbolicExecutor(program, symbolic_cells={1: 'noun',
+                                                         2: 'verb'})
+    ranges = {'noun': range(100), 'verb': range(100)}
+    assignment = next(executor.solve(0, 19690720, ranges))
+"""
+import itertools
+from collections import namedtuple
+
+from intcode_computer.engines import DECODE_TABLE, INSTRUCTION_PARAMETERS
+from intcode_computer.commands import OpCodeExtended
+from intcode_computer.command_parameters import ParameterModes
+
+# paths and executed instructions allowed by default, loops depending on a
+# symbol never end otherwise
+DEFAULT_MAX_PATHS = 256
+DEFAULT_MAX_STEPS = 1000000
+
+_ADD = OpCodeExtended.ADD.value
+_MULT = OpCodeExtended.MULT.value
+_INPUT = OpCodeExtended.INPUT.value
+_OUTPUT = OpCodeExtended.OUTPUT.value
+_JUMP_IF_TRUE = OpCodeExtended.JUMP_IF_TRUE.value
+_JUMP_IF_FALSE = OpCodeExtended.JUMP_IF_FALSE.value
+_LESS_THAN = OpCodeExtended.LESS_THAN.value
+_EQUALS = OpCodeExtended.EQUALS.value
+_ADJUST_REL_BASE = OpCodeExtended.ADJUST_REL_BASE.value
+_TERM = OpCodeExtended.TERM.value
+
+_IMMEDIATE = ParameterModes.IMMEDIATE.value
+_RELATIVE = ParameterModes.RELATIVE.value
+
+# relations of the path constraints: the expression compared with zero
+LESS_THAN_ZERO = '<0'
+NOT_LESS_THAN_ZERO = '>=0'
+EQUALS_ZERO = '==0'
+NOT_EQUALS_ZERO = '!=0'
+
+Constraint = namedtuple('Constraint', 'expression relation')
+
+
+class SymbolicExecutionError(Exception):
+    """Raised when the program can't be executed symbolically, e.g. it
+    writes to an address or jumps to a target depending on a symbol"""
+
+
+class _InvalidAssignment(Exception):
+    """Raised when the expression has no value for the assignment, e.g. it
+    reads a negative address"""
+
+
+class Polynomial:
+    """Polynomial with integer coefficients. The terms map the monomials -
+    frozensets of (variable, power) pairs - to their coefficients, the
+    constant term has the empty monomial. Variables are the names of the
+    symbols or the reads of the memory at an address depending on them"""
+    __slots__ = ('_terms',)
+
+    @property
+    def terms(self):
+        return self._terms
+
+    def __init__(self, terms):
+        self._terms = {monomial: coefficient
+                       for monomial, coefficient in terms.items()
+                       if coefficient}
+
+    @classmethod
+    def symbol(cls, variable):
+        return cls({frozenset(((variable, 1),)): 1})
+
+    @classmethod
+    def of(cls, value):
+        if isinstance(value, Polynomial):
+            return value
+        return cls({frozenset(): value})
+
+    def __add__(self, other):
+        terms = dict(self._terms)
+        for monomial, coefficient in Polynomial.of(other).terms.items():
+            terms[monomial] = terms.get(monomial, 0) + coefficient
+        return Polynomial(terms)
+
+    __radd__ = __add__
+
+    def __neg__(self):
+        return Polynomial({monomial: -coefficient
+                           for monomial, coefficient in self._terms.items()})
+
+    def __sub__(self, other):
+        return self + -Polynomial.of(other)
+
+    def __rsub__(self, other):
+        return Polynomial.of(other) - self
+
+    def __mul__(self, other):
+        terms = {}
+        for left, left_coefficient in self._terms.items():
+            for right, right_coefficient in \
+                    Polynomial.of(other).terms.items():
+                powers = dict(left)
+                for variable, power in right:
+                    powers[variable] = powers.get(variable, 0) + power
+                monomial = frozenset(powers.items())
+                terms[monomial] = terms.get(monomial, 0) + \
+                    left_coefficient * right_coefficient
+        return Polynomial(terms)
+
+    __rmul__ = __mul__
+
+    def __repr__(self):
+        if not self._terms:
+            return '0'
+        terms = []
+        for monomial, coefficient in self._terms.items():
+            factors = ['{}^{}'.format(variable, power) if power > 1
+                       else str(variable)
+                       for variable, power in sorted(monomial, key=str)]
+            if coefficient != 1 or not factors:
+                factors.insert(0, str(coefficient))
+            terms.append('*'.join(factors))
+        return ' + '.join(sorted(terms, key=len))
+
+    def is_constant(self):
+        return all(not monomial for monomial in self._terms)
+
+    def constant(self):
+        return self._terms.get(frozenset(), 0)
+
+    def variables(self):
+        return {variable for monomial in self._terms
+                for variable, _ in monomial}
+
+    def symbols(self):
+        """Names of the symbols the polynomial depends on, including the
+        symbols of the memory reads"""
+        names = set()
+        for variable in self.variables():
+            if isinstance(variable, MemoryRead):
+                names |= variable.symbols()
+            else:
+                names.add(variable)
+        return names
+
+    def split(self, symbol):
+        """
+        Split the polynomial linear in the symbol into the coefficient of the
+        symbol and the rest
+        :return: (coefficient, rest) tuple of the polynomials, None if the
+        polynomial is not linear in the symbol
+        """
+        coefficient, rest = {}, {}
+        for monomial, value in self._terms.items():
+            powers = dict(monomial)
+            power = powers.pop(symbol, 0)
+            if power > 1:
+                return None
+            if any(isinstance(variable, MemoryRead) and
+                   symbol in variable.symbols() for variable in powers):
+                return None
+            target = coefficient if power else rest
+            target[frozenset(powers.items())] = value
+        return Polynomial(coefficient), Polynomial(rest)
+
+    def evaluate(self, assignment):
+        """
+        :param assignment: mapping of the names of the symbols to the values
+        :return: value of the polynomial
+        """
+        result = 0
+        for monomial, coefficient in self._terms.items():
+            for variable, power in monomial:
+                if isinstance(variable, MemoryRead):
+                    value = variable.evaluate(assignment)
+                else:
+                    value = assignment[variable]
+                coefficient *= value ** power
+            result += coefficient
+        return result
+
+
+def _simplify(value):
+    """Return the constant polynomials as numbers"""
+    if isinstance(value, Polynomial) and value.is_constant():
+        return value.constant()
+    return value
+
+
+def evaluate(value, assignment):
+    if isinstance(value, Polynomial):
+        return value.evaluate(assignment)
+    return value
+
+
+class MemoryRead:
+    """Value read from the memory at the address depending on the symbols.
+    The memory is kept as it was at the moment of the read and looked up
+    only once the address is known"""
+    __slots__ = ('_address', '_memory', '_symbols')
+
+    @property
+    def address(self):
+        return self._address
+
+    def __init__(self, address, memory):
+        self._address = address
+        self._memory = memory
+        self._symbols = None
+
+    def __repr__(self):
+        return 'mem[{}]'.format(self._address)
+
+    def symbols(self):
+        if self._symbols is None:
+            names = self._address.symbols()
+            for value in self._memory:
+                if isinstance(value, Polynomial):
+                    names |= value.symbols()
+            self._symbols = names
+        return self._symbols
+
+    def evaluate(self, assignment):
+        address = self._address.evaluate(assignment)
+        if address < 0:
+            raise _InvalidAssignment(address)
+        if address >= len(self._memory):
+            return 0
+        return evaluate(self._memory[address], assignment)
+
+
+class SymbolicPath:
+    """One path of the execution: the final state of the machine and the
+    constraints the symbols have to satisfy to take it"""
+    @property
+    def memory(self):
+        """List of the cells, either numbers or Polynomial objects"""
+        return self._memory
+
+    @property
+    def outputs(self):
+        return self._outputs
+
+    @property
+    def constraints(self):
+        return self._constraints
+
+    @property
+    def halted(self):
+        return self._halted
+
+    @property
+    def blocked(self):
+        """True if the program has requested more input values than given"""
+        return self._blocked
+
+    @property
+    def command_pointer(self):
+        return self._pointer
+
+    @property
+    def relative_base(self):
+        return self._relative_base
+
+    def __init__(self, memory, pointer=0, relative_base=0, input_index=0,
+                 outputs=None, constraints=None):
+        self._memory = memory
+        self._pointer = pointer
+        self._relative_base = relative_base
+        self._input_index = input_index
+        self._outputs = outputs if outputs is not None else []
+        self._constraints = constraints if constraints is not None else []
+        self._halted = False
+        self._blocked = False
+
+    def expression(self, address):
+        """
+        :return: final value of the cell, a number or a Polynomial
+        """
+        if address < len(self._memory):
+            return self._memory[address]
+        return 0
+
+    def satisfied(self, assignment):
+        """Check whether the assignment of the symbols takes this path"""
+        try:
+            for expression, relation in self._constraints:
+                value = expression.evaluate(assignment)
+                if relation == LESS_THAN_ZERO:
+                    holds = value < 0
+                elif relation == NOT_LESS_THAN_ZERO:
+                    holds = value >= 0
+                elif relation == EQUALS_ZERO:
+                    holds = value == 0
+                else:
+                    holds = value != 0
+                if not holds:
+                    return False
+        except _InvalidAssignment:
+            return False
+        return True
+
+    def _fork(self, constraint):
+        return SymbolicPath(list(self._memory), self._pointer,
+                            self._relative_base, self._input_index,
+                            list(self._outputs),
+                            self._constraints + [constraint])
+
+
+class SymbolicExecutor:
+    """Executes the program with the symbolic cells and inputs on every path
+    the symbols may take it"""
+    @property
+    def steps(self):
+        return self._steps
+
+    def __init__(self, program, symbolic_cells=None, inputs=(),
+                 max_paths=DEFAULT_MAX_PATHS, max_steps=DEFAULT_MAX_STEPS):
+        """
+        :param symbolic_cells: mapping of the addresses to the names of the
+        symbols stored there
+        :param inputs: input values, numbers or the names of the symbols
+        """
+        memory = list(program)
+        for address, name in (symbolic_cells or {}).items():
+            if address >= len(memory):
+                memory.extend([0] * (address + 1 - len(memory)))
+            memory[address] = Polynomial.symbol(name)
+        self._initial_memory = memory
+        self._inputs = [Polynomial.symbol(value) if isinstance(value, str)
+                        else value for value in inputs]
+        self._max_paths = max_paths
+        self._max_steps = max_steps
+        self._paths = None
+        self._steps = 0
+
+    def run(self):
+        """
+        Execute every path of the program
+        :return: list of the SymbolicPath objects
+        """
+        if self._paths is not None:
+            return self._paths
+        pending = [SymbolicPath(list(self._initial_memory))]
+        paths = []
+        while pending:
+            path = pending.pop()
+            while True:
+                forked = self._step(path)
+                if forked is not None:
+                    if len(paths) + len(pending) + 2 > self._max_paths:
+                        raise SymbolicExecutionError(
+                            'Too many paths, the limit is {}'.format(
+                                self._max_paths))
+                    pending.append(forked)
+                if path.halted or path.blocked:
+                    break
+            paths.append(path)
+        self._paths = paths
+        return paths
+
+    def expressions(self, address):
+        """
+        :return: list of (path, expression) tuples with the final value of
+        the cell on every halted path
+        """
+        return [(path, path.expression(address)) for path in self.run()
+                if path.halted]
+
+    def solve(self, address, target, ranges):
+        """
+        Find the values of the symbols for which the program halts with the
+        target value in the cell. The last symbol is solved for if the
+        expression is linear in it, the other ones are enumerated
+        :param ranges: mapping of the names of the symbols to the ranges of
+        their values, the assignments are enumerated in this order
+        :return: generator of the assignments, dicts of the symbol values
+        """
+        names = list(ranges)
+        candidates = [(path, Polynomial.of(expression) - target)
+                      for path, expression in self.expressions(address)]
+        solvable = {}
+        if names:
+            for index, (path, difference) in enumerate(candidates):
+                solvable[index] = difference.split(names[-1])
+
+        outer = [ranges[name] for name in names[:-1]]
+        for values in itertools.product(*outer):
+            assignment = dict(zip(names, values))
+            for last in self._last_values(names, ranges, candidates,
+                                          solvable, assignment):
+                if names:
+                    assignment[names[-1]] = last
+                for path, difference in candidates:
+                    try:
+                        if difference.evaluate(assignment) == 0 and \
+                                path.satisfied(assignment):
+                            yield dict(assignment)
+                            break
+                    except (_InvalidAssignment, KeyError):
+                        continue
+
+    @staticmethod
+    def _last_values(names, ranges, candidates, solvable, assignment):
+        """Values of the last symbol worth checking for the assignment of the
+        other symbols, in the order of its range"""
+        if not names:
+            yield None
+            return
+        last_range = ranges[names[-1]]
+        values = set()
+        for index in range(len(candidates)):
+            split = solvable[index]
+            if split is None:
+                # no shortcut, every value has to be checked
+                yield from last_range
+                return
+            try:
+                coefficient = split[0].evaluate(assignment)
+                rest = split[1].evaluate(assignment)
+            except (_InvalidAssignment, KeyError):
+                continue
+            if coefficient == 0:
+                if rest == 0:
+                    yield from last_range
+                    return
+            elif rest % coefficient == 0 and -rest // coefficient in \
+                    last_range:
+                values.add(-rest // coefficient)
+        for value in last_range:
+            if value in values:
+                yield value
+
+    def _step(self, path):
+        """
+        Execute one instruction of the path
+        :return: the forked path if the instruction depends on a symbol
+        """
+        self._steps += 1
+        if self._steps > self._max_steps:
+            raise SymbolicExecutionError('Too many steps, the limit is {}'
+                                         .format(self._max_steps))
+        pointer = path._pointer
+        extended_opcode = self._read_cell(path, pointer)
+        if isinstance(extended_opcode, Polynomial):
+            raise SymbolicExecutionError(
+                'Opcode at {} depends on the symbols'.format(pointer))
+        decoded = DECODE_TABLE.get(extended_opcode)
+        if decoded is None:
+            if int(str(extended_opcode)[-2:]) == _TERM:
+                path._halted = True
+                return None
+            raise SymbolicExecutionError('Malformed instruction {} at {}'
+                                         .format(extended_opcode, pointer))
+        op_code = decoded[0]
+        if op_code == _TERM:
+            path._halted = True
+            return None
+        length = len(INSTRUCTION_PARAMETERS[op_code]) + 1
+
+        if op_code in (_ADD, _MULT, _LESS_THAN, _EQUALS):
+            left = self._read(path, 1, decoded[1])
+            right = self._read(path, 2, decoded[2])
+            if op_code == _ADD:
+                result = _simplify(Polynomial.of(left) + right) \
+                    if isinstance(left, Polynomial) or \
+                    isinstance(right, Polynomial) else left + right
+            elif op_code == _MULT:
+                result = _simplify(Polynomial.of(left) * right) \
+                    if isinstance(left, Polynomial) or \
+                    isinstance(right, Polynomial) else left * right
+            else:
+                difference = _simplify(Polynomial.of(left) - right)
+                if not isinstance(difference, Polynomial):
+                    holds = difference < 0 if op_code == _LESS_THAN \
+                        else difference == 0
+                    self._write(path, 3, decoded[3], int(holds))
+                    path._pointer += length
+                    return None
+                relations = (LESS_THAN_ZERO, NOT_LESS_THAN_ZERO) \
+                    if op_code == _LESS_THAN \
+                    else (EQUALS_ZERO, NOT_EQUALS_ZERO)
+                forked = path._fork(Constraint(difference, relations[1]))
+                path._constraints.append(Constraint(difference, relations[0]))
+                self._write(forked, 3, decoded[3], 0)
+                self._write(path, 3, decoded[3], 1)
+                forked._pointer += length
+                path._pointer += length
+                return forked
+            self._write(path, 3, decoded[3], result)
+            path._pointer += length
+        elif op_code == _INPUT:
+            if path._input_index == len(self._inputs):
+                path._blocked = True
+                return None
+            self._write(path, 1, decoded[1], self._inputs[path._input_index])
+            path._input_index += 1
+            path._pointer += length
+        elif op_code == _OUTPUT:
+            path._outputs.append(self._read(path, 1, decoded[1]))
+            path._pointer += length
+        elif op_code == _ADJUST_REL_BASE:
+            value = self._read(path, 1, decoded[1])
+            if isinstance(value, Polynomial):
+                raise SymbolicExecutionError(
+                    'Relative base at {} depends on the symbols'.format(
+                        pointer))
+            path._relative_base += value
+            path._pointer += length
+        else:
+            condition = self._read(path, 1, decoded[1])
+            if isinstance(condition, Polynomial):
+                taken_relation, skipped_relation = \
+                    (NOT_EQUALS_ZERO, EQUALS_ZERO) \
+                    if op_code == _JUMP_IF_TRUE \
+                    else (EQUALS_ZERO, NOT_EQUALS_ZERO)
+                forked = path._fork(Constraint(condition, skipped_relation))
+                forked._pointer += length
+                path._constraints.append(Constraint(condition,
+                                                    taken_relation))
+                self._jump(path, decoded, length)
+                return forked
+            taken = condition != 0 if op_code == _JUMP_IF_TRUE \
+                else condition == 0
+            if taken:
+                self._jump(path, decoded, length)
+            else:
+                path._pointer += length
+        return None
+
+    def _jump(self, path, decoded, length):
+        target = self._read(path, 2, decoded[2])
+        if isinstance(target, Polynomial):
+            raise SymbolicExecutionError(
+                'Jump target at {} depends on the symbols'.format(
+                    path._pointer))
+        # a jump to the jump itself moves to the next instruction
+        path._pointer = target if target != path._pointer \
+            else path._pointer + length
+
+    @staticmethod
+    def _read_cell(path, address):
+        if address < 0:
+            raise SymbolicExecutionError('Negative address {}'.format(
+                address))
+        if address >= len(path._memory):
+            return 0
+        return path._memory[address]
+
+    def _address(self, path, parameter, mode):
+        address = self._read_cell(path, path._pointer + parameter)
+        if mode == _RELATIVE:
+            address = _simplify(Polynomial.of(address) + path._relative_base)
+        return address
+
+    def _read(self, path, parameter, mode):
+        if mode == _IMMEDIATE:
+            return self._read_cell(path, path._pointer + parameter)
+        address = self._address(path, parameter, mode)
+        if isinstance(address, Polynomial):
+            return Polynomial.symbol(MemoryRead(address, tuple(path._memory)))
+        return self._read_cell(path, address)
+
+    def _write(self, path, parameter, mode, value):
+        address = self._address(path, parameter, mode)
+        if isinstance(address, Polynomial):
+            raise SymbolicExecutionError('Write to the address {}'.format(
+                address))
+        if address < 0:
+            raise SymbolicExecutionError('Negative address {}'.format(
+                address))
+        memory = path._memory
+        if address >= len(memory):
+            memory.extend([0] * (address + 1 - len(memory)))
+        memory[address] = value
@@ -0,0 +1,215 @@
+"""Binary execution trace of the IntcodeComputer. Tracing is switched on per
+computer with enable_tracing(), run_program() then executes the program
+with the instrumented loop of the engines module and stores a fixed size
+record of 64 bit integers per executed instruction into a preallocated ring
+buffer, so only the latest records are kept:
+
+    trace = computer.enable_tracing(capacity=1000000)
+    computer.run_program()
+    trace.dump('run.trace')
+    print(read_trace('run.trace').summary())
+"""
+import struct
+import sys
+import time
+from array import array
+from collections import namedtuple, Counter
+
+from intcode_computer.commands import OpCodeExtended
+from intcode_computer.engines import run_instrumented_engine
+from intcode_computer.program_image import BIG_CELL
+
+# records kept by the ring buffer by default
+DEFAULT_TRACE_CAPACITY = 1 << 20
+# stored in place of the fields the instruction doesn't have and of the
+# values which don't fit into 64 bits
+MISSING = BIG_CELL
+
+TraceRecord = namedtuple('TraceRecord', 'address opcode relative_base '
+                                        'operand_1 operand_2 write_address '
+                                        'write_value')
+RECORD_FIELDS = len(TraceRecord._fields)
+
+# magic, byte order, number of the fields per record, number of the
+# records in the file and number of the records ever traced
+_HEADER = struct.Struct('<8scBQQ')
+_MAGIC = b'ICTRACE1'
+_BYTE_ORDERS = {'little': b'<', 'big': b'>'}
+
+
+def _clip(value):
+    return value if -2 ** 63 < value < 2 ** 63 else MISSING
+
+
+def _records(cells):
+    for start in range(0, len(cells), RECORD_FIELDS):
+        yield TraceRecord(*cells[start:start + RECORD_FIELDS])
+
+
+def summarize(records, top=10):
+    """
+    :param records: iterable of the TraceRecord objects
+    :param top: number of the hottest addresses to report
+    :return: dict with the number of the records, the counts of the op_codes,
+    the hottest addresses and the number of the memory writes
+    """
+    op_codes = Counter()
+    addresses = Counter()
+    writes = 0
+    count = 0
+    for record in records:
+        count += 1
+        op_codes[int(str(record.opcode)[-2:])] += 1
+        addresses[record.address] += 1
+        if record.write_address != MISSING:
+            writes += 1
+    return {
+        'records': count,
+        'op_codes': {OpCodeExtended(op_code).name
+                     if op_code in OpCodeExtended._value2member_map_
+                     else str(op_code): total
+                     for op_code, total in op_codes.most_common()},
+        'hottest_addresses': addresses.most_common(top),
+        'writes': writes,
+    }
+
+
+class TraceRecorder:
+    """Ring buffer of the trace records kept in one array of signed 64 bit
+    integers"""
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def total(self):
+        """Number of the records ever traced, including the overwritten
+        ones"""
+        return self._total
+
+    @property
+    def wall_time(self):
+        return self._wall_time
+
+    def __init__(self, capacity=DEFAULT_TRACE_CAPACITY):
+        if capacity < 1:
+            raise ValueError('The trace should keep at least one record')
+        self._capacity = capacity
+        self._cells = array('q', bytes(8 * RECORD_FIELDS * capacity))
+        # index of the cell the next record starts at
+        self._position = 0
+        self._total = 0
+        self._wall_time = 0.0
+
+    def __len__(self):
+        return min(self._total, self._capacity)
+
+    def records(self):
+        """
+        :return: generator of the TraceRecord objects kept, the oldest one
+        first
+        """
+        return _records(self._ordered_cells())
+
+    def summary(self, top=10):
+        summary = summarize(self.records(), top)
+        summary['total'] = self._total
+        return summary
+
+    def dump(self, path):
+        """Write the kept records to the file, the oldest one first"""
+        cells = self._ordered_cells()
+        with open(path, 'wb') as trace_file:
+            trace_file.write(_HEADER.pack(
+                _MAGIC, _BYTE_ORDERS[sys.byteorder], RECORD_FIELDS,
+                len(self), self._total))
+            cells.tofile(trace_file)
+
+    def clear(self):
+        self._position = 0
+        self._total = 0
+
+    def _ordered_cells(self):
+        cells = self._cells
+        if self._total < self._capacity:
+            return cells[:self._position]
+        return cells[self._position:] + cells[:self._position]
+
+
+class TraceFile:
+    """Trace read back from the file written by TraceRecorder.dump()"""
+    @property
+    def total(self):
+        return self._total
+
+    def __init__(self, cells, total):
+        self._cells = cells
+        self._total = total
+
+    def __len__(self):
+        return len(self._cells) // RECORD_FIELDS
+
+    def records(self):
+        return _records(self._cells)
+
+    def summary(self, top=10):
+        summary = summarize(self.records(), top)
+        summary['total'] = self._total
+        return summary
+
+
+def read_trace(path):
+    """
+    Read the trace written by TraceRecorder.dump()
+    :return: TraceFile object
+    """
+    with open(path, 'rb') as trace_file:
+        magic, byte_order, fields, count, total = _HEADER.unpack(
+            trace_file.read(_HEADER.size))
+        if magic != _MAGIC or fields != RECORD_FIELDS:
+            raise ValueError('%s is not an Intcode trace' % path)
+        cells = array('q')
+        cells.fromfile(trace_file, count * RECORD_FIELDS)
+    if byte_order != _BYTE_ORDERS[sys.byteorder]:
+        cells.byteswap()
+    return TraceFile(cells, total)
+
+
+def run_traced_engine(computer, recorder):
+    """
+    Execute the program loaded into the computer with
+    run_instrumented_engine() storing a trace record per executed
+    instruction. Instructions the decode table doesn't know about are
+    traced without their operands
+    """
+    cells = recorder._cells
+    size = len(cells)
+    # position of the next record, number of the traced records
+    counters = [recorder._position, 0]
+
+    def record(address, extended_opcode, relative_base, read_1, operand_1,
+               read_2, operand_2, write_address, write_value):
+        position = counters[0]
+        try:
+            cells[position] = address
+            cells[position + 1] = extended_opcode
+            cells[position + 2] = relative_base
+            cells[position + 3] = operand_1
+            cells[position + 4] = operand_2
+            cells[position + 5] = write_address
+            cells[position + 6] = write_value
+        except OverflowError:
+            cells[position:position + RECORD_FIELDS] = array('q', map(
+                _clip, (address, extended_opcode, relative_base,
+                        operand_1, operand_2, write_address, write_value)))
+        position += RECORD_FIELDS
+        counters[0] = position if position != size else 0
+        counters[1] += 1
+
+    started = time.perf_counter()
+    try:
+        run_instrumented_engine(computer, record, missing=MISSING)
+    finally:
+        recorder._position = counters[0]
+        recorder._total += counters[1]
+        recorder._wall_time += time.perf_counter() - started
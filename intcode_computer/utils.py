@@ -1,7 +1,15 @@
+from intcode_computer.program_image import load_program_image, \
+    parse_program_text
+
+
 def parse_program(puzzle_input_file):
-    """Parse the list of values from the input file"""
-    sequence = []
-    with open(puzzle_input_file, 'r') as puzzle_input:
-        for line in puzzle_input:
-            sequence.extend([int(x) for x in line.split(',')])
-    return sequence
+    """Parse the list of values from the input file. The program is read
+    from its compiled image cached next to the file, see
+    load_program_image(), the text is parsed if the cache can't be written
+    or read"""
+    try:
+        # only the cells are read, the image needs no working memory
+        with load_program_image(puzzle_input_file, reserved=0) as image:
+            return image.cells()
+    except (OSError, ValueError, EOFError):
+        return parse_program_text(puzzle_input_file)
@@ -1,3 +1,68 @@
+import weakref
+
+
+def _supports_weak_references(subscriber):
+    """Check if the subscriber can be the key of a WeakKeyDictionary"""
+    try:
+        weakref.ref(subscriber)
+        hash(subscriber)
+    except TypeError:
+        return False
+    return True
+
+
+class _Subscription:
+    """Delivery of the values to one subscriber: single values, records of
+    record_width values or lists of flush_size records"""
+    __slots__ = ('_subscriber', '_callback', '_record_width', '_flush_size',
+                 '_record', '_batch')
+
+    def __init__(self, subscriber, callback, record_width, flush_size,
+                 weak):
+        if weak:
+            # the bound method would keep the subscriber alive
+            self._subscriber = None
+            self._callback = weakref.WeakMethod(callback)
+        else:
+            # the id of the subscriber stays unique while it is subscribed
+            self._subscriber = subscriber
+            self._callback = lambda: callback
+        self._record_width = record_width
+        self._flush_size = flush_size
+        self._record = []
+        self._batch = []
+
+    def push(self, value):
+        if self._record_width == 1:
+            record = value
+        else:
+            self._record.append(value)
+            if len(self._record) < self._record_width:
+                return
+            record = tuple(self._record)
+            self._record.clear()
+
+        if self._flush_size is None:
+            self._deliver(record)
+            return
+        self._batch.append(record)
+        if len(self._batch) >= self._flush_size:
+            self.flush()
+
+    def flush(self):
+        """Deliver the records batched so far, the incomplete record stays
+        until the rest of its values arrive"""
+        if self._batch:
+            batch = self._batch
+            self._batch = []
+            self._deliver(batch)
+
+    def _deliver(self, payload):
+        callback = self._callback()
+        if callback is not None:
+            callback(payload)
+
+
 class Observable:
     @property
     def value(self):
@@ -10,28 +75,72 @@ class Observable:
 
     @property
     def subscribers(self):
-        return self._subscribers
+        """List of the subscriptions, the strong ones first"""
+        return list(self._subscribers.values()) + \
+            list(self._weak_subscribers.values())
 
     def __init__(self, value):
         self._value = value
+        # id -> subscription of the subscribers held strongly
         self._subscribers = {}
+        # subscriber -> subscription, dropped with the subscriber
+        self._weak_subscribers = weakref.WeakKeyDictionary()
 
-    def subscribe(self, subscriber, subscriber_callback):
-        subscriber_id = id(subscriber)
-        if subscriber_id not in self._subscribers.keys():
-            self._subscribers[id(subscriber)] = subscriber_callback
+    def subscribe(self, subscriber, subscriber_callback, record_width=1,
+                  flush_size=None, weak=None):
+        """
+        Call the callback with the new values
+        :param record_width: number of the subsequent values the callback
+        gets at once as a tuple
+        :param flush_size: number of the values or records the callback gets
+        at once as a list, the rest of them is delivered by flush()
+        :param weak: hold the subscriber by a weak reference, so the
+        subscription ends once it is garbage collected. The callback should be
+        a method of the subscriber then, any other callable could keep the
+        subscriber alive. None holds it weakly whenever that's possible
+        """
+        weak_method = getattr(subscriber_callback, '__self__', None) \
+            is subscriber
+        supported = weak_method and _supports_weak_references(subscriber)
+        if weak and not supported:
+            raise ValueError('Only the methods of the subscribers supporting '
+                             'the weak references can be held weakly')
+        if weak is None:
+            weak = supported
+        if self._is_subscribed(subscriber):
+            return
+        subscription = _Subscription(subscriber, subscriber_callback,
+                                     record_width, flush_size, weak)
+        if weak:
+            self._weak_subscribers[subscriber] = subscription
+        else:
+            self._subscribers[id(subscriber)] = subscription
 
     def unsubscribe(self, subscriber):
-        self._subscribers.pop(id(subscriber))
+        if self._subscribers.pop(id(subscriber), None) is None:
+            del self._weak_subscribers[subscriber]
 
     def notify_subscribers(self, new_value):
-        for subscriber_callback in self._subscribers.values():
-            subscriber_callback(new_value)
+        # the callbacks may unsubscribe, the collector may drop the weak ones
+        for subscription in self.subscribers:
+            subscription.push(new_value)
+
+    def flush(self):
+        """Deliver the batches of the subscriptions with the flush_size"""
+        for subscription in self.subscribers:
+            subscription.flush()
+
+    def _is_subscribed(self, subscriber):
+        if id(subscriber) in self._subscribers:
+            return True
+        return _supports_weak_references(subscriber) and \
+            subscriber in self._weak_subscribers
 
 
 class ObserverMixin:
-    def subscribe(self, observable, callback):
-        observable.subscribe(self, callback)
+    def subscribe(self, observable, callback, record_width=1,
+                  flush_size=None, weak=None):
+        observable.subscribe(self, callback, record_width, flush_size, weak)
 
     def unsubscribe(self, observable):
-        observable.unsubscribe(self)
\ No newline at end of file
+        observable.unsubscribe(self)